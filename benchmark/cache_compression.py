@@ -0,0 +1,147 @@
+# Copyright (C) 2025  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""
+Compare the disk footprint and read latency of the blob and metadata caches,
+without compression, with zstd, and with zstd and a dictionary trained on the
+cached values (of at most 16 KiB, as ``swh fs train-dictionary`` does).
+
+Usage::
+
+    python benchmark/cache_compression.py [source directory]
+
+Files of the source directory (this repository by default) are cached as blobs,
+and the listing of each of its sub-directories as metadata. Each cache is
+written to a temporary database, closed, then read again from a new connection:
+the reported latency is the mean duration of ``get`` calls.
+"""
+
+import asyncio
+import hashlib
+import os
+from pathlib import Path
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple
+
+from swh.fuse.cache import BlobCache, MetadataCache
+from swh.fuse.compression import DEFAULT_DICTIONARY_SIZE, train_dictionary
+from swh.model.swhids import CoreSWHID, ObjectType
+
+MAX_SAMPLE_SIZE = 16_384
+
+
+def sha1(data: bytes) -> bytes:
+    return hashlib.sha1(data).digest()
+
+
+def collect(root: Path) -> Tuple[Dict[CoreSWHID, bytes], Dict[CoreSWHID, Any]]:
+    """Return the blobs and directory listings found below ``root``"""
+    blobs = {}
+    listings = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames if not name.startswith(".")]
+        dir_id = sha1(dirpath.encode())
+        listing: List[Dict[str, Any]] = []
+        for name in filenames:
+            data = (Path(dirpath) / name).read_bytes()
+            swhid = CoreSWHID(object_type=ObjectType.CONTENT, object_id=sha1(data))
+            blobs[swhid] = data
+            listing.append(
+                {
+                    "dir_id": dir_id.hex(),
+                    "type": "file",
+                    "target": swhid.object_id.hex(),
+                    "name": name,
+                    "perms": 0o100644,
+                    "length": len(data),
+                    "target_url": "https://archive.softwareheritage.org/api/1/"
+                    f"content/sha1_git:{swhid.object_id.hex()}/",
+                }
+            )
+        for name in dirnames:
+            target = sha1(os.path.join(dirpath, name).encode()).hex()
+            listing.append(
+                {
+                    "dir_id": dir_id.hex(),
+                    "type": "dir",
+                    "target": target,
+                    "name": name,
+                    "perms": 0o040000,
+                    "length": None,
+                    "target_url": "https://archive.softwareheritage.org/api/1/"
+                    f"directory/{target}/",
+                }
+            )
+        listings[CoreSWHID(object_type=ObjectType.DIRECTORY, object_id=dir_id)] = (
+            listing
+        )
+    return blobs, listings
+
+
+async def measure(
+    cache_cls, conf: Dict[str, Any], values: Dict[CoreSWHID, Any]
+) -> Tuple[int, float]:
+    """Return the database size and the mean read latency (in seconds)"""
+    cache = await cache_cls(conf).__aenter__()
+    for swhid, value in values.items():
+        await cache.set(swhid, value)
+    await cache.__aexit__()
+
+    cache = await cache_cls(conf).__aenter__()
+    begin = time.perf_counter()
+    for swhid in values:
+        await cache.get(swhid)
+    latency = (time.perf_counter() - begin) / len(values)
+    await cache.__aexit__()
+    return os.path.getsize(conf["path"]), latency
+
+
+async def main(root: Path) -> None:
+    blobs, listings = collect(root)
+    print(f"{len(blobs)} blobs, {len(listings)} directories in {root}")
+    for cache_cls, values, samples in (
+        (BlobCache, blobs, list(blobs.values())),
+        (
+            MetadataCache,
+            listings,
+            [MetadataCache._row(s, v)[1].encode() for s, v in listings.items()],
+        ),
+    ):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dictionary_path = os.path.join(tmpdir, "dictionary")
+            samples = [sample for sample in samples if len(sample) <= MAX_SAMPLE_SIZE]
+            # zstd needs samples about 10 times larger than the dictionary
+            size = min(DEFAULT_DICTIONARY_SIZE, sum(map(len, samples)) // 10)
+            compression: Dict[str, Dict[str, Any]] = {
+                "none": {},
+                "zstd": {"compression": "zstd"},
+            }
+            try:
+                Path(dictionary_path).write_bytes(train_dictionary(samples, size))
+                compression["zstd + dictionary"] = {
+                    "compression": "zstd",
+                    "compression-dictionary": dictionary_path,
+                }
+            except ValueError as e:
+                print(f"{cache_cls.__name__}: cannot train a dictionary ({e})")
+            for i, (name, options) in enumerate(compression.items()):
+                conf = {
+                    "path": os.path.join(tmpdir, f"{i}.sqlite"),
+                    "lru-maxram": "0B",
+                    **options,
+                }
+                size, latency = await measure(cache_cls, conf, values)
+                print(
+                    f"{cache_cls.__name__}, {name}: {size / 2**10:.0f} KiB, "
+                    f"{latency * 1e6:.0f} µs/read"
+                )
+
+
+if __name__ == "__main__":
+    asyncio.run(
+        main(Path(sys.argv[1]) if len(sys.argv) > 1 else Path(__file__).parent.parent)
+    )
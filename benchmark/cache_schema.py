@@ -0,0 +1,86 @@
+# Copyright (C) 2025  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""
+Compare the size and lookup latency of a metadata cache with the version 1 schema
+(keyed by SWHIDs as text) and once migrated to the current schema.
+
+Usage::
+
+    python benchmark/cache_schema.py [number of objects]
+
+The version 1 database is filled with small directory listings, then migrated
+by opening it with :py:class:`swh.fuse.cache.MetadataCache`. Both are vacuumed
+before measuring, and looked up by random SWHIDs with a single connection.
+"""
+
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from typing import Callable, List
+
+from swh.fuse.cache import MetadataCache, swhid_key
+from swh.model.swhids import CoreSWHID, ObjectType
+
+LOOKUPS = 100_000
+
+
+def swhids(count: int) -> List[CoreSWHID]:
+    return [
+        CoreSWHID(object_type=ObjectType.DIRECTORY, object_id=random.randbytes(20))
+        for _ in range(count)
+    ]
+
+
+def measure(path: str, keys: list, key: Callable) -> None:
+    conn = sqlite3.connect(path)
+    conn.execute("vacuum")
+    begin = time.perf_counter()
+    for swhid in keys:
+        conn.execute(
+            "select metadata from metadata_cache where swhid = ?", (key(swhid),)
+        ).fetchone()
+    latency = (time.perf_counter() - begin) / len(keys)
+    conn.close()
+    print(f"  {os.path.getsize(path) / 2**20:.1f} MiB, {latency * 1e6:.1f} µs/lookup")
+
+
+def main(count: int) -> None:
+    objects = swhids(count)
+    listing = json.dumps([{"name": "README", "type": "file", "length": 42}])
+    lookups = random.choices(objects, k=LOOKUPS)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "metadata.sqlite")
+        conn = sqlite3.connect(path)
+        conn.execute(
+            "create table metadata_cache "
+            "(swhid text not null primary key, metadata blob, date text)"
+        )
+        conn.executemany(
+            "insert into metadata_cache values (?, ?, '')",
+            ((str(swhid), listing) for swhid in objects),
+        )
+        conn.commit()
+        conn.close()
+        print(f"{count} objects, version 1 schema:")
+        measure(path, lookups, str)
+
+        begin = time.monotonic()
+
+        async def migrate() -> None:
+            await (await MetadataCache({"path": path}).__aenter__()).__aexit__()
+
+        asyncio.run(migrate())
+        print(f"migrated in {time.monotonic() - begin:.1f} s, version 2 schema:")
+        measure(path, lookups, swhid_key)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
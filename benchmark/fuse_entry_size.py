@@ -0,0 +1,93 @@
+# Copyright (C) 2025  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""
+Measure how many bytes of memory each ``FuseEntry`` retains once created from a
+directory listing, including its slot in the inode table.
+
+Usage::
+
+    python benchmark/fuse_entry_size.py [number of entries]
+
+Entries are ``Content`` files as created by ``Directory.create_entry``, spread
+over directories sharing 1000 distinct file names. The listing metadata is
+freed before measuring, so only what entries keep is counted.
+"""
+
+import asyncio
+import itertools
+import logging
+import sys
+import tracemalloc
+from typing import Any, Dict, List
+
+from swh.fuse.fs.artifact import Directory
+from swh.fuse.fs.entry import EntryMode, FuseEntry
+from swh.model.swhids import CoreSWHID, ObjectType
+
+DISTINCT_NAMES = 1000
+
+
+class InodeTable:
+    """The parts of :py:class:`swh.fuse.fuse.Fuse` needed to create entries"""
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self._inode2entry: Dict[int, FuseEntry] = {}
+        self._next_inode = itertools.count(1)
+
+    def _alloc_inode(self, entry: FuseEntry) -> int:
+        inode = next(self._next_inode)
+        self._inode2entry[inode] = entry
+        return inode
+
+
+def listing(start: int, count: int) -> List[Dict[str, Any]]:
+    """Directory entries, as typified by the metadata cache"""
+    return [
+        {
+            "dir_id": "0" * 40,
+            "type": "file",
+            "target": CoreSWHID(
+                object_type=ObjectType.CONTENT, object_id=i.to_bytes(20, "big")
+            ),
+            # a new string object per entry, as when decoded from JSON
+            "name": "".join(["file", str(i % DISTINCT_NAMES), ".py"]),
+            "perms": 0o100644,
+            "length": i,
+            "status": "visible",
+        }
+        for i in range(start, start + count)
+    ]
+
+
+async def main(count: int) -> None:
+    fuse: Any = InodeTable()
+    parent = Directory(
+        name="",
+        mode=int(EntryMode.RDONLY_DIR),
+        depth=1,
+        fuse=fuse,
+        swhid=CoreSWHID(object_type=ObjectType.DIRECTORY, object_id=b"\x00" * 20),
+    )
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    entries = []
+    for start in range(0, count, DISTINCT_NAMES):
+        metadata = listing(start, min(DISTINCT_NAMES, count - start))
+        for entry in metadata:
+            entries.append(await parent.create_entry(entry))
+        del metadata
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # do not count the list used to keep entries alive in this script
+    retained = after - before - sys.getsizeof(entries)
+    print(f"{count} entries: {retained / count:.0f} bytes/entry")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000))
@@ -0,0 +1,83 @@
+# Copyright (C) 2025  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""
+Measure how many bytes the graph gRPC server sends to list a directory, with the
+requests issued by swh-fuse up to v1.2 (an unmasked ``GetNode`` followed by a
+``Traverse`` for contents' lengths) and with the current single masked ``Traverse``.
+
+Usage::
+
+    python benchmark/graph_bytes_per_directory.py localhost:50091 dirs.txt
+
+where ``dirs.txt`` contains one ``swh:1:dir:`` SWHID per line.
+"""
+
+import statistics
+import sys
+from typing import List, Tuple
+
+from google.protobuf.field_mask_pb2 import FieldMask
+import grpc
+
+from swh.fuse.backends.compressed import CompressedGraphBackend
+import swh.graph.grpc.swhgraph_pb2 as swhgraph
+import swh.graph.grpc.swhgraph_pb2_grpc as swhgraph_grpc
+
+
+def before(stub, swhid: str) -> Tuple[int, int]:
+    """Return (bytes, RPCs) needed to list ``swhid`` the old way"""
+    node = stub.GetNode(swhgraph.GetNodeRequest(swhid=swhid))
+    size = node.ByteSize()
+    for item in stub.Traverse(
+        swhgraph.TraversalRequest(
+            src=[swhid],
+            max_depth=1,
+            edges="dir:cnt",
+            mask=FieldMask(paths=["swhid", "cnt"]),
+        )
+    ):
+        size += item.ByteSize()
+    return size, 2
+
+
+def after(stub, swhid: str) -> Tuple[int, int]:
+    """Return (bytes, RPCs) needed to list ``swhid`` like _directory_metadata"""
+    size = 0
+    for item in stub.Traverse(
+        swhgraph.TraversalRequest(
+            src=[swhid],
+            max_depth=1,
+            edges="dir:dir,dir:cnt,dir:rev",
+            mask=FieldMask(paths=CompressedGraphBackend.DIRECTORY_MASK),
+        )
+    ):
+        size += item.ByteSize()
+    return size, 1
+
+
+def summary(name: str, results: List[Tuple[int, int]]) -> None:
+    sizes = [size for size, _ in results]
+    print(
+        f"{name}: {statistics.mean(sizes):.0f} bytes/directory on average "
+        f"(median {statistics.median(sizes):.0f}, max {max(sizes)}), "
+        f"{sum(rpcs for _, rpcs in results)} RPCs"
+    )
+
+
+def main(grpc_url: str, swhids_path: str) -> None:
+    with open(swhids_path) as f:
+        swhids = [line.strip() for line in f if line.strip()]
+
+    with grpc.insecure_channel(
+        grpc_url, CompressedGraphBackend.CHANNEL_OPTIONS
+    ) as channel:
+        stub = swhgraph_grpc.TraversalServiceStub(channel)
+        summary("before", [before(stub, swhid) for swhid in swhids])
+        summary("after", [after(stub, swhid) for swhid in swhids])
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,88 @@
+# Copyright (C) 2025  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""
+Measure how many metadata rows per second SwhFS processes can write to a shared
+``metadata.sqlite`` cache, committing each row (``flush-interval: 0``) or with
+write-behind batches (default settings).
+
+Usage::
+
+    python benchmark/sqlite_cache_throughput.py [rows per process]
+
+Runs with 1 then 32 processes, each writing distinct directory listings to the
+same database file, in a temporary directory.
+"""
+
+import asyncio
+from multiprocessing import Pool
+from pathlib import Path
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple
+
+from swh.fuse.cache import MetadataCache
+from swh.model.swhids import CoreSWHID, ObjectType
+
+
+def listing(i: int) -> List[Dict[str, Any]]:
+    """A directory listing of 10 files, as returned by graph back-ends"""
+    dir_id = i.to_bytes(20, "big").hex()
+    return [
+        {
+            "dir_id": dir_id,
+            "type": "file",
+            "target": (i * 10 + j).to_bytes(20, "big").hex(),
+            "name": f"file{j}.py",
+            "perms": 0o100644,
+            "length": 1000 + j,
+        }
+        for j in range(10)
+    ]
+
+
+async def write_rows(conf: Dict[str, Any], start: int, count: int) -> None:
+    cache = await MetadataCache(conf).__aenter__()
+    for i in range(start, start + count):
+        swhid = CoreSWHID(
+            object_type=ObjectType.DIRECTORY, object_id=i.to_bytes(20, "big")
+        )
+        await cache.set(swhid, listing(i))
+    await cache.__aexit__()
+
+
+def worker(args: Tuple[Dict[str, Any], int, int]) -> None:
+    asyncio.run(write_rows(*args))
+
+
+def run(processes: int, count: int, flush_interval: float) -> float:
+    """Return the number of rows written per second"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        conf = {
+            "path": str(Path(tmpdir) / "metadata.sqlite"),
+            "flush-interval": flush_interval,
+            "lru-maxram": "0B",
+        }
+        # create the database before the race
+        worker((conf, 0, 0))
+        begin = time.monotonic()
+        with Pool(processes) as pool:
+            pool.map(worker, [(conf, p * count, count) for p in range(processes)])
+        return processes * count / (time.monotonic() - begin)
+
+
+def main(count: int) -> None:
+    for processes in (1, 32):
+        for name, flush_interval in (
+            ("commit per row", 0.0),
+            ("write-behind", MetadataCache.DEFAULT_FLUSH_INTERVAL),
+        ):
+            rate = run(processes, count, flush_interval)
+            print(f"{processes} process(es), {name}: {rate:.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -11,9 +11,25 @@ These classes are abstraction layers to the archive's graph and object storage.
 """
 
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List, Tuple
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
-from swh.model.swhids import CoreSWHID
+from swh.model.swhids import CoreSWHID, ObjectType
+
+# Fields that back-ends may leave out of revision and release metadata unless
+# :py:meth:`GraphBackend.get_metadata` is called with ``full=True``: they are only
+# displayed in ``meta.json`` files.
+FULL_METADATA_FIELDS: Dict[ObjectType, Tuple[str, ...]] = {
+    ObjectType.REVISION: ("author", "committer", "message"),
+    ObjectType.RELEASE: ("author", "message", "name"),
+}
+
+
+def is_partial_metadata(swhid: CoreSWHID, metadata: Any) -> bool:
+    """
+    Tell whether ``metadata`` lacks some of the fields requested with ``full=True``.
+    """
+    fields = FULL_METADATA_FIELDS.get(swhid.object_type, ())
+    return any(field not in metadata for field in fields)
 
 
 class GraphBackend(ABC):
@@ -29,9 +45,11 @@ class GraphBackend(ABC):
     """
 
     @abstractmethod
-    async def get_metadata(self, swhid: CoreSWHID) -> Dict | List:
+    async def get_metadata(self, swhid: CoreSWHID, full: bool = False) -> Dict | List:
         """
         Entries in the returned ``dict`` depend on the ``swhid`` type.
+        Unless ``full`` is set, back-ends may omit the fields listed in
+        :py:data:`FULL_METADATA_FIELDS`.
 
         For ``cnt``, return a dict containing at least ``length`` (int).
 
@@ -62,11 +80,45 @@ class GraphBackend(ABC):
         ``target_type`` (content, directory, revision, release, snapshot or alias).
         """
 
+    async def get_subtree_metadata(self, swhid: CoreSWHID) -> Dict[CoreSWHID, List]:
+        """
+        Optionally, return the listings of many directories below (and including)
+        the ``dir`` identified by ``swhid``, as a dict mapping each directory's SWHID
+        to the list :py:meth:`get_metadata` would return for it.
+        Only complete listings should be included.
+
+        The default implementation returns an empty dict, in which case directories
+        are fetched one by one with :py:meth:`get_metadata`.
+        """
+        return {}
+
     @abstractmethod
-    async def get_history(self, swhid: CoreSWHID) -> List[Tuple[str, str]]:
+    async def get_history(
+        self, swhid: CoreSWHID
+    ) -> Tuple[List[Tuple[str, str]], Dict[str, Optional[str]]]:
+        """
+        Return a list of tuples ``(rev swhid, parent swhid)``, and a dict mapping
+        each revision SWHID of those edges to its author date (ISO, or ``None`` if
+        unknown). The latter is used to build ``history/by-date`` directories.
         """
-        Return a list of tuples ``(rev swhid, parent swhid)``
+
+    async def iter_history(
+        self, swhid: CoreSWHID
+    ) -> AsyncIterator[Tuple[str, List[str], Optional[str]]]:
+        """
+        Yield ``(rev swhid, parent swhids, author date)`` for each revision in the
+        history of ``swhid``, with dates as in :py:meth:`get_history`.
+
+        The default implementation calls :py:meth:`get_history`; back-ends that
+        receive the history as a stream should override it, so it can be consumed
+        before being complete.
         """
+        edges, dates = await self.get_history(swhid)
+        parents: Dict[str, List[str]] = {}
+        for src, dst in edges:
+            parents.setdefault(src, []).append(dst)
+        for revision in dict.fromkeys([*parents, *dates]):
+            yield revision, parents.get(revision, []), dates.get(revision)
 
     @abstractmethod
     async def get_visits(self, url_encoded: str) -> List[Dict[str, Any]]:
@@ -77,7 +129,7 @@ class GraphBackend(ABC):
         ``snapshot`` (SWHID's hash as str)
         """
 
-    def shutdown(self) -> None:
+    async def shutdown(self) -> None:
         """
         Called when the FUSE object is destroyed.
         """
@@ -94,7 +146,7 @@ class ContentBackend(ABC):
         Fetch the content of a ``cnt`` object.
         """
 
-    def shutdown(self) -> None:
+    async def shutdown(self) -> None:
         """
         Called when the FUSE object is destroyed.
         """
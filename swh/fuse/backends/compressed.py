@@ -8,15 +8,15 @@ import base64
 from datetime import date, datetime, timedelta, timezone
 import hashlib
 import logging
-from time import sleep
-from typing import Any, Dict, List, Tuple
+from time import monotonic, sleep
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
 from urllib.parse import unquote_plus
 
 from google.protobuf.field_mask_pb2 import FieldMask
 import grpc
 from grpc_health.v1 import health_pb2, health_pb2_grpc
 
-from swh.core.statsd import Statsd, TimedContextManagerDecorator
+from swh.core.statsd import Statsd
 from swh.fuse import LOGGER_NAME
 import swh.graph.grpc.swhgraph_pb2 as swhgraph
 import swh.graph.grpc.swhgraph_pb2_grpc as swhgraph_grpc
@@ -35,88 +35,334 @@ def decode_or_base64(data: bytes) -> str:
         return base64.b64encode(data).decode()
 
 
+def format_date(timestamp: int, offset: int) -> Optional[str]:
+    """
+    Return the ISO representation of a graph timestamp, in the time zone given by
+    its ``offset`` (in minutes), or ``None`` if it cannot be represented.
+    """
+    try:
+        utc_date = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        return None
+    try:
+        return utc_date.astimezone(timezone(timedelta(minutes=offset))).isoformat()
+    except ValueError:
+        return None
+
+
+# Default number of seconds we wait for concurrent node requests to batch them
+DEFAULT_BATCH_WINDOW = 0.002
+# Default maximum number of nodes requested in a single batch
+DEFAULT_BATCH_SIZE = 256
+# Default limits of the subtree fetched by get_subtree_metadata, when enabled
+DEFAULT_PREFETCH_MAX_DEPTH = 8
+DEFAULT_PREFETCH_MAX_NODES = 100_000
+
+
+class NodeBatcher:
+    """
+    Collects the node requests issued concurrently during a short window
+    (``batch_window`` seconds, or until ``batch_size`` nodes are pending) and
+    resolves them with a single multi-source ``Traverse`` call, limited to depth 0.
+
+    Requests are grouped by field mask. If the batched call fails (for example
+    because one of the nodes is unknown), each node of the batch is fetched again
+    with its own ``GetNode`` call so the error only reaches its own waiter.
+    """
+
+    def __init__(
+        self, backend: "CompressedGraphBackend", batch_window: float, batch_size: int
+    ):
+        self.backend = backend
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        # mask paths -> SWHID -> future of the Node
+        self.pending: Dict[Optional[Tuple[str, ...]], Dict[str, asyncio.Future]] = {}
+        self.timers: Dict[Optional[Tuple[str, ...]], asyncio.TimerHandle] = {}
+        # keep references to running batches, until they complete
+        self.tasks: Set[asyncio.Task] = set()
+
+    async def get_node(
+        self, swhid: str, mask: Optional[Tuple[str, ...]] = None
+    ) -> swhgraph.Node:
+        if self.batch_window <= 0 or self.batch_size <= 1:
+            return await self.backend._get_node(self.backend.node_request(swhid, mask))
+
+        loop = asyncio.get_running_loop()
+        batch = self.pending.setdefault(mask, {})
+        future = batch.get(swhid)
+        if future is None:
+            future = loop.create_future()
+            batch[swhid] = future
+            if len(batch) >= self.batch_size:
+                self.flush(mask)
+            elif mask not in self.timers:
+                self.timers[mask] = loop.call_later(self.batch_window, self.flush, mask)
+        # several callers may wait for the same node: one being cancelled must not
+        # cancel the others
+        return await asyncio.shield(future)
+
+    def flush(self, mask: Optional[Tuple[str, ...]]) -> None:
+        timer = self.timers.pop(mask, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self.pending.pop(mask, None)
+        if not batch:
+            return
+        task = asyncio.create_task(self._resolve(batch, mask))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _resolve(
+        self, batch: Dict[str, asyncio.Future], mask: Optional[Tuple[str, ...]]
+    ) -> None:
+        self.backend.statsd.histogram("swhfuse_graph_batch_size", len(batch))
+        if len(batch) > 1:
+            request = swhgraph.TraversalRequest(src=list(batch.keys()), max_depth=0)
+            if mask is not None:
+                request.mask.CopyFrom(FieldMask(paths=mask))
+            try:
+                async for node in self.backend._traverse(request):
+                    future = batch.pop(node.swhid, None)
+                    if future is not None and not future.done():
+                        future.set_result(node)
+            except grpc.RpcError as err:
+                self.backend.logger.debug(
+                    "Batch of %d nodes failed (%s), fetching them one by one",
+                    len(batch),
+                    err.code(),
+                )
+            except asyncio.CancelledError:
+                for future in batch.values():
+                    future.cancel()
+                raise
+            except Exception as err:
+                for future in batch.values():
+                    if not future.done():
+                        future.set_exception(err)
+                return
+
+        # single requests, failed batches, and nodes missing from the response
+        await asyncio.gather(
+            *(self._resolve_one(swhid, future, mask) for swhid, future in batch.items())
+        )
+
+    async def _resolve_one(
+        self, swhid: str, future: asyncio.Future, mask: Optional[Tuple[str, ...]]
+    ) -> None:
+        try:
+            node = await self.backend._get_node(self.backend.node_request(swhid, mask))
+        except Exception as err:
+            if not future.done():
+                future.set_exception(err)
+        else:
+            if not future.done():
+                future.set_result(node)
+
+    def shutdown(self) -> None:
+        for timer in self.timers.values():
+            timer.cancel()
+        self.timers.clear()
+        for batch in self.pending.values():
+            for future in batch.values():
+                future.cancel()
+        self.pending.clear()
+        for task in self.tasks:
+            task.cancel()
+
+
 class CompressedGraphBackend(GraphBackend):
     """
     A Backend querying a compressed graph instance via gRPC.
+
+    It relies on an asyncio-native gRPC channel, so many concurrent requests share
+    a single connection without blocking the event loop, and streamed results
+    are consumed as they arrive.
     """
 
+    CHANNEL_OPTIONS = [
+        # advanced options are listed in
+        # github.com/grpc/grpc/blob/master/include/grpc/impl/channel_arg_names.h
+        #
+        # disable the limit on message length, because listing some folders
+        # may exceed the default value
+        ("grpc.max_receive_message_length", -1),
+    ]
+
+    # Node fields requested by get_metadata for each object type. Revisions'
+    # and releases' messages and authors are only requested for meta.json files,
+    # see FULL_MASKS.
+    MASKS: Dict[ObjectType, Tuple[str, ...]] = {
+        ObjectType.SNAPSHOT: ("swhid", "successor.swhid", "successor.label"),
+        ObjectType.REVISION: (
+            "swhid",
+            "successor.swhid",
+            "rev.author_date",
+            "rev.author_date_offset",
+            "rev.committer_date",
+            "rev.committer_date_offset",
+        ),
+        ObjectType.RELEASE: (
+            "swhid",
+            "successor.swhid",
+            "rel.author_date",
+            "rel.author_date_offset",
+        ),
+        ObjectType.CONTENT: ("swhid", "cnt"),
+    }
+    FULL_MASKS: Dict[ObjectType, Tuple[str, ...]] = {
+        **MASKS,
+        ObjectType.REVISION: ("swhid", "successor.swhid", "rev"),
+        ObjectType.RELEASE: ("swhid", "successor.swhid", "rel"),
+    }
+    # Fields of a directory and of its entries, requested by get_subtree_metadata
+    DIRECTORY_MASK = ("swhid", "successor.swhid", "successor.label", "cnt")
+    # _directory_metadata requests the directory's successors and labels, and its
+    # contents' properties separately
+    LISTING_MASK = ("swhid", "successor.swhid", "successor.label")
+    CONTENT_MASK = ("swhid", "cnt")
+    # Revisions' parents and author dates, requested by iter_history
+    HISTORY_MASK = (
+        "swhid",
+        "successor.swhid",
+        "rev.author_date",
+        "rev.author_date_offset",
+    )
+    # Origins' successors are their visits' snapshots, labelled by visit dates
+    ORIGIN_MASK = ("swhid", "successor.swhid", "successor.label")
+
     def __init__(self, conf: dict):
         """
-        Only needs ``graph.grpc-url``.
+        Needs ``graph.grpc-url``, optionally ``graph.batch-window``,
+        ``graph.batch-size``, ``graph.prefetch-subtree``,
+        ``graph.prefetch-max-depth`` and ``graph.prefetch-max-nodes``.
         """
-        self.grpc_channel = grpc.insecure_channel(
-            conf["graph"]["grpc-url"],
-            [
-                # advanced options are listed in
-                # github.com/grpc/grpc/blob/master/include/grpc/impl/channel_arg_names.h
-                #
-                # disable the limit on message length, because listing some folders
-                # may exceed the default value
-                ("grpc.max_receive_message_length", -1),
-            ],
+        self.grpc_url = conf["graph"]["grpc-url"]
+        self.prefetch_subtree = bool(conf["graph"].get("prefetch-subtree", False))
+        self.prefetch_max_depth = int(
+            conf["graph"].get("prefetch-max-depth", DEFAULT_PREFETCH_MAX_DEPTH)
         )
-        self.grpc_stub = swhgraph_grpc.TraversalServiceStub(self.grpc_channel)
-        self.logger = logging.getLogger(LOGGER_NAME)
-        self.time_tracker = TimedContextManagerDecorator(
-            Statsd(), "swhfuse_waiting_graph"
+        self.prefetch_max_nodes = int(
+            conf["graph"].get("prefetch-max-nodes", DEFAULT_PREFETCH_MAX_NODES)
         )
+        self.logger = logging.getLogger(LOGGER_NAME)
+        self.statsd = Statsd()
+        self.total_waiting_ms = 0.0
         self._check_connectivity()
+        self.grpc_channel = grpc.aio.insecure_channel(
+            self.grpc_url, self.CHANNEL_OPTIONS
+        )
+        self.grpc_stub = swhgraph_grpc.TraversalServiceStub(self.grpc_channel)
+        self.batcher = NodeBatcher(
+            self,
+            batch_window=float(conf["graph"].get("batch-window", DEFAULT_BATCH_WINDOW)),
+            batch_size=int(conf["graph"].get("batch-size", DEFAULT_BATCH_SIZE)),
+        )
 
     def _check_connectivity(self):
         """
         Connection errors have been observed, especially when spawning many swh.fuse
         instances against a single swh.graph.grpc-server over HPC. This pre-mount check
         avoids showing a mountpoint that's not yet ready.
+
+        It runs before mounting, hence it uses its own blocking channel.
         """
-        health_stub = health_pb2_grpc.HealthStub(self.grpc_channel)
-        for i in range(30):
-            try:
-                request = health_pb2.HealthCheckRequest(
-                    service="swh.graph.TraversalService"
-                )
-                resp = health_stub.Check(request)
-                if resp.status == health_pb2.HealthCheckResponse.SERVING:
-                    if i > 0:
-                        self.logger.info(
-                            "Received a positive health-check from the graph server "
-                            "only after %d attempts",
-                            i + 1,
-                        )
-                    return
-            except grpc.RpcError as rpc_error:
-                if rpc_error.code() != grpc.StatusCode.UNAVAILABLE:
-                    raise
-            sleep(1)
+        with grpc.insecure_channel(self.grpc_url, self.CHANNEL_OPTIONS) as channel:
+            health_stub = health_pb2_grpc.HealthStub(channel)
+            for i in range(30):
+                try:
+                    request = health_pb2.HealthCheckRequest(
+                        service="swh.graph.TraversalService"
+                    )
+                    resp = health_stub.Check(request)
+                    if resp.status == health_pb2.HealthCheckResponse.SERVING:
+                        if i > 0:
+                            self.logger.info(
+                                "Received a positive health-check from the graph "
+                                "server only after %d attempts",
+                                i + 1,
+                            )
+                        return
+                except grpc.RpcError as rpc_error:
+                    if rpc_error.code() != grpc.StatusCode.UNAVAILABLE:
+                        raise
+                sleep(1)
         raise RuntimeError("swh-graph-grpc-server does not seem active.")
 
-    def shutdown(self) -> None:
-        self.grpc_channel.close()
+    async def shutdown(self) -> None:
+        self.batcher.shutdown()
+        await self.grpc_channel.close()
         self.logger.info(
             "Spent %f ms waiting for graph server",
-            self.time_tracker.total_elapsed,
+            self.total_waiting_ms,
         )
 
-    async def get_metadata(self, swhid: CoreSWHID) -> Dict | List:
-        loop = asyncio.get_event_loop()
-        with self.time_tracker:
-            raw = await loop.run_in_executor(
-                None,
-                self.grpc_stub.GetNode,
-                swhgraph.GetNodeRequest(swhid=str(swhid)),
+    def _waited(self, start: float) -> None:
+        """Account for the time spent waiting for the graph server since ``start``
+        (a :func:`time.monotonic` value)"""
+        elapsed_ms = (monotonic() - start) * 1000
+        self.statsd.timing("swhfuse_waiting_graph", elapsed_ms)
+        self.total_waiting_ms += elapsed_ms
+
+    @staticmethod
+    def node_request(
+        swhid: str, mask: Optional[Tuple[str, ...]] = None
+    ) -> swhgraph.GetNodeRequest:
+        request = swhgraph.GetNodeRequest(swhid=swhid)
+        if mask is not None:
+            request.mask.CopyFrom(FieldMask(paths=mask))
+        return request
+
+    async def _get_node(self, request: swhgraph.GetNodeRequest) -> swhgraph.Node:
+        start = monotonic()
+        try:
+            return await self.grpc_stub.GetNode(request)
+        finally:
+            self._waited(start)
+
+    async def _traverse(
+        self, request: swhgraph.TraversalRequest
+    ) -> AsyncIterator[swhgraph.Node]:
+        """
+        Yield the nodes returned by a ``Traverse`` call as they arrive. Waiting time
+        is reported once per traversal (instead of once per node).
+        """
+        call = self.grpc_stub.Traverse(request)
+        waiting = 0.0
+        try:
+            while True:
+                start = monotonic()
+                node = await call.read()
+                waiting += monotonic() - start
+                if node is grpc.aio.EOF:
+                    break
+                yield node
+        finally:
+            call.cancel()
+            elapsed_ms = waiting * 1000
+            self.statsd.timing("swhfuse_waiting_graph", elapsed_ms)
+            self.total_waiting_ms += elapsed_ms
+
+    async def get_metadata(self, swhid: CoreSWHID, full: bool = False) -> Dict | List:
+        if swhid.object_type == ObjectType.DIRECTORY:
+            return await self._directory_metadata(swhid)
+
+        masks = self.FULL_MASKS if full else self.MASKS
+        if swhid.object_type not in masks:
+            raise NotImplementedError(
+                f"get_metadata({swhid.object_type}) not supported"
             )
+        raw = await self.batcher.get_node(str(swhid), masks[swhid.object_type])
 
         match swhid.object_type:
             case ObjectType.SNAPSHOT:
                 return self._snapshot_metadata(raw)
 
             case ObjectType.REVISION:
-                return self._revision_metadata(swhid, raw)
+                return self._revision_metadata(swhid, raw, full)
 
             case ObjectType.RELEASE:
-                return self._release_metadata(swhid, raw)
-
-            case ObjectType.DIRECTORY:
-                return await self._directory_metadata(swhid, raw)
+                return self._release_metadata(swhid, raw, full)
 
             case ObjectType.CONTENT:
                 return await self._content_metadata(swhid, raw)
@@ -138,7 +384,9 @@ class CompressedGraphBackend(GraphBackend):
                 }
         return metadata
 
-    def _revision_metadata(self, swhid: CoreSWHID, raw: swhgraph.Node) -> Dict:
+    def _revision_metadata(
+        self, swhid: CoreSWHID, raw: swhgraph.Node, full: bool = False
+    ) -> Dict:
         parents = []
         directory = None
         for successor in raw.successor:
@@ -153,94 +401,95 @@ class CompressedGraphBackend(GraphBackend):
                     f"Unsupported successor type for {swhid}: {target.object_type}"
                 )
         # we also provide fields from protobuf message RevisionData
-        try:
-            author_date = datetime.fromtimestamp(raw.rev.author_date, tz=timezone.utc)
-            author_tz = timezone(timedelta(minutes=raw.rev.author_date_offset))
-            author_date = author_date.astimezone(author_tz)
-            author_date_str = author_date.isoformat()
-        except ValueError:
-            author_date_str = None
-
-        try:
-            committer_date = datetime.fromtimestamp(
-                raw.rev.committer_date, tz=timezone.utc
-            )
-            committer_tz = timezone(timedelta(minutes=raw.rev.committer_date_offset))
-            committer_date = committer_date.astimezone(committer_tz)
-            committer_date_str = committer_date.isoformat()
-        except ValueError:
-            committer_date_str = None
-
-        message = decode_or_base64(raw.rev.message)
-        metadata = {
-            "author": raw.rev.author,
-            "committer": raw.rev.committer,
-            "message": message,
-            "date": author_date_str,
-            "committer_date": committer_date_str,
+        metadata: Dict[str, Any] = {
+            "date": format_date(raw.rev.author_date, raw.rev.author_date_offset),
+            "committer_date": format_date(
+                raw.rev.committer_date, raw.rev.committer_date_offset
+            ),
             "parents": parents,
             "directory": directory,
             "id": swhid.object_id.hex(),
         }
+        if full:
+            metadata.update(
+                {
+                    "author": raw.rev.author,
+                    "committer": raw.rev.committer,
+                    "message": decode_or_base64(raw.rev.message),
+                }
+            )
         return metadata
 
-    def _release_metadata(self, swhid: CoreSWHID, raw: swhgraph.Node) -> Dict:
+    def _release_metadata(
+        self, swhid: CoreSWHID, raw: swhgraph.Node, full: bool = False
+    ) -> Dict:
         for successor in raw.successor:
             target = CoreSWHID.from_string(successor.swhid)
             break
         else:
             raise ValueError(f"Cannot find target for release {swhid}")
 
-        try:
-            rel_date = datetime.fromtimestamp(raw.rel.author_date, tz=timezone.utc)
-            rel_tz = timezone(timedelta(minutes=raw.rel.author_date_offset))
-            rel_date = rel_date.astimezone(rel_tz)
-            rel_date_str = rel_date.isoformat()
-        except ValueError:
-            rel_date_str = None
-
-        message = decode_or_base64(raw.rel.message)
-        name = decode_or_base64(raw.rel.name)
-
-        metadata = {
+        metadata: Dict[str, Any] = {
             "target": target.object_id.hex(),
             "target_type": target.object_type.name.lower(),
             "id": swhid.object_id.hex(),
-            "message": message,
-            "name": name,
-            "author": raw.rel.author,
-            "date": rel_date_str,
+            "date": format_date(raw.rel.author_date, raw.rel.author_date_offset),
         }
+        if full:
+            metadata.update(
+                {
+                    "message": decode_or_base64(raw.rel.message),
+                    "name": decode_or_base64(raw.rel.name),
+                    "author": raw.rel.author,
+                }
+            )
         return metadata
 
-    async def _directory_metadata(self, swhid: CoreSWHID, raw: swhgraph.Node) -> List:
+    async def _directory_metadata(self, swhid: CoreSWHID) -> List:
         """
-        In this case the ``raw`` object obtained from ``getNode`` is not enough,
-        because we also need each successors' ``length`` property (if it's a content) to
-        be on par with the WebAPI. We use a filtered traversal request to obtain lengths
-        in a single gRPC call.
+        Listing a directory needs its successors and labels, but also each
+        successors' ``length`` property (if it's a content) to be on par with the
+        WebAPI. Both are requested concurrently: the directory's node alone, and a
+        traversal limited to depth 1 that only returns its contents' properties
+        (returning sub-directories would also stream their own successors).
         """
+        swhid_str = str(swhid)
+        request = swhgraph.TraversalRequest(
+            src=[swhid_str],
+            max_depth=1,
+            edges="dir:cnt",
+            return_nodes=swhgraph.NodeFilter(types="cnt"),
+            mask=FieldMask(paths=self.CONTENT_MASK),
+        )
 
-        loop = asyncio.get_event_loop()
-        with self.time_tracker:
-            raw_cnt = await loop.run_in_executor(
-                None,
-                self.grpc_stub.Traverse,
-                swhgraph.TraversalRequest(
-                    src=[str(swhid)],
-                    max_depth=1,
-                    edges="dir:cnt",
-                    mask=FieldMask(paths=["swhid", "cnt"]),
-                ),
-            )
-        cnt_metadata = {}
-        for item in raw_cnt:
-            if item.HasField("cnt"):
-                cnt_metadata[item.swhid] = {
-                    "length": item.cnt.length,
-                    "status": "skipped" if item.cnt.is_skipped else "visible",
-                }
+        async def contents() -> Dict[str, Dict[str, Any]]:
+            return {
+                item.swhid: self._content_fields(item)
+                async for item in self._traverse(request)
+            }
+
+        raw, cnt_metadata = await asyncio.gather(
+            self.batcher.get_node(swhid_str, self.LISTING_MASK), contents()
+        )
+        return self._directory_listing(swhid, raw, cnt_metadata)
+
+    @staticmethod
+    def _content_fields(raw: swhgraph.Node) -> Dict[str, Any]:
+        return {
+            "length": raw.cnt.length,
+            "status": "skipped" if raw.cnt.is_skipped else "visible",
+        }
 
+    def _directory_listing(
+        self,
+        swhid: CoreSWHID,
+        raw: swhgraph.Node,
+        cnt_metadata: Dict[str, Dict[str, Any]],
+    ) -> List:
+        """
+        Build a directory listing from its node and its contents' properties
+        (as returned by :py:meth:`_content_fields`), indexed by SWHID.
+        """
         metadata = []
         for successor in raw.successor:
             target = CoreSWHID.from_string(successor.swhid)
@@ -270,43 +519,97 @@ class CompressedGraphBackend(GraphBackend):
 
         return metadata
 
-    async def _content_metadata(self, swhid: CoreSWHID, raw: swhgraph.Node) -> Dict:
-        return {
-            "length": raw.cnt.length,
-            "status": "skipped" if raw.cnt.is_skipped else "visible",
-        }
+    async def get_subtree_metadata(self, swhid: CoreSWHID) -> Dict[CoreSWHID, List]:
+        """
+        When ``graph.prefetch-subtree`` is enabled, list the whole subtree below the
+        ``dir`` identified by ``swhid`` with a single streamed traversal, limited to
+        ``graph.prefetch-max-depth`` levels and ``graph.prefetch-max-nodes`` nodes.
 
-    async def get_history(self, swhid: CoreSWHID) -> List[Tuple[str, str]]:
-        loop = asyncio.get_event_loop()
-        with self.time_tracker:
-            raw_cnt = await loop.run_in_executor(
-                None,
-                self.grpc_stub.Traverse,
-                swhgraph.TraversalRequest(
-                    src=[str(swhid)],
-                    edges="rev:rev",
-                    mask=FieldMask(paths=["swhid"]),
-                ),
-            )
-        child_str = str(swhid)
-        result = []
-        for entry in raw_cnt:
-            entry_str = str(entry.swhid)
-            result.append((child_str, entry_str))
-            child_str = entry_str
-        return result
+        Directories whose listing may be incomplete because of those limits
+        (directories at the maximum depth, or whose contents were not all returned
+        before reaching the maximum number of nodes) are left out.
+        """
+        if not self.prefetch_subtree or swhid.object_type != ObjectType.DIRECTORY:
+            return {}
+
+        request = swhgraph.TraversalRequest(
+            src=[str(swhid)],
+            # dir:rev edges are needed to list submodules
+            edges="dir:dir,dir:cnt,dir:rev",
+            mask=FieldMask(paths=self.DIRECTORY_MASK),
+        )
+        if self.prefetch_max_depth > 0:
+            request.max_depth = self.prefetch_max_depth
+        if self.prefetch_max_nodes > 0:
+            request.max_matching_nodes = self.prefetch_max_nodes
+
+        depths = {str(swhid): 0}
+        directories: List[swhgraph.Node] = []
+        cnt_metadata: Dict[str, Dict[str, Any]] = {}
+        async for node in self._traverse(request):
+            if node.HasField("cnt"):
+                cnt_metadata[node.swhid] = self._content_fields(node)
+            elif node.swhid.startswith("swh:1:dir:"):
+                depth = depths.get(node.swhid, 0)
+                for successor in node.successor:
+                    depths.setdefault(successor.swhid, depth + 1)
+                directories.append(node)
+
+        listings = {}
+        for node in directories:
+            if 0 < self.prefetch_max_depth <= depths.get(node.swhid, 0):
+                continue
+            if any(
+                successor.swhid.startswith("swh:1:cnt:")
+                and successor.swhid not in cnt_metadata
+                for successor in node.successor
+            ):
+                continue
+            dir_swhid = CoreSWHID.from_string(node.swhid)
+            listings[dir_swhid] = self._directory_listing(dir_swhid, node, cnt_metadata)
+
+        self.statsd.histogram("swhfuse_prefetched_directories", len(listings))
+        return listings
+
+    async def _content_metadata(self, swhid: CoreSWHID, raw: swhgraph.Node) -> Dict:
+        return self._content_fields(raw)
+
+    async def get_history(
+        self, swhid: CoreSWHID
+    ) -> Tuple[List[Tuple[str, str]], Dict[str, Optional[str]]]:
+        edges: List[Tuple[str, str]] = []
+        dates: Dict[str, Optional[str]] = {}
+        async for revision, parents, author_date in self.iter_history(swhid):
+            dates[revision] = author_date
+            edges.extend((revision, parent) for parent in parents)
+        return edges, dates
+
+    async def iter_history(
+        self, swhid: CoreSWHID
+    ) -> AsyncIterator[Tuple[str, List[str], Optional[str]]]:
+        """
+        Traverse all ancestors of ``swhid`` in a single streamed call, where each
+        node comes with its parents and its author date.
+        """
+        request = swhgraph.TraversalRequest(
+            src=[str(swhid)],
+            edges="rev:rev",
+            mask=FieldMask(paths=self.HISTORY_MASK),
+        )
+        async for node in self._traverse(request):
+            author_date = None
+            if node.rev.HasField("author_date"):
+                author_date = format_date(
+                    node.rev.author_date, node.rev.author_date_offset
+                )
+            parents = [successor.swhid for successor in node.successor]
+            yield node.swhid, parents, author_date
 
     async def get_visits(self, url_encoded: str) -> List[Dict[str, Any]]:
         url = unquote_plus(url_encoded)
         swhid = "swh:1:ori:" + hashlib.sha1(url.encode()).hexdigest()
 
-        loop = asyncio.get_event_loop()
-        with self.time_tracker:
-            ori_node = await loop.run_in_executor(
-                None,
-                self.grpc_stub.GetNode,
-                swhgraph.GetNodeRequest(swhid=str(swhid)),
-            )
+        ori_node = await self.batcher.get_node(str(swhid), self.ORIGIN_MASK)
 
         origin = url
         visits = []
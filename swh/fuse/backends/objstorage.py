@@ -3,8 +3,12 @@
 # License: GNU General Public License version 3, or any later version
 # See top-level LICENSE file for more information
 
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import logging
 import typing
+from typing import Any, Callable, Dict, TypeVar
 
 from swh.core.statsd import Statsd, TimedContextManagerDecorator
 from swh.fuse import LOGGER_NAME
@@ -19,12 +23,20 @@ if typing.TYPE_CHECKING:
 
 from . import ContentBackend
 
+T = TypeVar("T")
+
+DEFAULT_THREADS = 8
+
 
 class ObjStorageBackend(ContentBackend):
     """
     This content backend relies on an ``swh-storage`` service,
     and maybe an ``swh-objstorage`` directly.
 
+    Both are called through blocking APIs, so calls run in a dedicated thread
+    pool (whose size is set by ``content.threads``) in order to keep the event
+    loop serving other FUSE requests meanwhile.
+
     See :ref:`Configuring files' download <swh-fuse-config-file-download>`.
     """
 
@@ -45,6 +57,13 @@ class ObjStorageBackend(ContentBackend):
         except KeyError:
             self.objstorage = None
 
+        self.executor = ThreadPoolExecutor(
+            max_workers=conf["content"].get("threads", DEFAULT_THREADS),
+            thread_name_prefix="swhfuse-content",
+        )
+        # Number of calls queued or running in the executor, per stage
+        self.queue_depth: Dict[str, int] = {"storage": 0, "objstorage": 0}
+
         self.statsd = Statsd()
         self.storage_tracker = TimedContextManagerDecorator(
             self.statsd, "swhfuse_waiting_storage"
@@ -53,7 +72,8 @@ class ObjStorageBackend(ContentBackend):
             self.statsd, "swhfuse_waiting_objstorage"
         )
 
-    def shutdown(self) -> None:
+    async def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
         self.logger.info(
             "Spent %f ms waiting for storage",
             self.storage_tracker.total_elapsed,
@@ -63,6 +83,31 @@ class ObjStorageBackend(ContentBackend):
             self.objstorage_tracker.total_elapsed,
         )
 
+    async def _run(
+        self,
+        stage: str,
+        tracker: TimedContextManagerDecorator,
+        func: Callable[..., T],
+        *args: Any,
+        **kwargs: Any,
+    ) -> T:
+        """
+        Run a blocking call in the content thread pool. ``tracker`` only times the
+        call itself, whereas the ``swhfuse_<stage>_queue_depth`` gauge tracks how
+        many calls are queued or running for that stage.
+        """
+        metric = f"swhfuse_{stage}_queue_depth"
+        self.queue_depth[stage] += 1
+        self.statsd.gauge(metric, self.queue_depth[stage])
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor, partial(tracker(func), *args, **kwargs)
+            )
+        finally:
+            self.queue_depth[stage] -= 1
+            self.statsd.gauge(metric, self.queue_depth[stage])
+
     async def get_blob(self, swhid: CoreSWHID) -> bytes:
         """
         Fetch the content of a ``cnt`` object.
@@ -70,17 +115,26 @@ class ObjStorageBackend(ContentBackend):
         self.statsd.increment("swhfuse_get_blob")
         hashes = None
         try:
-            with self.storage_tracker:
-                found = self.storage.content_get([swhid.object_id], algo="sha1_git")
-                if found and found[0]:
-                    hashes = objid_from_dict(found[0].hashes())
+            found = await self._run(
+                "storage",
+                self.storage_tracker,
+                self.storage.content_get,
+                [swhid.object_id],
+                algo="sha1_git",
+            )
+            if found and found[0]:
+                hashes = objid_from_dict(found[0].hashes())
             if hashes:
                 if self.objstorage is None:
                     self.logger.debug("downloading %s from storage", hashes)
-                    with self.storage_tracker:
-                        content = self.storage.content_get_data(hashes)
-                        if content:
-                            return content
+                    content = await self._run(
+                        "storage",
+                        self.storage_tracker,
+                        self.storage.content_get_data,
+                        hashes,
+                    )
+                    if content:
+                        return content
                     raise ValueError(f"SWH-storage cannot get object {hashes}")
                 # else let's reach the "try objstorage" block
             else:
@@ -92,10 +146,9 @@ class ObjStorageBackend(ContentBackend):
 
         try:
             self.logger.debug("downloading %s from objstorage", hashes)
-            with self.objstorage_tracker:
-                return self.objstorage.get(hashes)
-            raise ValueError(f"SWH-objstorage cannot find object {hashes}")
-
+            return await self._run(
+                "objstorage", self.objstorage_tracker, self.objstorage.get, hashes
+            )
         except BaseException as e:
             self.statsd.increment("swhfuse_blob_not_in_objstorage")
             self.logger.error("Failed to fetch %s from objstorage: %s", swhid, e)
@@ -6,7 +6,7 @@
 import asyncio
 from functools import partial
 import logging
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 from urllib.parse import unquote_plus
 
 from requests import HTTPError
@@ -40,7 +40,7 @@ class WebApiBackend(GraphBackend, ContentBackend):
         self.logger = logging.getLogger(LOGGER_NAME)
         self.cache = cache
 
-    async def get_metadata(self, swhid: CoreSWHID) -> Dict | List:
+    async def get_metadata(self, swhid: CoreSWHID, full: bool = False) -> Dict | List:
         try:
             self.logger.debug(f"Fetching metadata via Web API for {swhid}")
             loop = asyncio.get_event_loop()
@@ -61,7 +61,9 @@ class WebApiBackend(GraphBackend, ContentBackend):
             self.logger.error("Cannot fetch blob for object %s: %s", swhid, err)
             raise
 
-    async def get_history(self, swhid: CoreSWHID) -> List[Tuple[str, str]]:
+    async def get_history(
+        self, swhid: CoreSWHID
+    ) -> Tuple[List[Tuple[str, str]], Dict[str, Optional[str]]]:
         """
         Fetch a thousand ``(entry, parent)`` edges from ``swhid``.
 
@@ -70,6 +72,7 @@ class WebApiBackend(GraphBackend, ContentBackend):
         artifacts.
         """
         edges = []
+        dates: Dict[str, Optional[str]] = {}
         limit = 1000
         try:
             self.logger.debug(
@@ -79,21 +82,24 @@ class WebApiBackend(GraphBackend, ContentBackend):
             loop = asyncio.get_event_loop()
             request = await loop.run_in_executor(None, self.web_api._call, call)
             history = request.json()
+            revisions = []
             for revision in history:
                 entry_swhid = CoreSWHID(
                     object_type=ObjectType.REVISION,
                     object_id=bytes.fromhex(revision["id"]),
                 )
-                await self.cache.metadata.set(entry_swhid, revision)
+                revisions.append((entry_swhid, revision))
+                dates[str(entry_swhid)] = revision.get("date")
                 for parent in revision["parents"]:
                     parent_swhid = CoreSWHID(
                         object_type=ObjectType.REVISION,
                         object_id=bytes.fromhex(parent["id"]),
                     )
                     edges.append((str(entry_swhid), str(parent_swhid)))
+            await self.cache.metadata.set_many(revisions)
         except HTTPError as err:
             self.logger.error("Cannot fetch history for object %s: %s", swhid, err)
-        return edges
+        return edges, dates
 
     async def get_visits(self, url_encoded: str) -> List[Dict[str, Any]]:
         try:
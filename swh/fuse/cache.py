@@ -4,28 +4,103 @@
 # See top-level LICENSE file for more information
 
 from abc import ABC
+import asyncio
 from collections import OrderedDict
 from dataclasses import dataclass, field
 from datetime import datetime
+import itertools
 import json
 import logging
+import mmap
+import os
 from pathlib import Path
 import re
 import sqlite3
+import struct
 import sys
-from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
+import tempfile
+import time
+from typing import (
+    Any,
+    AsyncGenerator,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+import weakref
 
 import aiosqlite
-import dateutil.parser
 from psutil import virtual_memory
 
-from swh.fuse.fs.artifact import RevisionHistoryShardByDate
-from swh.fuse.fs.entry import FuseDirEntry, FuseEntry
+from swh.core.statsd import Statsd
+from swh.fuse.compression import Codec, is_compressed
+from swh.fuse.fs.entry import DirListing, FileContent, FuseDirEntry, deep_sizeof
 from swh.fuse.fs.mountpoint import CacheDir, OriginDir
-from swh.model.exceptions import ValidationError
+from swh.fuse.history import History, HistoryGraph
 from swh.model.swhids import CoreSWHID, ObjectType
 from swh.web.client.client import ORIGIN_VISIT, typify_json
 
+# Default SQLite tuning, see db_connect()
+DEFAULT_PAGE_SIZE = 8192
+DEFAULT_MMAP_SIZE = 256 * 2**20
+# How long (in seconds) to wait for another process to release the database
+BUSY_TIMEOUT = 30.0
+# How long (in seconds) to wait for another process migrating the database
+MIGRATION_TIMEOUT = 3600.0
+
+
+SIZE_UNITS = {"B": 1, "KB": 10**3, "MB": 10**6, "GB": 10**9, "TB": 10**12}
+
+
+def parse_size(value: str) -> int:
+    """Parse a size with a unit suffix: ``B``, ``KB``, ``MB``, ``GB`` or ``TB``"""
+    m = re.match(r"(\d+)\s*(.+)", str(value).strip())
+    if not m or m.group(2).upper() not in SIZE_UNITS:
+        raise ValueError(f"Cannot parse size: {value}")
+    return int(m.group(1)) * SIZE_UNITS[m.group(2).upper()]
+
+
+# Codes of SWHIDs' object types in binary keys (see swhid_key()). They are stored
+# on disk: never change them.
+SWHID_TYPE_CODES = {
+    ObjectType.CONTENT: 1,
+    ObjectType.DIRECTORY: 2,
+    ObjectType.REVISION: 3,
+    ObjectType.RELEASE: 4,
+    ObjectType.SNAPSHOT: 5,
+}
+SWHID_TYPES = {code: object_type for object_type, code in SWHID_TYPE_CODES.items()}
+
+
+def swhid_key(swhid: CoreSWHID) -> bytes:
+    """Key of ``swhid`` in cache tables: its 1-byte type code then its hash"""
+    return bytes((SWHID_TYPE_CODES[swhid.object_type],)) + swhid.object_id
+
+
+def key_swhid(key: bytes) -> CoreSWHID:
+    """The SWHID whose :py:func:`swhid_key` is ``key``"""
+    return CoreSWHID(object_type=SWHID_TYPES[key[0]], object_id=key[1:])
+
+
+def text_swhid_key(swhid: str) -> Optional[bytes]:
+    """:py:func:`swhid_key` of a SWHID in text form (as in version 1 tables), or
+    None if it is not a valid SWHID"""
+    if not isinstance(swhid, str) or not swhid.startswith("swh:1:"):
+        return None
+    try:
+        code = SWHID_TYPE_CODES[ObjectType(swhid[6:9])]
+        object_id = bytes.fromhex(swhid[10:])
+    except ValueError:
+        return None
+    if len(object_id) != 20 or swhid[9] != ":":
+        return None
+    return bytes((code,)) + object_id
+
 
 async def db_connect(conf: Dict[str, Any]) -> aiosqlite.Connection:
     # In-memory (thus temporary) caching is useful for testing purposes
@@ -37,7 +112,24 @@ async def db_connect(conf: Dict[str, Any]) -> aiosqlite.Connection:
         Path(path).parent.mkdir(parents=True, exist_ok=True)
         uri = False
 
-    return await aiosqlite.connect(path, uri=uri, detect_types=sqlite3.PARSE_DECLTYPES)
+    conn = await aiosqlite.connect(
+        path, uri=uri, detect_types=sqlite3.PARSE_DECLTYPES, timeout=BUSY_TIMEOUT
+    )
+    # used to migrate tables from schema version 1
+    await conn.create_function("swhid_key", 1, text_swhid_key, deterministic=True)
+    if not uri:
+        # The page size only applies to new databases (before WAL is enabled).
+        # In WAL mode, readers do not block the writer (and vice versa), so many
+        # SwhFS processes can share the same cache files.
+        await conn.execute(
+            f"pragma page_size={int(conf.get('page-size', DEFAULT_PAGE_SIZE))}"
+        )
+        await conn.execute("pragma journal_mode=wal")
+        await conn.execute("pragma synchronous=normal")
+        await conn.execute(
+            f"pragma mmap_size={int(conf.get('mmap-size', DEFAULT_MMAP_SIZE))}"
+        )
+    return conn
 
 
 class FuseCache:
@@ -68,18 +160,24 @@ class FuseCache:
 
         if self.cache_conf["blob"].get("bypass", False):
             self.blob = await NoopBlobCache(conf=self.cache_conf["blob"]).__aenter__()
+        elif "directory" in self.cache_conf["blob"]:
+            self.blob = await FileBlobCache(conf=self.cache_conf["blob"]).__aenter__()
         else:
             self.blob = await BlobCache(conf=self.cache_conf["blob"]).__aenter__()
 
+        self.direntry = DirEntryCache(self.cache_conf["direntry"])
         # History and raw metadata share the same SQLite db (hence the same connection)
         self.history = await HistoryCache(
             conf=self.cache_conf["metadata"], conn=self.metadata.conn
         ).__aenter__()
-        self.direntry = DirEntryCache(self.cache_conf["direntry"])
+        # in-memory history graphs are charged to the direntry cache budget
+        self.history.track = self.direntry.track
 
         return self
 
     async def __aexit__(self, type=None, val=None, tb=None) -> None:
+        # History and metadata share a connection: flush both before closing it
+        await self.history.flush()
         await self.metadata.__aexit__()
         await self.blob.__aexit__()
         await self.history.__aexit__()
@@ -87,64 +185,313 @@ class FuseCache:
     async def get_cached_swhids(self) -> AsyncGenerator[CoreSWHID, None]:
         """Return a list of all previously cached SWHID"""
 
+        await self.metadata.flush()
         # Use the metadata db since it should always contain all accessed SWHIDs
         metadata_cursor = await self.metadata.conn.execute(
             "select swhid from metadata_cache"
         )
         swhids = await metadata_cursor.fetchall()
-        for raw_swhid in swhids:
-            yield CoreSWHID.from_string(raw_swhid[0])
+        for key in swhids:
+            yield key_swhid(key[0])
 
     async def get_cached_visits(self) -> AsyncGenerator[str, None]:
         """Return a list of all previously cached visit URL"""
 
+        await self.metadata.flush()
         cursor = await self.metadata.conn.execute("select url from visits_cache")
         urls = await cursor.fetchall()
         for raw_url in urls:
             yield raw_url[0]
 
 
+# Flush locks of connections, shared by the caches using them
+FLUSH_LOCKS: "weakref.WeakKeyDictionary[aiosqlite.Connection, asyncio.Lock]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+# A write of the row identified by (table, primary key): the SQL statement and its
+# parameters, then the row as seen by readers until it is committed (None for
+# deletions)
+Write = Tuple[str, Tuple[Any, ...], Optional[Tuple[Any, ...]]]
+
+
 class AbstractCache(ABC):
-    """Abstract cache implementation to share common behavior between cache types"""
+    """Abstract cache implementation to share common behavior between cache types.
+
+    Writes are queued then committed by batches (write-behind), at most
+    ``flush-interval`` seconds after being queued or as soon as ``flush-size``
+    rows are pending, instead of paying one transaction per row. Reads take
+    pending writes into account. A ``flush-interval`` of 0 commits each write
+    immediately. Writes of a failed transaction are queued again, unless newer
+    writes to the same rows are pending.
+
+    The version of each cache's tables is recorded in the ``schema_version``
+    table. Tables of a previous version are migrated when opening the cache,
+    while other processes opening it wait (see :py:meth:`upgrade`)."""
 
     DB_SCHEMA: str = ""
+    # Name of the cache in the schema_version table
+    SCHEMA_NAME: str = ""
+    SCHEMA_VERSION = 2
+    # Tables of version 1, which predates the schema_version table
+    V1_TABLES: Tuple[str, ...] = ()
+    # Statements copying rows of each version 1 table (renamed <table>_v1)
+    V1_COPY: Dict[str, str] = {}
     conf: Dict[str, Any]
     conn: aiosqlite.Connection
 
+    DEFAULT_FLUSH_INTERVAL = 1.0
+    DEFAULT_FLUSH_SIZE = 1000
+
     def __init__(
         self, conf: Dict[str, Any], conn: Optional[aiosqlite.Connection] = None
     ):
         self.conf = conf
         self.init_conn = conn
+        self.flush_interval = float(
+            conf.get("flush-interval", self.DEFAULT_FLUSH_INTERVAL)
+        )
+        self.flush_size = int(conf.get("flush-size", self.DEFAULT_FLUSH_SIZE))
+        self.pending: Dict[Tuple[str, Any], Write] = {}
+        # writes of the flush in progress, until committed
+        self.flushing: Dict[Tuple[str, Any], Write] = {}
+        # shared with other caches using the same connection, see __aenter__
+        self.flush_lock = asyncio.Lock()
+        self.flush_timer: Optional[asyncio.TimerHandle] = None
+        self.flush_tasks: Set[asyncio.Task] = set()
+        self.statsd = Statsd()
 
     async def __aenter__(self):
         if self.init_conn is None:
             self.conn = await db_connect(self.conf)
         else:
             self.conn = self.init_conn
+        # Caches sharing a connection share its transactions: their flushes must
+        # not interleave, or one's rollback would discard the other's writes
+        self.flush_lock = FLUSH_LOCKS.setdefault(self.conn, self.flush_lock)
 
-        await self.conn.executescript(self.DB_SCHEMA)
-        await self.conn.commit()
+        await self.create_schema()
         return self
 
+    async def execute_script(self, script: str) -> None:
+        """Execute each statement of ``script`` in the current transaction (unlike
+        ``executescript``, which commits it first)"""
+        for statement in script.split(";"):
+            if statement.strip():
+                await self.conn.execute(statement)
+
+    async def tables(self) -> Set[str]:
+        cursor = await self.conn.execute(
+            "select name from sqlite_master where type = 'table'"
+        )
+        return {name for (name,) in await cursor.fetchall()}
+
+    async def create_schema(self) -> None:
+        """Create tables, or migrate them to :py:attr:`SCHEMA_VERSION`"""
+        # Lock the database for writing before reading its version, so that
+        # concurrent processes wait for the migration instead of migrating too
+        await self.conn.execute(
+            f"pragma busy_timeout = {int(MIGRATION_TIMEOUT * 1000)}"
+        )
+        await self.conn.execute("begin immediate")
+        try:
+            await self.conn.execute(
+                """create table if not exists schema_version (
+                    name text not null primary key,
+                    version integer not null
+                ) without rowid"""
+            )
+            cursor = await self.conn.execute(
+                "select version from schema_version where name = ?",
+                (self.SCHEMA_NAME,),
+            )
+            row = await cursor.fetchone()
+            if row is not None:
+                version = row[0]
+            elif await self.tables() & set(self.V1_TABLES):
+                version = 1
+            else:
+                version = self.SCHEMA_VERSION
+
+            if version > self.SCHEMA_VERSION:
+                raise RuntimeError(
+                    f"The {self.SCHEMA_NAME} cache was created by a newer SwhFS "
+                    f"(schema version {version})"
+                )
+            if version < self.SCHEMA_VERSION:
+                logging.info(
+                    "Migrating the %s cache from schema version %d to %d",
+                    self.SCHEMA_NAME,
+                    version,
+                    self.SCHEMA_VERSION,
+                )
+                await self.upgrade(version)
+            await self.execute_script(self.DB_SCHEMA)
+            await self.conn.execute(
+                "insert or replace into schema_version values (?, ?)",
+                (self.SCHEMA_NAME, self.SCHEMA_VERSION),
+            )
+            await self.conn.commit()
+        except BaseException:
+            await self.conn.rollback()
+            raise
+        finally:
+            await self.conn.execute(f"pragma busy_timeout = {int(BUSY_TIMEOUT * 1000)}")
+
+    async def upgrade(self, version: int) -> None:
+        """Migrate tables from schema ``version`` to :py:attr:`SCHEMA_VERSION`,
+        within the transaction of :py:meth:`create_schema`.
+
+        Version 2 keys rows by :py:func:`swhid_key` instead of SWHIDs as text:
+        version 1 tables are renamed, copied by :py:attr:`V1_COPY` then dropped."""
+        assert version == 1
+        existing = await self.tables()
+        v1_tables = [table for table in self.V1_TABLES if table in existing]
+        for table in v1_tables:
+            await self.conn.execute(f"alter table {table} rename to {table}_v1")
+        await self.execute_script(self.DB_SCHEMA)
+        for table in v1_tables:
+            if table in self.V1_COPY:
+                await self.conn.execute(self.V1_COPY[table])
+            await self.conn.execute(f"drop table {table}_v1")
+
     async def __aexit__(self, type=None, val=None, tb=None) -> None:
+        await self.flush()
+        if self.flush_timer is not None:
+            # the last flush failed, its writes are lost
+            self.flush_timer.cancel()
+            self.flush_timer = None
         # In case we were given an existing connection, do not close it here
         if self.init_conn is None:
             await self.conn.close()
 
+    async def write(
+        self,
+        table: str,
+        statement: str,
+        rows: Iterable[Tuple[Any, Tuple[Any, ...], Optional[Tuple[Any, ...]]]],
+        replace: bool = True,
+    ) -> None:
+        """Queue writes to ``table`` with ``statement``, given ``(primary key,
+        parameters, row)`` triples: readers will get ``row`` until it is committed.
+        Unless ``replace`` is set, a write already pending for the same row wins
+        (as with ``insert or ignore``)."""
+
+        if self.flush_interval <= 0:
+            async with self.flush_lock:
+                await self.conn.executemany(
+                    statement, [params for _, params, _ in rows]
+                )
+                await self.conn.commit()
+            return
+
+        for key, params, row in rows:
+            if replace or (table, key) not in self.pending:
+                self.pending[(table, key)] = (statement, params, row)
+        if len(self.pending) >= self.flush_size:
+            self._flush_soon()
+        else:
+            self._flush_later()
+
+    async def read(self, table: str, key: Any, query: str) -> Optional[Tuple]:
+        """Return the row whose primary key is ``key`` in ``table``, as selected by
+        ``query`` (given ``key`` as parameter) unless a write to it is pending"""
+
+        for writes in (self.pending, self.flushing):
+            write = writes.get((table, key))
+            if write is not None:
+                return write[2]
+        cursor = await self.conn.execute(query, (key,))
+        row = await cursor.fetchone()
+        return None if row is None else tuple(row)
+
+    def _flush_soon(self) -> None:
+        task = asyncio.create_task(self.flush())
+        self.flush_tasks.add(task)
+        task.add_done_callback(self.flush_tasks.discard)
+
+    def _flush_later(self) -> None:
+        if self.flush_timer is None:
+            self.flush_timer = asyncio.get_running_loop().call_later(
+                self.flush_interval, self._flush_soon
+            )
+
+    async def flush(self) -> None:
+        """Commit pending writes, in a single transaction"""
+
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        async with self.flush_lock:
+            if not self.pending:
+                return
+            self.flushing, self.pending = self.pending, {}
+            try:
+                # consecutive writes with the same statement are sent at once
+                for statement, writes in itertools.groupby(
+                    self.flushing.values(), key=lambda write: write[0]
+                ):
+                    await self.conn.executemany(
+                        statement, [params for _, params, _ in writes]
+                    )
+                await self.conn.commit()
+            except sqlite3.Error:
+                logging.exception(
+                    "Cannot write %d rows to the %s cache, will retry",
+                    len(self.flushing),
+                    self.SCHEMA_NAME,
+                )
+                self.statsd.increment(
+                    "swhfuse_cache_failed_flushes", tags={"cache": self.SCHEMA_NAME}
+                )
+                # Release the database for other processes
+                await self.conn.rollback()
+                for key, write in self.flushing.items():
+                    self.pending.setdefault(key, write)
+                self._flush_later()
+            finally:
+                self.flushing = {}
+
+
+@dataclass(slots=True)
+class CachedMetadata:
+    """Metadata of an object kept in memory by :py:class:`MetadataCache`"""
+
+    raw: str
+    """JSON serialization, as stored in SQLite"""
+    typed: Any = None
+    """typified metadata, parsed from ``raw`` on first use"""
+    nbytes: int = 0
+    """memory used by ``raw`` and ``typed``, as last measured"""
+
+    def sizeof(self) -> int:
+        return sys.getsizeof(self.raw) + deep_sizeof(self.typed)
+
 
 class MetadataCache(AbstractCache):
     """The metadata cache map each artifact to the complete metadata of the
     referenced object. This is analogous to what is available in
     ``archive/<SWHID>.json`` file (and generally used as data source for returning
     the content of those files). Artifacts are identified using their SWHIDs, or
-    in the case of origin visits, using their URLs."""
+    in the case of origin visits, using their URLs.
+
+    The most recently used objects' metadata is also kept in memory (up to
+    ``lru-maxram`` bytes), already typified, so cache hits neither query SQLite
+    nor parse JSON again. Writing to SQLite can be disabled with
+    ``write-through: false``, which makes sense with an in-memory database.
+
+    With ``compression: zstd``, the JSON of objects is stored compressed (as a
+    blob instead of text, so both can be read), see :py:mod:`swh.fuse.compression`."""
+
+    DEFAULT_LRU_MAXRAM = "64MB"
 
+    # Tables keep a rowid: clustering them by key would be slower with JSON
+    # documents, which may be large (e.g., directory listings)
     DB_SCHEMA = """
         create table if not exists metadata_cache (
-            swhid text not null primary key,
-            metadata blob,
-            date text
+            swhid blob not null primary key,  -- swhid_key()
+            metadata blob
         );
 
         create table if not exists visits_cache (
@@ -153,32 +500,96 @@ class MetadataCache(AbstractCache):
             itime timestamp  -- insertion time
         );
     """
+    SCHEMA_NAME = "metadata"
+    V1_TABLES = ("metadata_cache", "visits_cache")
+    V1_COPY = {
+        # the date column is not used anymore
+        "metadata_cache": "insert or ignore into metadata_cache "
+        "select swhid_key(swhid), metadata from metadata_cache_v1",
+        "visits_cache": "insert or ignore into visits_cache "
+        "select url, metadata, itime from visits_cache_v1",
+    }
+
+    def __init__(
+        self, conf: Dict[str, Any], conn: Optional[aiosqlite.Connection] = None
+    ):
+        super().__init__(conf, conn)
+        self.lru_maxram = parse_size(conf.get("lru-maxram", self.DEFAULT_LRU_MAXRAM))
+        self.write_through = bool(conf.get("write-through", True))
+        if not self.write_through and self.lru_maxram <= 0:
+            raise ValueError(
+                "Metadata cache write-through can only be disabled with a "
+                "positive lru-maxram"
+            )
+        self.lru: OrderedDict[bytes, CachedMetadata] = OrderedDict()
+        self.lru_used_ram = 0
+        """memory used by the metadata kept in memory, in bytes"""
+        self.codec = Codec.from_conf(conf)
+        # keys of stored metadata which cannot be decoded, to be replaced
+        self.unreadable: Set[bytes] = set()
+
+    def _remember(self, key: bytes, cached: CachedMetadata) -> None:
+        """Keep ``cached`` in memory (or update its size, if it already is), then
+        forget the least recently used metadata until it fits in ``lru-maxram``"""
+        if self.lru_maxram <= 0:
+            return
+        previous = self.lru.pop(key, None)
+        if previous is not None:
+            self.lru_used_ram -= previous.nbytes
+        cached.nbytes = cached.sizeof()
+        self.lru[key] = cached
+        self.lru_used_ram += cached.nbytes
+        while self.lru_used_ram > self.lru_maxram:
+            _, oldest = self.lru.popitem(last=False)
+            self.lru_used_ram -= oldest.nbytes
+
+    @staticmethod
+    def _typify(swhid: CoreSWHID, metadata: Any) -> Any:
+        try:
+            return typify_json(metadata, swhid.object_type.name.lower())
+        except Exception:
+            logging.exception("error with metadata=%r", metadata)
+            return None
 
     async def get(self, swhid: CoreSWHID, typify: bool = True) -> Any:
-        cursor = await self.conn.execute(
-            "select metadata from metadata_cache where swhid=?", (str(swhid),)
-        )
-        cache = await cursor.fetchone()
-        if cache:
-            metadata = json.loads(cache[0])
-            try:
-                return (
-                    typify_json(metadata, swhid.object_type.name.lower())
-                    if typify
-                    else metadata
-                )
-            except Exception:
-                logging.exception("error with metadata=%r", metadata)
-        return None
+        key = swhid_key(swhid)
+        cached = self.lru.get(key)
+        if cached is not None:
+            self.lru.move_to_end(key)
+        else:
+            cache = await self.read(
+                "metadata_cache",
+                key,
+                "select swhid, metadata from metadata_cache where swhid=?",
+            )
+            if not cache:
+                return None
+            raw = await self._decode(swhid, cache[1])
+            if raw is None:
+                self.unreadable.add(key)
+                return None
+            cached = CachedMetadata(raw)
+            if not typify:
+                self._remember(key, cached)
+
+        if not typify:
+            return json.loads(cached.raw)
+        return self._typed(key, swhid, cached)
+
+    def _typed(self, key: bytes, swhid: CoreSWHID, cached: CachedMetadata) -> Any:
+        """Return the typified metadata of ``cached``, parsing it on first use"""
+        if cached.typed is None:
+            cached.typed = self._typify(swhid, json.loads(cached.raw))
+            # measured again now that it holds typified metadata
+            self._remember(key, cached)
+        return cached.typed
 
     async def get_visits(self, url_encoded: str) -> Optional[List[Dict[str, Any]]]:
-        cursor = await self.conn.execute(
-            "select metadata, itime from visits_cache where url=?",
-            (url_encoded,),
+        cache = await self.read(
+            "visits_cache", url_encoded, "select * from visits_cache where url=?"
         )
-        cache = await cursor.fetchone()
         if cache:
-            metadata, itime = cache[0], cache[1]
+            metadata, itime = cache[1], cache[2]
             # Force-update cache with (potentially) new origin visits
             diff = datetime.now() - itime
             if diff.days >= 1:
@@ -190,42 +601,104 @@ class MetadataCache(AbstractCache):
         else:
             return None
 
-    async def set(self, swhid: CoreSWHID, metadata: Any) -> None:
-        # Fill in the date column for revisions (used as cache for history/by-date/)
-        swhid_date = ""
-        if swhid.object_type == ObjectType.REVISION:
-            try:
-                date = dateutil.parser.parse(metadata["date"])
-                swhid_date = RevisionHistoryShardByDate.DATE_FMT.format(
-                    year=date.year, month=date.month, day=date.day
-                )
-            except TypeError:
-                # for the rare case of missing/incorrect error, we'll display this
-                # obviously wrong date. This avoids further complexity in
-                # RevisionHistoryShardByDate
-                swhid_date = RevisionHistoryShardByDate.DATE_FMT.format(
-                    year=1970, month=1, day=1
-                )
+    async def _decode(self, swhid: CoreSWHID, stored: Any) -> Optional[str]:
+        """Return the JSON of metadata as stored in SQLite, decompressed if
+        needed, or None if it cannot be"""
+        if not is_compressed(stored):
+            return stored
+        if self.codec is None:
+            logging.warning("Cannot read compressed metadata of %s", swhid)
+            return None
+        try:
+            return (await self.codec.decompress_async(stored)).decode()
+        except ValueError:
+            logging.warning("Cannot decompress metadata of %s", swhid)
+            return None
 
-        await self.conn.execute(
-            "insert or ignore into metadata_cache values (?, ?, ?)",
-            (str(swhid), json.dumps(metadata), swhid_date),
-        )
-        await self.conn.commit()
+    @staticmethod
+    def _row(swhid: CoreSWHID, metadata: Any) -> Tuple[bytes, Any]:
+        return (swhid_key(swhid), json.dumps(metadata))
+
+    async def set(self, swhid: CoreSWHID, metadata: Any, replace: bool = False) -> Any:
+        """Cache ``metadata``, then return it typified (as :py:meth:`get` would,
+        without parsing it again). Existing metadata of the same object is kept,
+        unless ``replace`` is set (for example to complete partial metadata)."""
+        row = self._row(swhid, metadata)
+        if row[0] in self.unreadable:
+            self.unreadable.discard(row[0])
+            replace = True
+        cached = self.lru.get(row[0])
+        if replace or cached is None:
+            # typified in place, once serialized
+            cached = CachedMetadata(row[1], self._typify(swhid, metadata))
+            self._remember(row[0], cached)
+        else:
+            self.lru.move_to_end(row[0])
+        typed = self._typed(row[0], swhid, cached)
+        if self.write_through:
+            if self.codec is not None:
+                compressed = await self.codec.compress_async(row[1].encode())
+                row = (row[0], compressed)
+            await self.write(
+                "metadata_cache",
+                f"insert or {'replace' if replace else 'ignore'} "
+                "into metadata_cache values (?, ?)",
+                [(row[0], row, row)],
+                replace=replace,
+            )
+        return typed
+
+    async def set_many(self, items: Iterable[Tuple[CoreSWHID, Any]]) -> None:
+        """Insert many ``(swhid, metadata)`` pairs, e.g., prefetched ones. Unless
+        ``write-through`` is disabled, they are not kept in memory, so that bulk
+        inserts do not evict the objects in use."""
+        rows = []
+        for swhid, metadata in items:
+            row = self._row(swhid, metadata)
+            if not self.write_through and row[0] not in self.lru:
+                self._remember(row[0], CachedMetadata(row[1]))
+            rows.append((row[0], row, row))
+        if self.write_through:
+            if self.codec is not None:
+                compressed = await asyncio.get_running_loop().run_in_executor(
+                    None,
+                    self.codec.compress_many,
+                    [row[1].encode() for _, row, _ in rows],
+                )
+                for i, ((key, row, _), value) in enumerate(zip(rows, compressed)):
+                    row = (row[0], value)
+                    rows[i] = (key, row, row)
+            # unreadable rows are replaced, others are kept
+            for replace in (False, True):
+                group = [row for row in rows if (row[0] in self.unreadable) == replace]
+                if group:
+                    await self.write(
+                        "metadata_cache",
+                        f"insert or {'replace' if replace else 'ignore'} "
+                        "into metadata_cache values (?, ?)",
+                        group,
+                        replace=replace,
+                    )
+            self.unreadable.difference_update(key for key, _, _ in rows)
 
     async def set_visits(self, url_encoded: str, visits: List[Dict[str, Any]]) -> None:
-        await self.conn.execute(
+        row = (url_encoded, json.dumps(visits), datetime.now())
+        await self.write(
+            "visits_cache",
             "insert or replace into visits_cache values (?, ?, ?)",
-            (url_encoded, json.dumps(visits), datetime.now()),
+            [(url_encoded, row, row)],
         )
-        await self.conn.commit()
 
     async def remove(self, swhid: CoreSWHID) -> None:
-        await self.conn.execute(
+        key = swhid_key(swhid)
+        cached = self.lru.pop(key, None)
+        if cached is not None:
+            self.lru_used_ram -= cached.nbytes
+        await self.write(
+            "metadata_cache",
             "delete from metadata_cache where swhid=?",
-            (str(swhid),),
+            [(key, (key,), None)],
         )
-        await self.conn.commit()
 
 
 class BlobCache(AbstractCache):
@@ -235,39 +708,370 @@ class BlobCache(AbstractCache):
     The blob cache entry for a given content object is populated, at the latest,
     the first time the object is ``read()``-d. It might be populated earlier on
     due to prefetching, e.g., when a directory pointing to the given content is
-    listed for the first time."""
-
+    listed for the first time.
+
+    When ``maxsize`` is set, the size and accesses of each blob are tracked in
+    the ``blob_usage`` table and, once the cache outgrows ``maxsize``, blobs are
+    evicted in the background until it is 90% full. Blobs read only once are
+    evicted first (least recently used first), so that a one-pass scan does not
+    evict blobs read several times (as in a segmented LRU). Those are protected
+    up to 80% of ``maxsize``: beyond that, the least recently used ones become
+    evictable again.
+
+    With ``compression: zstd``, blobs are stored compressed (and flagged so in
+    the ``compressed`` column) unless that does not make them smaller, see
+    :py:mod:`swh.fuse.compression`. Sizes then count bytes as stored on disk."""
+
+    # blob_cache keeps a rowid: clustering it by key would be slower with
+    # large rows
     DB_SCHEMA = """
         create table if not exists blob_cache (
-            swhid text not null primary key,
-            blob blob
+            swhid blob not null primary key,  -- swhid_key()
+            blob blob,
+            compressed integer not null default 0
         );
+
+        create table if not exists blob_usage (
+            swhid blob not null primary key,  -- swhid_key()
+            size integer not null,
+            last_access real not null,  -- timestamp
+            hits integer not null default 0
+        ) without rowid;
     """
+    SCHEMA_NAME = "blob"
+    V1_TABLES = ("blob_cache",)
+    V1_COPY = {
+        "blob_cache": "insert or ignore into blob_cache "
+        "select swhid_key(swhid), blob, 0 from blob_cache_v1",
+    }
+
+    # Pending blobs are kept in memory until flushed
+    DEFAULT_FLUSH_SIZE = 100
+    # Eviction stops once the cache is this full (as a ratio of maxsize)
+    EVICTION_TARGET = 0.9
+    # Maximal share of maxsize used by blobs protected from eviction
+    PROTECTED_RATIO = 0.8
+
+    def __init__(
+        self, conf: Dict[str, Any], conn: Optional[aiosqlite.Connection] = None
+    ):
+        super().__init__(conf, conn)
+        self.maxsize = parse_size(conf["maxsize"]) if "maxsize" in conf else None
+        # size of tracked blobs, as last known by this process
+        self.size = 0
+        self.eviction: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.evicted_bytes = 0
+        self.codec = Codec.from_conf(conf)
+
+    async def __aenter__(self):
+        await super().__aenter__()
+        if self.maxsize is not None:
+            self.size, tracked = await self.usage()
+            if not tracked:
+                # first mount with a maxsize
+                await self.track_existing()
+                self.size, tracked = await self.usage()
+        return self
 
-    async def get(self, swhid: CoreSWHID) -> Optional[bytes]:
+    async def usage(self) -> Tuple[int, int]:
+        """Total size and number of the blobs tracked in ``blob_usage``"""
         cursor = await self.conn.execute(
-            "select blob from blob_cache where swhid=?", (str(swhid),)
+            "select coalesce(sum(size), 0), count(*) from blob_usage"
         )
-        cache = await cursor.fetchone()
-        if cache:
-            blob = cache[0]
-            return blob
-        else:
-            return None
+        row = await cursor.fetchone()
+        return (row[0], row[1]) if row else (0, 0)
 
-    async def set(self, swhid: CoreSWHID, blob: bytes) -> None:
+    async def __aexit__(self, type=None, val=None, tb=None) -> None:
+        if self.eviction is not None:
+            self.eviction.cancel()
+        await super().__aexit__(type, val, tb)
+
+    async def track_existing(self) -> None:
+        """Track blobs stored before ``maxsize`` was set. This scans the whole
+        cache, so it is only done while no blob is tracked yet."""
         await self.conn.execute(
-            "insert into blob_cache values (?, ?)", (str(swhid), blob)
+            "insert or ignore into blob_usage "
+            "select swhid, length(blob), 0, 0 from blob_cache"
         )
         await self.conn.commit()
 
+    async def get(self, swhid: CoreSWHID) -> Optional[FileContent]:
+        blob = await self.lookup(swhid)
+        if blob is None:
+            self.misses += 1
+            self.statsd.increment("swhfuse_blob_cache_misses")
+            return None
+        self.hits += 1
+        self.statsd.increment("swhfuse_blob_cache_hits")
+        if self.maxsize is not None:
+            # An access already pending for this blob is recent enough. It is
+            # queued apart from the insertion of the blob's row, which it follows.
+            key = swhid_key(swhid)
+            await self.write(
+                "blob_usage",
+                "update blob_usage set hits = hits + 1, last_access = ? "
+                "where swhid = ?",
+                [((key, "hit"), (time.time(), key), None)],
+                replace=False,
+            )
+        return blob
+
+    async def set(self, swhid: CoreSWHID, blob: bytes) -> None:
+        size = await self.store(swhid, blob)
+        if self.maxsize is not None:
+            key = swhid_key(swhid)
+            await self.write(
+                "blob_usage",
+                "insert or replace into blob_usage values (?, ?, ?, 0)",
+                [(key, (key, size, time.time()), None)],
+            )
+            self.size += size
+            if self.size > self.maxsize and self.eviction is None:
+                self.eviction = asyncio.create_task(self.evict())
+
     async def remove(self, swhid: CoreSWHID) -> None:
-        await self.conn.execute(
-            "delete from blob_cache where swhid=?",
-            (str(swhid),),
+        await self.discard(swhid)
+        key = swhid_key(swhid)
+        await self.write(
+            "blob_usage", "delete from blob_usage where swhid=?", [(key, (key,), None)]
+        )
+
+    async def lookup(self, swhid: CoreSWHID) -> Optional[FileContent]:
+        cache = await self.read(
+            "blob_cache",
+            swhid_key(swhid),
+            "select swhid, blob, compressed from blob_cache where swhid=?",
+        )
+        if not cache:
+            return None
+        blob, compressed = cache[1], cache[2]
+        if not compressed:
+            return blob
+        if self.codec is None:
+            logging.warning("Cannot read compressed blob %s", swhid)
+            return None
+        try:
+            return await self.codec.decompress_async(blob)
+        except ValueError:
+            logging.warning("Cannot decompress blob %s", swhid)
+            return None
+
+    async def store(self, swhid: CoreSWHID, blob: bytes) -> int:
+        """Store ``blob``, and return how many bytes it takes once stored.
+
+        Blobs are only stored after a cache miss: a stored blob is replaced, as
+        it could not be read (e.g., compressed with another dictionary)."""
+        row = (swhid_key(swhid), blob, 0)
+        if self.codec is not None:
+            compressed = await self.codec.compress_async(blob)
+            # incompressible blobs (e.g., archives or images) are stored as is
+            if len(compressed) < len(blob):
+                row = (row[0], compressed, 1)
+        await self.write(
+            "blob_cache",
+            "insert or replace into blob_cache (swhid, blob, compressed) "
+            "values (?, ?, ?)",
+            [(row[0], row, row)],
+        )
+        return len(row[1])
+
+    async def discard(self, swhid: CoreSWHID) -> None:
+        key = swhid_key(swhid)
+        await self.write(
+            "blob_cache", "delete from blob_cache where swhid=?", [(key, (key,), None)]
+        )
+
+    async def evict(self) -> None:
+        """Remove blobs until the cache fits in ``EVICTION_TARGET * maxsize``"""
+        assert self.maxsize is not None
+        try:
+            await self.flush()
+            # other processes sharing the cache may have added or evicted blobs
+            self.size, _ = await self.usage()
+            if self.size <= self.maxsize:
+                return
+
+            # Blobs read again since they were stored (hits count reads from the
+            # cache) are protected, up to PROTECTED_RATIO of the cache: the least
+            # recently used ones beyond that go back to probation, so they
+            # cannot stay forever once they are not read
+            protected = 0
+            demoted = []
+            cursor = await self.conn.execute(
+                "select swhid, size from blob_usage where hits >= 1 "
+                "order by last_access desc"
+            )
+            async for swhid, size in cursor:
+                protected += size
+                if protected > self.PROTECTED_RATIO * self.maxsize:
+                    demoted.append((swhid,))
+            await cursor.close()
+            await self.conn.executemany(
+                "update blob_usage set hits = 0 where swhid = ?", demoted
+            )
+
+            target = self.EVICTION_TARGET * self.maxsize
+            victims = []
+            cursor = await self.conn.execute(
+                "select swhid, size from blob_usage order by hits >= 1, last_access"
+            )
+            async for swhid, size in cursor:
+                if self.size <= target:
+                    break
+                victims.append(key_swhid(swhid))
+                self.size -= size
+                self.evicted_bytes += size
+                self.statsd.increment("swhfuse_blob_cache_evicted_bytes", size)
+            await cursor.close()
+
+            for swhid in victims:
+                await self.remove(swhid)
+            await self.flush()
+            await self.conn.commit()
+        except Exception:
+            logging.exception("Cannot evict blobs from the cache")
+        finally:
+            self.eviction = None
+
+
+class FileBlobCache(BlobCache):
+    """Blob cache storing each blob in its own file, named by the blob's SHA1-git
+    and sharded in sub-directories by its first bytes (``ab/cd/abcd...``).
+
+    Blobs are written to a temporary file then renamed, so concurrent SwhFS
+    processes sharing the directory never see partial blobs. They are read with
+    ``mmap``, so reading a slice does not copy the whole blob. Blobs of at most
+    ``small-blob-size`` bytes are stored in the SQLite database instead, as by
+    :py:class:`BlobCache`, to avoid creating many tiny files.
+
+    Compressed blobs are stored in files named with a ``.zst`` suffix, and read
+    (then decompressed) in a worker thread instead of being mapped."""
+
+    DEFAULT_SMALL_BLOB_SIZE = 4096
+
+    def __init__(
+        self, conf: Dict[str, Any], conn: Optional[aiosqlite.Connection] = None
+    ):
+        super().__init__(conf, conn)
+        self.directory = Path(conf["directory"])
+        self.small_blob_size = int(
+            conf.get("small-blob-size", self.DEFAULT_SMALL_BLOB_SIZE)
+        )
+
+    def blob_path(self, swhid: CoreSWHID, compressed: bool = False) -> Path:
+        hex_id = swhid.object_id.hex()
+        name = f"{hex_id}.zst" if compressed else hex_id
+        return self.directory / hex_id[:2] / hex_id[2:4] / name
+
+    @staticmethod
+    def _map(path: Path) -> FileContent:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # empty files cannot be mapped
+                return b""
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def _store(path: Path, blob: bytes) -> None:
+        if path.exists():
+            # blobs are immutable: someone else already stored it
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(blob)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _list_files(self) -> List[Tuple[bytes, int, float]]:
+        """Return the :py:func:`swhid_key`, size and modification time of stored
+        files"""
+        files = []
+        for path in self.directory.glob("??/??/*"):
+            if path.name.startswith("."):
+                # being written
+                continue
+            try:
+                stat = path.stat()
+                swhid = CoreSWHID(
+                    object_type=ObjectType.CONTENT,
+                    object_id=bytes.fromhex(path.name.removesuffix(".zst")),
+                )
+            except (OSError, ValueError):
+                continue
+            files.append((swhid_key(swhid), stat.st_size, stat.st_mtime))
+        return files
+
+    async def track_existing(self) -> None:
+        await super().track_existing()
+        loop = asyncio.get_running_loop()
+        files = await loop.run_in_executor(None, self._list_files)
+        await self.conn.executemany(
+            "insert or ignore into blob_usage values (?, ?, ?, 0)", files
         )
         await self.conn.commit()
 
+    def _load(self, swhid: CoreSWHID) -> Optional[FileContent]:
+        """Read a blob stored as a file, possibly compressed"""
+        try:
+            return self._map(self.blob_path(swhid))
+        except FileNotFoundError:
+            pass
+        try:
+            data = self.blob_path(swhid, compressed=True).read_bytes()
+        except FileNotFoundError:
+            return None
+        if self.codec is None:
+            raise ValueError("compression is disabled")
+        return self.codec.decompress(data)
+
+    def _compress_and_store(self, swhid: CoreSWHID, blob: bytes) -> int:
+        if self.codec is not None:
+            data = self.codec.compress(blob)
+            if len(data) < len(blob):
+                self._store(self.blob_path(swhid, compressed=True), data)
+                return len(data)
+        self._store(self.blob_path(swhid), blob)
+        return len(blob)
+
+    async def lookup(self, swhid: CoreSWHID) -> Optional[FileContent]:
+        loop = asyncio.get_running_loop()
+        try:
+            blob = await loop.run_in_executor(None, self._load, swhid)
+        except ValueError:
+            logging.warning("Cannot decompress blob %s", swhid)
+            # the blob fetched instead is stored under the name it will have
+            path = self.blob_path(swhid, compressed=True)
+            await loop.run_in_executor(None, path.unlink, True)
+            return None
+        if blob is None:
+            return await super().lookup(swhid)
+        return blob
+
+    async def store(self, swhid: CoreSWHID, blob: bytes) -> int:
+        if len(blob) <= self.small_blob_size:
+            return await super().store(swhid, blob)
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                None, self._compress_and_store, swhid, blob
+            )
+        except OSError:
+            logging.exception("Cannot store blob %s in %s", swhid, self.directory)
+            return 0
+
+    async def discard(self, swhid: CoreSWHID) -> None:
+        loop = asyncio.get_running_loop()
+        for compressed in (False, True):
+            path = self.blob_path(swhid, compressed)
+            await loop.run_in_executor(None, path.unlink, True)
+        await super().discard(swhid)
+
 
 class NoopBlobCache(BlobCache):
     """This does not cache anything at all: use it to save some memory, if you have
@@ -287,7 +1091,7 @@ class NoopBlobCache(BlobCache):
     async def __aexit__(self, type=None, val=None, tb=None) -> None:
         return None
 
-    async def get(self, swhid: CoreSWHID) -> Optional[bytes]:
+    async def get(self, swhid: CoreSWHID) -> Optional[FileContent]:
         return None
 
     async def set(self, swhid: CoreSWHID, blob: bytes) -> None:
@@ -296,90 +1100,107 @@ class NoopBlobCache(BlobCache):
     async def remove(self, swhid: CoreSWHID) -> None:
         return None
 
+    async def flush(self) -> None:
+        return None
+
 
 class HistoryCache(AbstractCache):
     """The history cache map SWHIDs of type ``rev`` to a list of ``rev`` SWHIDs
     corresponding to all its revision ancestors, sorted in reverse topological
     order. As the parents cache, the history cache is lazily populated and can
-    be prefetched. To efficiently store the ancestor lists, the history cache
-    represents ancestors as graph edges (a pair of two SWHID nodes), meaning the
-    history cache is shared amongst all revisions parents."""
+    be prefetched.
+
+    Each fetched history is stored as a compact binary
+    :py:class:`swh.fuse.history.HistoryGraph`, which also holds revisions' dates.
+    The most recently used graphs are kept in memory, where the history of any
+    revision they contain can be listed without a new fetch. Their memory is
+    reported to ``track`` (see :py:meth:`DirEntryCache.track`) each time they are
+    used, as their indexes are built on demand."""
 
     DB_SCHEMA = """
-        create table if not exists history_graph (
-            src text not null,
-            dst text not null,
-            unique(src, dst)
+        create table if not exists history (
+            root blob not null primary key,  -- swhid_key()
+            graph blob  -- HistoryGraph.to_bytes()
         );
-        create index if not exists idx_history on history_graph(src);
     """
+    SCHEMA_NAME = "history"
+    # history_graph, which stored edges as pairs of SWHIDs, lacks revisions' dates:
+    # those histories will be fetched again
+    V1_TABLES = ("history_graph",)
 
-    HISTORY_REC_QUERY = """
-        with recursive
-        dfs(node) AS (
-            values(?)
-            union
-            select history_graph.dst
-            from history_graph
-            join dfs on history_graph.src = dfs.node
-        )
-        -- Do not keep the root node since it is not an ancestor
-        select * from dfs limit -1 offset 1
-    """
+    # Number of history graphs kept in memory
+    IN_MEMORY_GRAPHS = 16
 
-    async def get(self, swhid: CoreSWHID) -> Optional[List[CoreSWHID]]:
-        cursor = await self.conn.execute(
-            self.HISTORY_REC_QUERY,
-            (str(swhid),),
-        )
-        cache = await cursor.fetchall()
-        if not cache:
+    def __init__(
+        self, conf: Dict[str, Any], conn: Optional[aiosqlite.Connection] = None
+    ):
+        super().__init__(conf, conn)
+        self.graphs: OrderedDict[bytes, HistoryGraph] = OrderedDict()
+        # memory used by each graph, as last reported to track
+        self.sizes: Dict[bytes, int] = {}
+        self.track: Callable[[int], None] = lambda nbytes: None
+
+    def _remember(self, root: bytes, graph: HistoryGraph) -> None:
+        self.graphs[root] = graph
+        self.graphs.move_to_end(root)
+        while len(self.graphs) > self.IN_MEMORY_GRAPHS:
+            evicted, _ = self.graphs.popitem(last=False)
+            self.track(-self.sizes.pop(evicted, 0))
+
+    def _measure(self, root: bytes, graph: HistoryGraph) -> None:
+        """Report the memory used by ``graph`` since it was last measured"""
+        if root in self.graphs:
+            nbytes = graph.sizeof()
+            self.track(nbytes - self.sizes.get(root, 0))
+            self.sizes[root] = nbytes
+
+    async def get(self, swhid: CoreSWHID) -> Optional[History]:
+        root = swhid_key(swhid)
+        graph = self.graphs.get(root)
+        if graph is not None:
+            self.graphs.move_to_end(root)
+            history = graph.history()
+            self._measure(root, graph)
+            return history
+
+        for graph_root, graph in reversed(self.graphs.items()):
+            node = graph.node(swhid)
+            if node is not None:
+                history = graph.history(node)
+                self._measure(graph_root, graph)
+                return history
+
+        row = await self.read("history", root, "select * from history where root=?")
+        if row is None:
             return None
-        history = []
-        for row in cache:
-            parent = row[0]
-            try:
-                history.append(CoreSWHID.from_string(parent))
-            except ValidationError:
-                logging.warning("Cannot parse object from history cache: %s", parent)
+        try:
+            graph = HistoryGraph.from_bytes(row[1])
+        except (ValueError, struct.error):
+            logging.warning("Cannot load history of %s from cache", swhid)
+            return None
+        self._remember(root, graph)
+        history = graph.history()
+        self._measure(root, graph)
         return history
 
-    async def get_with_date_prefix(
-        self, swhid: CoreSWHID, date_prefix: str
-    ) -> List[Tuple[CoreSWHID, str]]:
-        cursor = await self.conn.execute(
-            f"""
-            select swhid, date from ( {self.HISTORY_REC_QUERY} ) as history
-            join metadata_cache on history.node = metadata_cache.swhid
-            where metadata_cache.date like '{date_prefix}%'
-            """,
-            (str(swhid),),
+    async def set(self, swhid: CoreSWHID, graph: HistoryGraph) -> History:
+        """Cache the history graph below ``swhid``, then return its history"""
+        row = (swhid_key(swhid), graph.to_bytes())
+        await self.write(
+            "history",
+            "insert or replace into history values (?, ?)",
+            [(row[0], row, row)],
         )
-        cache = await cursor.fetchall()
-        if not cache:
-            return []
-
-        history = []
-        for row in cache:
-            parent, date = row[0], row[1]
-            try:
-                history.append((CoreSWHID.from_string(parent), date))
-            except ValidationError:
-                logging.warning("Cannot parse object from history cache: %s", parent)
+        self._remember(row[0], graph)
+        history = graph.history()
+        self._measure(row[0], graph)
         return history
 
-    async def set(self, history: List[Tuple[str, str]]) -> None:
-        if history:
-            await self.conn.executemany(
-                "insert or ignore into history_graph values (?, ?)", history
-            )
-            await self.conn.commit()
-
 
 class DirEntryCache:
-    """The direntry cache map inode representing directories to the entries
-    they contain. Each entry comes with its name as well as file attributes
-    (i.e., all its needed to perform a detailed directory listing).
+    """The direntry cache map directories (see :py:meth:`key`) to the entries
+    they contain, indexed by name. Each entry comes with its name as well as file
+    attributes (i.e., all its needed to perform a detailed directory listing).
 
     Additional attributes of each directory entry should be looked up on a entry
     by entry basis, possibly hitting other caches.
@@ -388,16 +1209,30 @@ class DirEntryCache:
     content of the directory is listed. More aggressive prefetching might
     happen. For instance, when first opening a dir a recursive listing of it can
     be retrieved from the remote backend and used to recursively populate the
-    direntry cache for all (transitive) sub-directories."""
+    direntry cache for all (transitive) sub-directories.
+
+    Its ``maxram`` budget covers the memory used by cached listings (measured
+    with :py:attr:`DirListing.nbytes`), and by structures the cache cannot evict
+    but is told about (see :py:meth:`track`): the inode table with its entries,
+    and the buffers of open files. Least recently used listings are evicted
+    until all of them fit in the budget.
+
+    Each entry is accounted once, by the inode table, which keeps it alive as
+    long as the kernel refers to it. Entries created by a listing but never
+    handed to the kernel are not accounted: large directories use lazy
+    listings, which only create the entries the kernel reads or looks up."""
 
     @dataclass
     class LRU(OrderedDict):
         max_ram: int
         used_ram: int = field(init=False, default=0)
+        """memory used by cached listings, as last measured"""
+        reserved_ram: int = field(init=False, default=0)
+        """memory used outside of the cache, but within its budget"""
+        sizes: Dict[Any, int] = field(init=False, default_factory=dict)
 
         def sizeof(self, value: Any) -> int:
-            # Rough size estimate in bytes for a list of entries
-            return len(value) * 1000
+            return value.nbytes
 
         def __getitem__(self, key: Any) -> Any:
             value = super().__getitem__(key)
@@ -405,18 +1240,25 @@ class DirEntryCache:
             return value
 
         def __delitem__(self, key: Any) -> None:
-            self.used_ram -= self.sizeof(self[key])
+            self.used_ram -= self.sizes.pop(key)
             super().__delitem__(key)
 
         def __setitem__(self, key: Any, value: Any) -> None:
             if key in self:
                 self.move_to_end(key)
-            else:
-                self.used_ram += self.sizeof(value)
-
             super().__setitem__(key, value)
-
-            while self.used_ram > self.max_ram and self:
+            self.measure(key)
+
+        def measure(self, key: Any) -> None:
+            """Update the accounted size of a cached listing, then evict listings
+            until the budget is met"""
+            size = self.sizeof(super().__getitem__(key))
+            self.used_ram += size - self.sizes.get(key, 0)
+            self.sizes[key] = size
+            self.evict()
+
+        def evict(self) -> None:
+            while self.used_ram + self.reserved_ram > self.max_ram and self:
                 oldest = next(iter(self))
                 del self[oldest]
 
@@ -430,25 +1272,58 @@ class DirEntryCache:
         unit = m.group(2).upper()
 
         if unit == "%":
-            max_ram = int(num * virtual_memory().available / 100)
+            # Relative to the total memory, which (unlike the available memory)
+            # does not depend on what else is running when mounting
+            max_ram = int(num * virtual_memory().total / 100)
         else:
-            units = {"B": 1, "KB": 10**3, "MB": 10**6, "GB": 10**9}
-            max_ram = int(float(num) * units[unit])
+            max_ram = int(float(num) * SIZE_UNITS[unit])
 
         self.lru_cache = self.LRU(max_ram)
+        self.statsd = Statsd()
+
+    @property
+    def max_ram(self) -> int:
+        """Memory budget, in bytes"""
+        return self.lru_cache.max_ram
+
+    @property
+    def used_ram(self) -> int:
+        """Memory used by cached listings and tracked structures, in bytes"""
+        return self.lru_cache.used_ram + self.lru_cache.reserved_ram
+
+    def track(self, nbytes: int) -> None:
+        """Account for ``nbytes`` (released if negative) of memory used outside
+        of the cache but within its budget, evicting listings if needed"""
+        self.lru_cache.reserved_ram += nbytes
+        if nbytes > 0:
+            self.lru_cache.evict()
+
+    @staticmethod
+    def key(direntry: FuseDirEntry) -> Hashable:
+        """Return the key under which the listing of ``direntry`` is cached: its
+        inode, which is shared by interchangeable entries (e.g., the same archived
+        directory reached from several revisions), so they also share their
+        listing and its entries."""
+
+        return direntry.inode
+
+    def get(self, direntry: FuseDirEntry) -> Optional[DirListing]:
+        key = self.key(direntry)
+        if key not in self.lru_cache:
+            return None
+        return self.lru_cache[key]
 
-    def get(self, direntry: FuseDirEntry) -> Optional[List[FuseEntry]]:
-        return self.lru_cache.get(direntry.inode, None)
-
-    def set(self, direntry: FuseDirEntry, entries: List[FuseEntry]) -> None:
+    def set(self, direntry: FuseDirEntry, listing: DirListing) -> None:
         if isinstance(direntry, (CacheDir, CacheDir.ArtifactShardBySwhid, OriginDir)):
             # The `cache/` and `origin/` directories are populated on the fly
             pass
         else:
-            self.lru_cache[direntry.inode] = entries
+            self.lru_cache[self.key(direntry)] = listing
+            self.statsd.gauge("swhfuse_direntry_used_bytes", self.used_ram)
+            self.statsd.gauge("swhfuse_direntry_budget_bytes", self.max_ram)
 
     def invalidate(self, direntry: FuseDirEntry) -> None:
         try:
-            del self.lru_cache[direntry.inode]
+            del self.lru_cache[self.key(direntry)]
         except KeyError:
             pass
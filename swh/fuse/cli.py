@@ -8,6 +8,7 @@
 import os
 from pathlib import Path
 import re
+import shutil
 from typing import Any, Dict
 
 import click
@@ -38,6 +39,30 @@ DEFAULT_CONFIG: Dict[str, Any] = {
         "auth-token": None,
     },
     "json-indent": 2,
+    # Timeouts are in seconds
+    "kernel-cache": {
+        # archived objects are immutable
+        "archive": {
+            "entry-timeout": 365 * 24 * 3600,
+            "attr-timeout": 365 * 24 * 3600,
+            "negative-timeout": 365 * 24 * 3600,
+            "keep-cache": True,
+        },
+        # new origin visits may appear
+        "origin": {
+            "entry-timeout": 60,
+            "attr-timeout": 60,
+            "negative-timeout": 0,
+            "keep-cache": True,
+        },
+        # cached objects may be added or removed at any time
+        "cache": {
+            "entry-timeout": 1,
+            "attr-timeout": 1,
+            "negative-timeout": 0,
+            "keep-cache": True,
+        },
+    },
 }
 
 
@@ -221,10 +246,105 @@ def clean(ctx):
 
     def rm_cache(conf, cache_name):
         try:
-            Path(conf["cache"][cache_name]["path"]).unlink()
-        except (FileNotFoundError, KeyError):
-            pass
+            path = conf["cache"][cache_name]["path"]
+        except KeyError:
+            return
+        # SQLite's write-ahead log and its index come along with the database
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                Path(path + suffix).unlink()
+            except FileNotFoundError:
+                pass
 
     conf = ctx.obj["config"]
     for cache_name in ["blob", "metadata"]:
         rm_cache(conf, cache_name)
+
+    blob_directory = conf["cache"].get("blob", {}).get("directory")
+    if blob_directory:
+        shutil.rmtree(blob_directory, ignore_errors=True)
+
+
+@fuse.command(name="train-dictionary")
+@click.argument(
+    "output",
+    required=True,
+    metavar="OUTPUT",
+    type=click.Path(dir_okay=False, writable=True),
+)
+@click.option(
+    "--cache",
+    "cache_name",
+    type=click.Choice(["blob", "metadata"]),
+    default="blob",
+    show_default=True,
+    help="on-disk cache whose values are sampled",
+)
+@click.option(
+    "--samples",
+    default=10_000,
+    show_default=True,
+    help="maximal number of values to sample",
+)
+@click.option(
+    "--max-sample-size",
+    default=16_384,
+    show_default=True,
+    help="only sample values of at most that many bytes",
+)
+@click.option(
+    "--size",
+    default=110 * 1024,
+    show_default=True,
+    help="maximal size of the dictionary, in bytes",
+)
+@click.pass_context
+def train_dictionary(ctx, output, cache_name, samples, max_sample_size, size):
+    """Train a zstd dictionary on values sampled from an on-disk cache, and write
+    it to OUTPUT.
+
+    Small values (source files, directory listings) compress much better with a
+    dictionary: set OUTPUT as ``compression-dictionary`` of the cache, see
+    :ref:`configuration <swh-fuse-config>`. Values already stored compressed
+    without it cannot be read anymore.
+
+    Example:
+
+    .. code-block:: bash
+
+      $ swh fs train-dictionary --cache metadata ~/.cache/swh/fuse/metadata.zdict
+
+    """
+    import logging
+    import sqlite3
+
+    from swh.fuse.compression import is_compressed
+    from swh.fuse.compression import train_dictionary as train
+
+    path = ctx.obj["config"]["cache"][cache_name].get("path")
+    if path is None or not os.path.isfile(path):
+        logging.error("The %s cache is not stored in a file", cache_name)
+        ctx.exit(1)
+
+    query = {
+        # compressed values are blobs, as opposed to raw JSON
+        "metadata": "select metadata from metadata_cache "
+        "where typeof(metadata) = 'text' and length(metadata) <= ? "
+        "order by random() limit ?",
+        "blob": "select blob from blob_cache where length(blob) <= ? "
+        "order by random() limit ?",
+    }[cache_name]
+    with sqlite3.connect(f"file:{path}?mode=ro", uri=True) as conn:
+        rows = conn.execute(query, (max_sample_size, samples)).fetchall()
+    values = [
+        value.encode() if isinstance(value, str) else value
+        for (value,) in rows
+        if not is_compressed(value)
+    ]
+
+    try:
+        dictionary = train(values, size)
+    except ValueError as e:
+        logging.error("Cannot train a dictionary on %d values: %s", len(values), e)
+        ctx.exit(1)
+    Path(output).write_bytes(dictionary)
@@ -0,0 +1,127 @@
+# Copyright (C) 2025  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""
+Cache compression
+-----------------
+
+Optional zstd compression of the values stored by on-disk caches, which requires
+the ``compression`` dependency group (``pip install swh-fuse[compression]``).
+
+Small values (most source files, directory listings' JSON) compress poorly on
+their own, because each of them is too short to contain repetitions. A
+dictionary trained on samples of such values (see :py:func:`train_dictionary`)
+provides those repetitions: zstd frames record the ID of the dictionary they
+were compressed with, and cannot be decompressed without it.
+"""
+
+import asyncio
+from pathlib import Path
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+DEFAULT_LEVEL = 3
+# Default size of trained dictionaries, as recommended by zstd
+DEFAULT_DICTIONARY_SIZE = 110 * 1024
+# The magic number starting zstd frames
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+class Codec:
+    """Compresses and decompresses cached values with zstd, possibly using a
+    trained dictionary. Methods can be called from several threads."""
+
+    def __init__(self, level: int = DEFAULT_LEVEL, dictionary: Optional[str] = None):
+        import zstandard
+
+        self.zstd = zstandard
+        self.level = level
+        self.dictionary = (
+            zstandard.ZstdCompressionDict(Path(dictionary).read_bytes())
+            if dictionary
+            else None
+        )
+        if self.dictionary is not None:
+            # computed once instead of by each thread's compressor
+            self.dictionary.precompute_compress(level=level)
+        # zstandard (de)compressors cannot be shared between threads
+        self.local = threading.local()
+
+    @classmethod
+    def from_conf(cls, conf: Dict[str, Any]) -> Optional["Codec"]:
+        """Return the codec configured by a cache's ``compression``,
+        ``compression-level`` and ``compression-dictionary`` entries, if any"""
+        compression = conf.get("compression")
+        if not compression:
+            return None
+        if compression != "zstd":
+            raise ValueError(f"Unsupported cache compression: {compression}")
+        return cls(
+            level=int(conf.get("compression-level", DEFAULT_LEVEL)),
+            dictionary=conf.get("compression-dictionary"),
+        )
+
+    def _compressor(self):
+        compressor = getattr(self.local, "compressor", None)
+        if compressor is None:
+            compressor = self.zstd.ZstdCompressor(
+                level=self.level, dict_data=self.dictionary
+            )
+            self.local.compressor = compressor
+        return compressor
+
+    def _decompressor(self):
+        decompressor = getattr(self.local, "decompressor", None)
+        if decompressor is None:
+            decompressor = self.zstd.ZstdDecompressor(dict_data=self.dictionary)
+            self.local.decompressor = decompressor
+        return decompressor
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor().compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        """Decompress ``data``, or raise :py:exc:`ValueError` if it is corrupted
+        or was compressed with another dictionary"""
+        try:
+            return self._decompressor().decompress(data)
+        except self.zstd.ZstdError as e:
+            raise ValueError(str(e)) from e
+
+    def compress_many(self, values: List[bytes]) -> List[bytes]:
+        compressor = self._compressor()
+        return [compressor.compress(value) for value in values]
+
+    async def compress_async(self, data: bytes) -> bytes:
+        """Compress ``data`` in a worker thread, not to block the event loop"""
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.compress, data
+        )
+
+    async def decompress_async(self, data: bytes) -> bytes:
+        """Decompress ``data`` in a worker thread, not to block the event loop"""
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.decompress, data
+        )
+
+
+def is_compressed(value: Any) -> bool:
+    """Whether a value read from a cache is a zstd frame"""
+    return isinstance(value, bytes) and value.startswith(ZSTD_MAGIC)
+
+
+def train_dictionary(
+    samples: Sequence[bytes],
+    size: int = DEFAULT_DICTIONARY_SIZE,
+    level: int = DEFAULT_LEVEL,
+) -> bytes:
+    """Train a zstd dictionary of at most ``size`` bytes on ``samples``, or raise
+    :py:exc:`ValueError` if they are too few or too small"""
+    import zstandard
+
+    try:
+        return zstandard.train_dictionary(size, list(samples), level=level).as_bytes()
+    except zstandard.ZstdError as e:
+        raise ValueError(str(e)) from e
@@ -3,29 +3,33 @@
 # License: GNU General Public License version 3, or any later version
 # See top-level LICENSE file for more information
 
+from bisect import bisect_left
 from dataclasses import dataclass, field
 import json
 import logging
 import os
 from pathlib import Path
 import re
-from typing import Any, AsyncIterator, Dict, List, Optional, cast
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple, cast
 
 from swh.fuse.fs.entry import (
+    DirListing,
     EntryMode,
+    FileContent,
     FuseDirEntry,
     FuseEntry,
     FuseFileEntry,
     FuseSymlinkEntry,
+    LazyDirListing,
+    deep_sizeof,
 )
 from swh.model.from_disk import DentryPerms
-from swh.model.hashutil import hash_to_bytes, hash_to_hex
 from swh.model.swhids import CoreSWHID, ObjectType
 
 SWHID_REGEXP = r"swh:1:(cnt|dir|rel|rev|snp):[0-9a-f]{40}"
 
 
-@dataclass
+@dataclass(slots=True)
 class Content(FuseFileEntry):
     """Software Heritage content artifact.
 
@@ -38,23 +42,27 @@ class Content(FuseFileEntry):
     not meaningful (e.g., `0x644`)."""
 
     swhid: CoreSWHID
-    prefetch: Any = None
-    """optional prefetched metadata used to set entry attributes"""
+    length: Optional[int] = None
+    """content size, when already known from the parent directory listing"""
 
-    async def get_content(self) -> bytes:
+    def inode_key(self) -> Optional[Tuple[Any, ...]]:
+        # Permissions are set by the parent directory, so they are part of the key
+        return ("cnt", self.swhid, self.mode)
+
+    async def get_content(self) -> FileContent:
         data = await self.fuse.get_blob(self.swhid)
-        if not self.prefetch:
-            self.prefetch = {"length": len(data)}
+        if self.length is None:
+            self.length = len(data)
         return data
 
     async def size(self) -> int:
-        if self.prefetch:
-            return self.prefetch["length"]
+        if self.length is not None:
+            return self.length
         else:
-            return await super().size()
+            return await super(Content, self).size()
 
 
-@dataclass
+@dataclass(slots=True)
 class Directory(FuseDirEntry):
     """Software Heritage directory artifact.
 
@@ -69,75 +77,89 @@ class Directory(FuseDirEntry):
 
     swhid: CoreSWHID
 
+    def inode_key(self) -> Optional[Tuple[Any, ...]]:
+        # Symlinks to the archive are relative, hence depend on the entry depth
+        return (type(self).__name__, self.swhid, self.depth)
+
+    async def compute_listing(self) -> DirListing:
+        # Directories may have many entries: only create those requested
+        metadata = await self.fuse.get_metadata(self.swhid)
+        return LazyDirListing(
+            [entry["name"] for entry in metadata],
+            lambda position: self.create_entry(metadata[position]),
+            source_nbytes=deep_sizeof(metadata),
+        )
+
     async def compute_entries(self) -> AsyncIterator[FuseEntry]:
         metadata = await self.fuse.get_metadata(self.swhid)
         for entry in metadata:
-            name = entry["name"]
-            swhid = entry["target"]
-            mode = (
-                # Archived permissions for directories are always set to
-                # 0o040000 so use a read-only permission instead
-                int(EntryMode.RDONLY_DIR)
-                if swhid.object_type == ObjectType.DIRECTORY
-                else entry["perms"]
-            )
+            yield await self.create_entry(entry)
+
+    async def create_entry(self, entry: Dict[str, Any]) -> FuseEntry:
+        name = entry["name"]
+        swhid = entry["target"]
+        mode = (
+            # Archived permissions for directories are always set to
+            # 0o040000 so use a read-only permission instead
+            int(EntryMode.RDONLY_DIR)
+            if swhid.object_type == ObjectType.DIRECTORY
+            else entry["perms"]
+        )
 
-            # 1. Symlink (check symlink first because condition is less restrictive)
-            if mode == DentryPerms.symlink:
-                target = b""
-                try:
-                    # Symlink target is stored in the blob content
-                    target = await self.fuse.get_blob(swhid)
-                except Exception:
-                    self.fuse.logger.exception(
-                        "while adding a symlink in %s", self.swhid
-                    )
+        # 1. Symlink (check symlink first because condition is less restrictive)
+        if mode == DentryPerms.symlink:
+            target = b""
+            try:
+                # Symlink target is stored in the blob content
+                target = bytes(await self.fuse.get_blob(swhid))
+            except Exception:
+                self.fuse.logger.exception("while adding a symlink in %s", self.swhid)
 
-                yield self.create_child(
-                    FuseSymlinkEntry,
-                    name=name,
-                    target=target,
-                )
-            # 2. Regular file
-            elif swhid.object_type == ObjectType.CONTENT:
-                yield self.create_child(
-                    Content,
-                    name=name,
-                    mode=mode,
-                    swhid=swhid,
-                    # The directory API has extra info we can use to set
-                    # attributes without additional Software Heritage API call
-                    prefetch=entry,
-                )
-            # 3. Regular directory
-            elif swhid.object_type == ObjectType.DIRECTORY:
-                yield self.create_child(
-                    Directory,
-                    name=name,
-                    mode=mode,
-                    swhid=swhid,
+            return self.create_child(
+                FuseSymlinkEntry,
+                name=name,
+                target=target,
+            )
+        # 2. Regular file
+        elif swhid.object_type == ObjectType.CONTENT:
+            return self.create_child(
+                Content,
+                name=name,
+                mode=mode,
+                swhid=swhid,
+                # The directory API has extra info we can use to set
+                # attributes without additional Software Heritage API call
+                length=entry.get("length"),
+            )
+        # 3. Regular directory
+        elif swhid.object_type == ObjectType.DIRECTORY:
+            return self.create_child(
+                Directory,
+                name=name,
+                mode=mode,
+                swhid=swhid,
+            )
+        # 4. Submodule
+        elif swhid.object_type == ObjectType.REVISION:
+            try:
+                # Make sure the revision metadata is fetched and create a
+                # symlink to distinguish it with regular directories
+                await self.fuse.get_metadata(swhid)
+            except Exception:
+                self.fuse.logger.exception(
+                    "while symlinking to revision in %s", self.swhid
                 )
-            # 4. Submodule
-            elif swhid.object_type == ObjectType.REVISION:
-                try:
-                    # Make sure the revision metadata is fetched and create a
-                    # symlink to distinguish it with regular directories
-                    await self.fuse.get_metadata(swhid)
-                except Exception:
-                    self.fuse.logger.exception(
-                        "while symlinking to revision in %s", self.swhid
-                    )
 
-                yield self.create_child(
-                    FuseSymlinkEntry,
-                    name=name,
-                    target=Path(self.get_relative_root_path(), f"archive/{swhid}"),
-                )
-            else:
-                raise ValueError("Unknown directory entry type: {swhid.object_type}")
+            return self.create_child(
+                FuseSymlinkEntry,
+                name=name,
+                target=Path(self.get_relative_root_path(), f"archive/{swhid}"),
+            )
+        else:
+            raise ValueError(f"Unknown directory entry type: {swhid.object_type}")
 
 
-@dataclass
+@dataclass(slots=True)
 class Revision(FuseDirEntry):
     """Software Heritage revision artifact.
 
@@ -161,6 +183,9 @@ class Revision(FuseDirEntry):
 
     swhid: CoreSWHID
 
+    def inode_key(self) -> Optional[Tuple[Any, ...]]:
+        return (type(self).__name__, self.swhid, self.depth)
+
     async def compute_entries(self) -> AsyncIterator[FuseEntry]:
         metadata = await self.fuse.get_metadata(self.swhid)
         directory = metadata["directory"]
@@ -200,7 +225,7 @@ class Revision(FuseDirEntry):
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class RevisionParents(FuseDirEntry):
     """Revision virtual `parents/` directory"""
 
@@ -216,12 +241,15 @@ class RevisionParents(FuseDirEntry):
             )
 
 
-@dataclass
+@dataclass(slots=True)
 class RevisionHistory(FuseDirEntry):
     """Revision virtual `history/` directory"""
 
     swhid: CoreSWHID
 
+    def inode_key(self) -> Optional[Tuple[Any, ...]]:
+        return (type(self).__name__, self.swhid, self.depth)
+
     async def compute_entries(self) -> AsyncIterator[FuseEntry]:
         by_date_dir = cast(
             RevisionHistoryShardByDate,
@@ -250,7 +278,7 @@ class RevisionHistory(FuseDirEntry):
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class RevisionHistoryShardByDate(FuseDirEntry):
     """Revision virtual `history/by-date` sharded directory"""
 
@@ -260,42 +288,37 @@ class RevisionHistoryShardByDate(FuseDirEntry):
     DATE_FMT = "{year:04d}/{month:02d}/{day:02d}/"
     ENTRIES_REGEXP = re.compile(r"^([0-9]{2,4})|(" + SWHID_REGEXP + ")$")
 
-    async def compute_entries(self) -> AsyncIterator[FuseEntry]:
-        # ensure cache is loaded
-        await self.fuse.get_history(self.history_swhid)
-        history_cached = await self.fuse.cache.history.get_with_date_prefix(
-            self.history_swhid, date_prefix=self.prefix
-        )
+    def inode_key(self) -> Optional[Tuple[Any, ...]]:
+        return (type(self).__name__, self.history_swhid, self.prefix, self.depth)
 
-        depth = self.prefix.count("/")
-        root_path = self.get_relative_root_path()
-        sharded_dirs = set()
-
-        for swhid, sharded_name in history_cached:
-            if not sharded_name.startswith(self.prefix):
-                continue
+    async def compute_entries(self) -> AsyncIterator[FuseEntry]:
+        history = await self.fuse.get_history(self.history_swhid)
+        # year, month and day of this directory, as far as they are known
+        parts = [int(part) for part in self.prefix.split("/") if part]
 
-            if depth == 3:
+        if len(parts) == 3:
+            root_path = self.get_relative_root_path()
+            for swhid in history.on_date(*parts):
                 yield self.create_child(
                     FuseSymlinkEntry,
                     name=str(swhid),
                     target=Path(root_path, f"archive/{swhid}"),
                 )
-            # Create sharded directories
-            else:
-                next_prefix = sharded_name.split("/")[depth]
-                if next_prefix not in sharded_dirs:
-                    sharded_dirs.add(next_prefix)
-                    yield self.create_child(
-                        RevisionHistoryShardByDate,
-                        name=next_prefix,
-                        mode=int(EntryMode.RDONLY_DIR),
-                        prefix=f"{self.prefix}{next_prefix}/",
-                        history_swhid=self.history_swhid,
-                    )
-
-
-@dataclass
+        # Create sharded directories
+        else:
+            name_fmt = "{:04d}" if not parts else "{:02d}"
+            for child in history.date_children(parts):
+                next_prefix = name_fmt.format(child)
+                yield self.create_child(
+                    RevisionHistoryShardByDate,
+                    name=next_prefix,
+                    mode=int(EntryMode.RDONLY_DIR),
+                    prefix=f"{self.prefix}{next_prefix}/",
+                    history_swhid=self.history_swhid,
+                )
+
+
+@dataclass(slots=True)
 class RevisionHistoryShardByHash(FuseDirEntry):
     """Revision virtual `history/by-hash` sharded directory"""
 
@@ -305,35 +328,33 @@ class RevisionHistoryShardByHash(FuseDirEntry):
     SHARDING_LENGTH = 2
     ENTRIES_REGEXP = re.compile(r"^([a-f0-9]+)|(" + SWHID_REGEXP + ")$")
 
+    def inode_key(self) -> Optional[Tuple[Any, ...]]:
+        return (type(self).__name__, self.history_swhid, self.prefix, self.depth)
+
     async def compute_entries(self) -> AsyncIterator[FuseEntry]:
         history = await self.fuse.get_history(self.history_swhid)
 
         if self.prefix:
             root_path = self.get_relative_root_path()
-            for swhid in history:
-                if swhid.object_id.startswith(hash_to_bytes(self.prefix)):
-                    yield self.create_child(
-                        FuseSymlinkEntry,
-                        name=str(swhid),
-                        target=Path(root_path, f"archive/{swhid}"),
-                    )
+            for swhid in history.with_hash_prefix(self.prefix):
+                yield self.create_child(
+                    FuseSymlinkEntry,
+                    name=str(swhid),
+                    target=Path(root_path, f"archive/{swhid}"),
+                )
         # Create sharded directories
         else:
-            sharded_dirs = set()
-            for swhid in history:
-                next_prefix = hash_to_hex(swhid.object_id)[: self.SHARDING_LENGTH]
-                if next_prefix not in sharded_dirs:
-                    sharded_dirs.add(next_prefix)
-                    yield self.create_child(
-                        RevisionHistoryShardByHash,
-                        name=next_prefix,
-                        mode=int(EntryMode.RDONLY_DIR),
-                        prefix=next_prefix,
-                        history_swhid=self.history_swhid,
-                    )
-
-
-@dataclass
+            for next_prefix in history.hash_buckets(self.SHARDING_LENGTH):
+                yield self.create_child(
+                    RevisionHistoryShardByHash,
+                    name=next_prefix,
+                    mode=int(EntryMode.RDONLY_DIR),
+                    prefix=next_prefix,
+                    history_swhid=self.history_swhid,
+                )
+
+
+@dataclass(slots=True)
 class RevisionHistoryShardByPage(FuseDirEntry):
     """Revision virtual `history/by-page` sharded directory"""
 
@@ -344,15 +365,19 @@ class RevisionHistoryShardByPage(FuseDirEntry):
     PAGE_FMT = "{page_number:03d}"
     ENTRIES_REGEXP = re.compile(r"^([0-9]+)|(" + SWHID_REGEXP + ")$")
 
+    def inode_key(self) -> Optional[Tuple[Any, ...]]:
+        return (type(self).__name__, self.history_swhid, self.prefix, self.depth)
+
     async def compute_entries(self) -> AsyncIterator[FuseEntry]:
         history = await self.fuse.get_history(self.history_swhid)
 
         if self.prefix is not None:
             current_page = self.prefix
             root_path = self.get_relative_root_path()
-            max_idx = min(len(history), (current_page + 1) * self.PAGE_SIZE)
-            for i in range(current_page * self.PAGE_SIZE, max_idx):
-                swhid = history[i]
+            page = history[
+                current_page * self.PAGE_SIZE : (current_page + 1) * self.PAGE_SIZE
+            ]
+            for swhid in page:
                 yield self.create_child(
                     FuseSymlinkEntry,
                     name=str(swhid),
@@ -371,7 +396,7 @@ class RevisionHistoryShardByPage(FuseDirEntry):
                 )
 
 
-@dataclass
+@dataclass(slots=True)
 class Release(FuseDirEntry):
     """Software Heritage release artifact.
 
@@ -388,6 +413,9 @@ class Release(FuseDirEntry):
 
     swhid: CoreSWHID
 
+    def inode_key(self) -> Optional[Tuple[Any, ...]]:
+        return (type(self).__name__, self.swhid, self.depth)
+
     async def find_root_directory(self, swhid: CoreSWHID) -> Optional[CoreSWHID]:
         if swhid.object_type == ObjectType.RELEASE:
             metadata = await self.fuse.get_metadata(swhid)
@@ -430,7 +458,7 @@ class Release(FuseDirEntry):
             )
 
 
-@dataclass
+@dataclass(slots=True)
 class ReleaseType(FuseFileEntry):
     """Release type virtual file"""
 
@@ -440,7 +468,72 @@ class ReleaseType(FuseFileEntry):
         return str.encode(self.target_type.name.lower() + "\n")
 
 
-@dataclass
+class SnapshotBranches:
+    """Branches of a snapshot, sorted by name, so the branches and sub-directories
+    below a given prefix can be listed with range lookups. It is built once per
+    snapshot, and shared by all its ``Snapshot`` directories."""
+
+    def __init__(self, branches: Dict[str, Any]):
+        self.names = sorted(branches)
+        self.targets = [branches[name] for name in self.names]
+        # the branches' metadata is shared with the metadata cache, but outlives
+        # it once evicted from its in-memory LRU
+        self.nbytes = deep_sizeof(self.names) + deep_sizeof(self.targets)
+        """memory used by the branches, in bytes"""
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @staticmethod
+    def _after(prefix: str) -> str:
+        """Smallest string greater than all strings starting with ``prefix``, given
+        that ``prefix`` ends with a slash"""
+        return prefix[:-1] + chr(ord("/") + 1)
+
+    def children(self, prefix: str) -> Iterator[Tuple[str, Optional[Any]]]:
+        """Yield ``(name, branch target)`` for each branch directly below ``prefix``
+        (empty, or ending with a slash), and ``(name, None)`` for each
+        sub-directory. Sub-directories are skipped over, so this costs time
+        proportional to the number of children."""
+        names = self.names
+        i = bisect_left(names, prefix)
+        end = bisect_left(names, self._after(prefix)) if prefix else len(names)
+        while i < end:
+            name, slash, _ = names[i][len(prefix) :].partition("/")
+            if slash:
+                yield name, None
+                i = bisect_left(names, self._after(f"{prefix}{name}/"), i, end)
+            else:
+                yield name, self.targets[i]
+                i += 1
+
+    def get(self, branch_name: str) -> Optional[Any]:
+        """Return the target of the branch named ``branch_name``, if any"""
+        i = bisect_left(self.names, branch_name)
+        if i < len(self.names) and self.names[i] == branch_name:
+            return self.targets[i]
+        return None
+
+    def has_prefix(self, prefix: str) -> bool:
+        """Tell whether some branch names start with ``prefix``"""
+        i = bisect_left(self.names, prefix)
+        return i < len(self.names) and self.names[i].startswith(prefix)
+
+
+@dataclass(slots=True)
+class SnapshotBranch(FuseSymlinkEntry):
+    """Branch of a snapshot, named ``name`` below ``prefix``, as a symlink to its
+    target"""
+
+    snapshot: CoreSWHID
+    prefix: str
+
+    def inode_key(self) -> Optional[Tuple[Any, ...]]:
+        # Symlinks to the archive are relative, hence depend on the entry depth
+        return (type(self).__name__, self.snapshot, self.prefix, self.name, self.depth)
+
+
+@dataclass(slots=True)
 class Snapshot(FuseDirEntry):
     """Software Heritage snapshot artifact.
 
@@ -453,49 +546,64 @@ class Snapshot(FuseDirEntry):
     swhid: CoreSWHID
     prefix: str = field(default="")
 
+    def inode_key(self) -> Optional[Tuple[Any, ...]]:
+        return (type(self).__name__, self.swhid, self.prefix, self.depth)
+
+    def create_branch(self, name: str, branch_meta: Any, root_path: str) -> FuseEntry:
+        # Non-alias targets are symlinks to their corresponding archived
+        # artifact, whereas alias targets are relative symlinks to the
+        # corresponding snapshot directory entry.
+        target_type = branch_meta["target_type"]
+        target_raw = branch_meta["target"]
+        if target_type == "alias":
+            prefix = Path(f"{self.prefix}{name}").parent
+            target = os.path.relpath(target_raw, prefix)
+        else:
+            target = f"{root_path}/archive/{target_raw}"
+
+        return self.create_child(
+            SnapshotBranch,
+            name=name,
+            target=Path(target),
+            snapshot=self.swhid,
+            prefix=self.prefix,
+        )
+
+    def create_subdir(self, name: str) -> FuseEntry:
+        return self.create_child(
+            Snapshot,
+            name=name,
+            mode=int(EntryMode.RDONLY_DIR),
+            swhid=self.swhid,
+            prefix=f"{self.prefix}{name}/",
+        )
+
     async def compute_entries(self) -> AsyncIterator[FuseEntry]:
-        metadata = await self.fuse.get_metadata(self.swhid)
+        branches = await self.fuse.get_snapshot_branches(self.swhid)
         root_path = self.get_relative_root_path()
 
-        subdirs = set()
-        for branch_name, branch_meta in metadata.items():
-            if not branch_name.startswith(self.prefix):
-                continue
-
-            next_subdirs = branch_name[len(self.prefix) :].split("/")
-            next_prefix = next_subdirs[0]
-
-            if len(next_subdirs) == 1:
-                # Non-alias targets are symlinks to their corresponding archived
-                # artifact, whereas alias targets are relative symlinks to the
-                # corresponding snapshot directory entry.
-                target_type = branch_meta["target_type"]
-                target_raw = branch_meta["target"]
-                if target_type == "alias":
-                    prefix = Path(branch_name).parent
-                    target = os.path.relpath(target_raw, prefix)
-                else:
-                    target = f"{root_path}/archive/{target_raw}"
-
-                yield self.create_child(
-                    FuseSymlinkEntry,
-                    name=next_prefix,
-                    target=Path(target),
-                )
+        for name, branch_meta in branches.children(self.prefix):
+            if branch_meta is None:
+                yield self.create_subdir(name)
             else:
-                subdirs.add(next_prefix)
+                yield self.create_branch(name, branch_meta, root_path)
 
-        for subdir in subdirs:
-            yield self.create_child(
-                Snapshot,
-                name=subdir,
-                mode=int(EntryMode.RDONLY_DIR),
-                swhid=self.swhid,
-                prefix=f"{self.prefix}{subdir}/",
-            )
+    async def lookup(self, name: str) -> Optional[FuseEntry]:
+        listing = self.fuse.cache.direntry.get(self)
+        if listing is not None:
+            return await listing.lookup(name)
+
+        # Avoid listing (possibly many) siblings to look up a single branch
+        branches = await self.fuse.get_snapshot_branches(self.swhid)
+        branch_meta = branches.get(f"{self.prefix}{name}")
+        if branch_meta is not None:
+            return self.create_branch(name, branch_meta, self.get_relative_root_path())
+        if branches.has_prefix(f"{self.prefix}{name}/"):
+            return self.create_subdir(name)
+        return None
 
 
-@dataclass
+@dataclass(slots=True)
 class Origin(FuseDirEntry):
     """Software Heritage origin artifact.
 
@@ -534,13 +642,13 @@ class Origin(FuseDirEntry):
                 )
 
 
-@dataclass
+@dataclass(slots=True)
 class OriginVisit(FuseDirEntry):
     """Origin visit virtual directory"""
 
     meta: Dict[str, Any]
 
-    @dataclass
+    @dataclass(slots=True)
     class MetaFile(FuseFileEntry):
         content: str
 
@@ -7,14 +7,34 @@ from __future__ import annotations
 
 from dataclasses import dataclass, field
 from enum import IntEnum
+from mmap import mmap
 from pathlib import Path
 import re
 from stat import S_IFDIR, S_IFLNK, S_IFREG
-from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Optional, Pattern, Union
+import sys
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    ClassVar,
+    Dict,
+    List,
+    Optional,
+    Pattern,
+    Tuple,
+    Union,
+)
+
+from swh.model.swhids import CoreSWHID
 
 if TYPE_CHECKING:  # avoid cyclic import
     from swh.fuse.fuse import Fuse
 
+# File contents, either in memory or mapped from a file of the blob cache
+FileContent = Union[bytes, mmap]
+
 
 class EntryMode(IntEnum):
     """Default entry mode and permissions for the FUSE.
@@ -33,7 +53,7 @@ class EntryMode(IntEnum):
     RDWR_DIR = S_IFDIR | 0o755
 
 
-@dataclass
+@dataclass(slots=True)
 class FuseEntry:
     """Main wrapper class to manipulate virtual FUSE entries"""
 
@@ -46,12 +66,35 @@ class FuseEntry:
     """internal reference to the main FUSE class"""
     inode: int = field(init=False)
     """unique integer identifying the entry"""
-    file_info_attrs: Dict[str, Any] = field(init=False, default_factory=dict)
+    view: str = field(kw_only=True, default="archive")
+    """name of the kernel cache policy applying to the entry (see
+    :ref:`swh-fuse-config-kernel-cache`)"""
+
+    VIEW: ClassVar[Optional[str]] = None
+    """kernel cache policy of the entry and its descendants, if it differs from
+    the parent's one"""
 
     def __post_init__(self):
+        # Many entries share the same names (README, __init__.py, meta.json...)
+        self.name = sys.intern(self.name)
         self.inode = self.fuse._alloc_inode(self)
-        # By default, let the kernel cache previously accessed data
-        self.file_info_attrs["keep_cache"] = True
+
+    def sizeof(self) -> int:
+        """Return the memory used by the entry, in bytes, not counting objects
+        shared with other entries or caches (names are interned, SWHIDs come
+        from the parent's metadata)"""
+
+        return sys.getsizeof(self)
+
+    def inode_key(self) -> Optional[Tuple[Any, ...]]:
+        """Return the key from which a stable inode number is derived, or None if
+        the entry should get a fresh inode.
+
+        Entries sharing the same key and view (e.g., the same archived object
+        reached through different paths) must be interchangeable, as they will
+        share the same inode."""
+
+        return None
 
     async def size(self) -> int:
         """Return the size (in bytes) of an entry"""
@@ -65,14 +108,19 @@ class FuseEntry:
         return "../" * (self.depth - 1)
 
     def create_child(self, constructor: Any, **kwargs) -> FuseEntry:
-        return constructor(depth=self.depth + 1, fuse=self.fuse, **kwargs)
+        return constructor(
+            depth=self.depth + 1,
+            fuse=self.fuse,
+            view=constructor.VIEW or self.view,
+            **kwargs,
+        )
 
 
-@dataclass
+@dataclass(slots=True)
 class FuseFileEntry(FuseEntry):
     """FUSE virtual file entry"""
 
-    async def get_content(self) -> bytes:
+    async def get_content(self) -> FileContent:
         """Return the content of a file entry"""
 
         raise NotImplementedError
@@ -81,11 +129,11 @@ class FuseFileEntry(FuseEntry):
         return len(await self.get_content())
 
 
-@dataclass
+@dataclass(slots=True)
 class FuseDirEntry(FuseEntry):
     """FUSE virtual directory entry"""
 
-    ENTRIES_REGEXP: Optional[Pattern] = field(init=False, default=None)
+    ENTRIES_REGEXP: ClassVar[Optional[Pattern]] = None
 
     async def size(self) -> int:
         return 0
@@ -99,36 +147,146 @@ class FuseDirEntry(FuseEntry):
         else:
             return True
 
-    async def compute_entries(self):
-        """Return the child entries of a directory entry"""
+    def compute_entries(self) -> AsyncIterator[FuseEntry]:
+        """Return the child entries of a directory entry (implemented as an
+        asynchronous generator by subclasses)"""
 
         raise NotImplementedError
 
-    async def get_entries(self, offset: int = 0) -> AsyncIterator[FuseEntry]:
+    async def compute_listing(self) -> DirListing:
+        """Return the listing of this directory. By default, all its entries are
+        created upfront by :py:meth:`compute_entries`; large directories can
+        return a :py:class:`LazyDirListing` instead."""
+
+        return DirListing([x async for x in self.compute_entries()])
+
+    async def get_listing(self) -> DirListing:
         """Return the child entries of a directory entry using direntry cache"""
 
-        cache = self.fuse.cache.direntry.get(self)
-        if cache:
-            entries = cache
-        else:
-            entries = [x async for x in self.compute_entries()]
-            self.fuse.cache.direntry.set(self, entries)
+        listing = self.fuse.cache.direntry.get(self)
+        if listing is None:
+            listing = await self.compute_listing()
+            self.fuse.cache.direntry.set(self, listing)
+        return listing
 
-        # Avoid copy by manual iteration (instead of slicing) and use of a
-        # generator (instead of returning the full list every time)
-        for i in range(offset, len(entries)):
-            yield entries[i]
+    async def get_entries(self, offset: int = 0) -> AsyncIterator[FuseEntry]:
+        """Return the child entries of a directory entry using direntry cache"""
+
+        listing = await self.get_listing()
+        # Use a generator (instead of returning the full list every time), so
+        # lazy listings only create the entries actually requested
+        for i in range(offset, len(listing)):
+            yield await listing.get(i)
 
     async def lookup(self, name: str) -> Optional[FuseEntry]:
         """Look up a FUSE entry by name"""
 
-        async for entry in self.get_entries():
-            if entry.name == name:
-                return entry
-        return None
+        return await (await self.get_listing()).lookup(name)
+
+
+def deep_sizeof(obj: Any) -> int:
+    """Return the memory used by ``obj`` and by the containers, strings and SWHIDs
+    it refers to (as found in typified metadata), in bytes. Objects referenced
+    several times are counted once."""
+
+    size = 0
+    seen = set()
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+        elif isinstance(obj, CoreSWHID):
+            # its object type is a shared enum member
+            size += sys.getsizeof(vars(obj))
+            stack.append(obj.object_id)
+    return size
+
+
+class DirListing:
+    """Child entries of a directory, in listing order and indexed by name"""
+
+    def __init__(self, entries: List[FuseEntry]):
+        self.entries = entries
+        self.by_name: Dict[str, FuseEntry] = {}
+        for entry in entries:
+            # On duplicate names, keep the first one (as a linear scan would)
+            self.by_name.setdefault(entry.name, entry)
+        self.nbytes = (
+            sys.getsizeof(self)
+            + sys.getsizeof(self.entries)
+            + sys.getsizeof(self.by_name)
+        )
+        """memory used by the listing, in bytes, not counting its entries (see
+        :py:class:`swh.fuse.cache.DirEntryCache`)"""
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    async def get(self, position: int) -> FuseEntry:
+        """Return the entry at ``position`` in listing order (used as readdir
+        offset)"""
+        return self.entries[position]
 
+    async def lookup(self, name: str) -> Optional[FuseEntry]:
+        return self.by_name.get(name)
+
+
+class LazyDirListing(DirListing):
+    """Child entries of a directory, of which only names are known upfront.
+
+    Each entry is created by ``create`` (given its position) the first time it
+    is requested, then kept. Listing order, hence readdir offsets, are given by
+    ``names`` and do not depend on which entries were already created.
+
+    ``source_nbytes`` is the memory used by the data ``create`` builds entries
+    from, which the listing keeps alive."""
+
+    def __init__(
+        self,
+        names: List[str],
+        create: Callable[[int], Awaitable[FuseEntry]],
+        source_nbytes: int = 0,
+    ):
+        self.names = names
+        self.create = create
+        self.created: List[Optional[FuseEntry]] = [None] * len(names)
+        self.positions: Dict[str, int] = {}
+        for position, name in enumerate(names):
+            self.positions.setdefault(name, position)
+        # names are usually shared with the source data
+        self.nbytes = (
+            sys.getsizeof(self)
+            + sys.getsizeof(self.names)
+            + sys.getsizeof(self.created)
+            + sys.getsizeof(self.positions)
+            + source_nbytes
+        )
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    async def get(self, position: int) -> FuseEntry:
+        entry = self.created[position]
+        if entry is None:
+            entry = self.created[position] = await self.create(position)
+        return entry
+
+    async def lookup(self, name: str) -> Optional[FuseEntry]:
+        position = self.positions.get(name)
+        if position is None:
+            return None
+        return await self.get(position)
 
-@dataclass
+
+@dataclass(slots=True)
 class FuseSymlinkEntry(FuseEntry):
     """FUSE virtual symlink entry"""
 
@@ -139,6 +297,13 @@ class FuseSymlinkEntry(FuseEntry):
     async def size(self) -> int:
         return len(str(self.target))
 
+    def sizeof(self) -> int:
+        target = self.target
+        if isinstance(target, Path):
+            # paths keep their string representation once computed
+            target = str(target)
+        return sys.getsizeof(self) + sys.getsizeof(target)
+
     def get_target(self) -> Union[str, bytes, Path]:
         """Return the path target of a symlink entry"""
 
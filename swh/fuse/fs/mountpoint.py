@@ -7,7 +7,7 @@ from dataclasses import dataclass, field
 import json
 from pathlib import Path
 import re
-from typing import AsyncIterator, Optional
+from typing import Any, AsyncIterator, Optional, Tuple
 
 from swh.fuse.fs.artifact import OBJTYPE_GETTERS, SWHID_REGEXP, Origin
 from swh.fuse.fs.entry import (
@@ -22,9 +22,10 @@ from swh.model.hashutil import hash_to_hex
 from swh.model.swhids import CoreSWHID, ObjectType
 
 JSON_SUFFIX = ".json"
+ORIGIN_DIRNAME = "origin"
 
 
-@dataclass
+@dataclass(slots=True)
 class Root(FuseDirEntry):
     """The FUSE mountpoint, consisting of the archive/ and origin/ directories"""
 
@@ -39,7 +40,7 @@ class Root(FuseDirEntry):
         yield self.create_child(Readme)
 
 
-@dataclass
+@dataclass(slots=True)
 class ArchiveDir(FuseDirEntry):
     """The `archive/` virtual directory allows to mount any artifact on the fly
     using its SWHID as name. The associated metadata of the artifact from the
@@ -51,6 +52,8 @@ class ArchiveDir(FuseDirEntry):
     name: str = field(init=False, default="archive")
     mode: int = field(init=False, default=int(EntryMode.RDONLY_DIR))
 
+    VIEW = "archive"
+
     ENTRIES_REGEXP = re.compile(r"^(" + SWHID_REGEXP + ")(.json)?$")
 
     async def compute_entries(self) -> AsyncIterator[FuseEntry]:
@@ -70,7 +73,8 @@ class ArchiveDir(FuseDirEntry):
                 )
             else:
                 swhid = CoreSWHID.from_string(name)
-                await self.fuse.get_metadata(swhid)
+                # sub-directories of a mounted directory are likely to be read
+                await self.fuse.get_metadata(swhid, prefetch=True)
                 return self.create_child(
                     OBJTYPE_GETTERS[swhid.object_type],
                     name=str(swhid),
@@ -85,16 +89,19 @@ class ArchiveDir(FuseDirEntry):
             return None
 
 
-@dataclass
+@dataclass(slots=True)
 class MetaEntry(FuseFileEntry):
     """An entry for a `archive/<SWHID>.json` file, containing all the SWHID's
     metadata from the Software Heritage archive."""
 
     swhid: CoreSWHID
 
+    def inode_key(self) -> Optional[Tuple[Any, ...]]:
+        return (type(self).__name__, self.swhid)
+
     async def get_content(self) -> bytes:
-        # Make sure the metadata is in cache
-        await self.fuse.get_metadata(self.swhid)
+        # Make sure the complete metadata is in cache
+        await self.fuse.get_metadata(self.swhid, full=True)
         # Retrieve raw JSON metadata from cache (un-typified)
         metadata = await self.fuse.cache.metadata.get(self.swhid, typify=False)
         json_str = json.dumps(metadata, indent=self.fuse.conf["json-indent"])
@@ -104,19 +111,21 @@ class MetaEntry(FuseFileEntry):
         return len(await self.get_content())
 
 
-@dataclass
+@dataclass(slots=True)
 class OriginDir(FuseDirEntry):
     """The origin/ directory is lazily populated with one entry per accessed
     origin URL (mangled to create a valid UNIX filename). The URL encoding is
     done using the percent-encoding mechanism described in RFC 3986."""
 
-    name: str = field(init=False, default="origin")
+    name: str = field(init=False, default=ORIGIN_DIRNAME)
     mode: int = field(init=False, default=int(EntryMode.RDONLY_DIR))
 
+    VIEW = "origin"
+
     ENTRIES_REGEXP = re.compile(r"^.*%3A.*$")  # %3A is the encoded version of ':'
 
     def create_origin_child(self, url_encoded: str) -> FuseEntry:
-        return super().create_child(
+        return self.create_child(
             Origin,
             name=url_encoded,
             mode=int(EntryMode.RDONLY_DIR),
@@ -127,7 +136,7 @@ class OriginDir(FuseDirEntry):
             yield self.create_origin_child(url)
 
     async def lookup(self, name: str) -> Optional[FuseEntry]:
-        entry = await super().lookup(name)
+        entry = await super(OriginDir, self).lookup(name)
         if entry:
             return entry
 
@@ -140,7 +149,7 @@ class OriginDir(FuseDirEntry):
             return None
 
 
-@dataclass
+@dataclass(slots=True)
 class CacheDir(FuseDirEntry):
     """The cache/ directory is an on-disk representation of locally cached
     objects and metadata. Via this directory you can browse cached data and
@@ -154,9 +163,11 @@ class CacheDir(FuseDirEntry):
     name: str = field(init=False, default="cache")
     mode: int = field(init=False, default=int(EntryMode.RDONLY_DIR))
 
-    ENTRIES_REGEXP = re.compile(r"^([a-f0-9]{2})|(" + OriginDir.name + ")$")
+    VIEW = "cache"
+
+    ENTRIES_REGEXP = re.compile(r"^([a-f0-9]{2})|(" + ORIGIN_DIRNAME + ")$")
 
-    @dataclass
+    @dataclass(slots=True)
     class ArtifactShardBySwhid(FuseDirEntry):
         ENTRIES_REGEXP = re.compile(r"^(" + SWHID_REGEXP + ")$")
 
@@ -204,12 +215,12 @@ class CacheDir(FuseDirEntry):
 
         yield self.create_child(
             FuseSymlinkEntry,
-            name=OriginDir.name,
-            target=Path(self.get_relative_root_path(), OriginDir.name),
+            name=ORIGIN_DIRNAME,
+            target=Path(self.get_relative_root_path(), ORIGIN_DIRNAME),
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class Readme(FuseFileEntry):
     """Top-level README to explain briefly what is SwhFS."""
 
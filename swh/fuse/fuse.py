@@ -4,8 +4,13 @@
 # See top-level LICENSE file for more information
 
 import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass
 import errno
+from functools import partial
+import hashlib
 import logging
+from mmap import mmap
 import os
 from pathlib import Path
 from shutil import rmtree, which
@@ -13,19 +18,106 @@ from subprocess import run
 from tempfile import mkdtemp
 from threading import Thread
 import time
-from typing import Any, Dict, List
+from typing import (
+    Any,
+    Callable,
+    Coroutine,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
 
 import pyfuse3
 import pyfuse3.asyncio
 
+from swh.core.config import merge_configs
+from swh.core.statsd import Statsd
 from swh.fuse import LOGGER_NAME
-from swh.fuse.backends import ContentBackend, GraphBackend
+from swh.fuse.backends import ContentBackend, GraphBackend, is_partial_metadata
 from swh.fuse.cache import FuseCache
-from swh.fuse.cli import load_config
-from swh.fuse.fs.entry import FuseDirEntry, FuseEntry, FuseFileEntry, FuseSymlinkEntry
+from swh.fuse.cli import DEFAULT_CONFIG, load_config
+from swh.fuse.fs.artifact import Content, SnapshotBranches
+from swh.fuse.fs.entry import (
+    FileContent,
+    FuseDirEntry,
+    FuseEntry,
+    FuseFileEntry,
+    FuseSymlinkEntry,
+)
 from swh.fuse.fs.mountpoint import Root
+from swh.fuse.history import History, HistoryGraphBuilder
 from swh.model.swhids import CoreSWHID, ObjectType
 
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class KernelCachePolicy:
+    """How long the kernel may cache entries of a given view (``archive/``,
+    ``origin/`` or ``cache/``) without asking SwhFS again. Timeouts are in
+    seconds."""
+
+    entry_timeout: float
+    """validity of name lookups"""
+    attr_timeout: float
+    """validity of entry attributes"""
+    negative_timeout: float
+    """validity of failed name lookups (0 disables negative caching)"""
+    keep_cache: bool
+    """whether files' page cache is kept when re-opening them"""
+
+    @classmethod
+    def from_conf(cls, conf: Dict[str, Any]) -> "KernelCachePolicy":
+        return cls(
+            entry_timeout=float(conf["entry-timeout"]),
+            attr_timeout=float(conf["attr-timeout"]),
+            negative_timeout=float(conf["negative-timeout"]),
+            keep_cache=bool(conf["keep-cache"]),
+        )
+
+
+class OpenFile:
+    """Content of an open file, shared by all the file handles opened on the same
+    object.
+
+    The content is fetched at most once, on the first ``read()``, and kept in
+    memory until the last file handle referring to it is released. In-memory
+    contents are charged to the ``direntry`` memory budget meanwhile; mapped ones
+    live in the page cache and are not."""
+
+    def __init__(self, key: Hashable, entry: FuseFileEntry):
+        self.key = key
+        self.entry = entry
+        self.refcount = 0
+        self.data: Optional[memoryview] = None
+        self.nbytes = 0
+        self.lock = asyncio.Lock()
+
+    async def get_data(self) -> memoryview:
+        """Return the file content, fetching it if needed"""
+
+        if self.data is None:
+            # Concurrent reads of a fresh handle must not fetch the blob twice
+            async with self.lock:
+                if self.data is None:
+                    content = await self.entry.get_content()
+                    if not isinstance(content, mmap):
+                        self.nbytes = len(content)
+                        self.entry.fuse.cache.direntry.track(self.nbytes)
+                    self.data = memoryview(content)
+        return self.data
+
+    def close(self) -> None:
+        """Release the content, once no file handle refers to it"""
+
+        self.entry.fuse.cache.direntry.track(-self.nbytes)
+        self.nbytes = 0
+        self.data = None
+
 
 class Fuse(pyfuse3.Operations):
     """
@@ -36,6 +128,15 @@ class Fuse(pyfuse3.Operations):
     This class ties together ``pyfuse3`` and the configured cache and back-end.
     """
 
+    KEYED_INODE_BIT = 1 << 63
+    # Number of snapshots whose sorted branches are kept in memory
+    SNAPSHOT_BRANCHES_CACHE_SIZE = 32
+
+    # Memory used by each inode of the inode table besides its entry, in bytes:
+    # an item in both _inode2entry and _nlookup (about 52 bytes each, measured on
+    # large dicts), and the inode integer itself (36 bytes for keyed inodes)
+    INODE_TABLE_ITEM_SIZE = 2 * 52 + 36
+
     def __init__(
         self,
         cache: FuseCache,
@@ -46,12 +147,34 @@ class Fuse(pyfuse3.Operations):
         super(Fuse, self).__init__()
 
         self._next_inode: pyfuse3.InodeT = pyfuse3.ROOT_INODE
+        # Entries known to the kernel, with their lookup count
         self._inode2entry: Dict[pyfuse3.InodeT, FuseEntry] = {}
+        self._nlookup: Dict[pyfuse3.InodeT, int] = {}
+        self._next_fh: pyfuse3.FileHandleT = pyfuse3.FileHandleT(1)
+        self._fh2file: Dict[pyfuse3.FileHandleT, OpenFile] = {}
+        # Open files indexed by content SWHID (or by inode for virtual files)
+        self._open_files: Dict[Hashable, OpenFile] = {}
+        # Backend fetches currently running, indexed by (kind, key)
+        self._in_flight: Dict[Tuple[str, Hashable], asyncio.Task] = {}
+        # Recently listed snapshots, in LRU order
+        self._snapshot_branches: OrderedDict[CoreSWHID, SnapshotBranches] = (
+            OrderedDict()
+        )
 
         self.root = Root(fuse=self)
+        # The root inode is never forgotten
+        self._inode2entry[pyfuse3.InodeT(self.root.inode)] = self.root
         self.conf = conf
         self.logger = logging.getLogger(LOGGER_NAME)
 
+        kernel_cache_conf = merge_configs(
+            DEFAULT_CONFIG["kernel-cache"], conf.get("kernel-cache", {})
+        )
+        self.kernel_cache: Dict[str, KernelCachePolicy] = {
+            view: KernelCachePolicy.from_conf(view_conf)
+            for view, view_conf in kernel_cache_conf.items()
+        }
+
         self.time_ns: int = time.time_ns()  # start time, used as timestamp
         self.gid = os.getgid()
         self.uid = os.getuid()
@@ -59,30 +182,85 @@ class Fuse(pyfuse3.Operations):
         self.graph_backend = graph_backend
         self.obj_backend = obj_backend
         self.cache = cache
+        self.statsd = Statsd()
 
-    def shutdown(self) -> None:
-        self.graph_backend.shutdown()
-        self.obj_backend.shutdown()
+    async def shutdown(self) -> None:
+        await self.graph_backend.shutdown()
+        await self.obj_backend.shutdown()
 
     def _alloc_inode(self, entry: FuseEntry) -> int:
-        """Return a unique inode integer for a given entry"""
+        """Return an inode integer for a given entry.
+
+        Entries providing an :meth:`FuseEntry.inode_key` get a deterministic inode
+        derived from that key and their view, so the same archived object reached
+        through different paths (or listed again after a direntry cache eviction)
+        keeps the same inode, allowing the kernel to reuse its caches. Other entries get
+        a unique inode from a counter. Derived inodes have their most significant
+        bit set, so they never clash with counter-allocated ones.
+
+        The entry is only registered in the inode table once it is handed to the
+        kernel (see :meth:`_add_lookup`), so entries the kernel never heard of
+        can be garbage-collected."""
+
+        key = self._inode_key(entry)
+        if key is not None:
+            digest = hashlib.blake2b(
+                "\0".join(str(x) for x in key).encode(), digest_size=8
+            ).digest()
+            inode = pyfuse3.InodeT(int.from_bytes(digest, "big") | self.KEYED_INODE_BIT)
+            known = self._inode2entry.get(inode)
+            if known is None:
+                return inode
+            known_key = self._inode_key(known)
+            if known_key == key:
+                return inode
+            self.logger.warning(
+                "Inode collision between %s and %s, allocating a new inode",
+                key,
+                known_key,
+            )
 
         inode = self._next_inode
         self._next_inode = pyfuse3.InodeT(inode + 1)
-        self._inode2entry[inode] = entry
 
         return inode
 
-    def _remove_inode(self, inode: pyfuse3.InodeT) -> None:
-        try:
-            del self._inode2entry[inode]
-        except KeyError:
-            pass
+    @staticmethod
+    def _inode_key(entry: FuseEntry) -> Optional[Tuple[Any, ...]]:
+        """Key an entry's inode is derived from: its :py:meth:`FuseEntry.inode_key`
+        within its view, or None if it has none"""
+        inode_key = entry.inode_key()
+        if inode_key is None:
+            return None
+        # Views have their own kernel cache policy, hence their own inodes
+        return (entry.view, *inode_key)
+
+    def _add_lookup(self, entry: FuseEntry) -> None:
+        """Register an entry in the inode table and increase its lookup count, as
+        the kernel does for each successful ``lookup()`` or ``readdir_reply()``"""
+
+        inode = pyfuse3.InodeT(entry.inode)
+        # Entries sharing an inode are interchangeable, keep the known one
+        if inode not in self._inode2entry:
+            self._inode2entry[inode] = entry
+            self.cache.direntry.track(self.INODE_TABLE_ITEM_SIZE + entry.sizeof())
+        self._nlookup[inode] = self._nlookup.get(inode, 0) + 1
+
+    def _drop_inode(self, inode: pyfuse3.InodeT) -> None:
+        """Remove an inode from the inode table"""
+
+        entry = self._inode2entry.pop(inode, None)
+        if entry is not None:
+            self.cache.direntry.track(-self.INODE_TABLE_ITEM_SIZE - entry.sizeof())
+        self._nlookup.pop(inode, None)
+
+    def kernel_cache_policy(self, entry: FuseEntry) -> KernelCachePolicy:
+        """Return the kernel cache policy applying to a given entry"""
 
         try:
-            pyfuse3.invalidate_inode(inode)
-        except FileNotFoundError:
-            pass
+            return self.kernel_cache[entry.view]
+        except KeyError:
+            return self.kernel_cache["archive"]
 
     def inode2entry(self, inode: pyfuse3.InodeT) -> FuseEntry:
         """Return the entry matching a given inode"""
@@ -92,19 +270,76 @@ class Fuse(pyfuse3.Operations):
         except KeyError:
             raise pyfuse3.FUSEError(errno.ENOENT)
 
-    async def get_metadata(self, swhid: CoreSWHID) -> Any:
-        """Retrieve metadata for a given SWHID using Software Heritage API"""
+    async def _single_flight(
+        self, kind: str, key: Hashable, fetch: Callable[[], Coroutine[Any, Any, T]]
+    ) -> T:
+        """Return the result of ``fetch()``, unless a fetch of the same ``kind``
+        and ``key`` is already running: in that case, wait for its outcome
+        (result or exception) instead of querying the backend again.
+
+        The fetch runs in its own task, shared by all its callers: a cancelled
+        caller (e.g., an interrupted request) stops waiting for it, without
+        cancelling it for the others."""
+
+        flight_key = (kind, key)
+        task = self._in_flight.get(flight_key)
+        if task is None:
+            task = asyncio.create_task(fetch())
+            self._in_flight[flight_key] = task
+            task.add_done_callback(partial(self._landed, flight_key))
+        else:
+            self.statsd.increment("swhfuse_coalesced_fetches", tags={"kind": kind})
+        return await asyncio.shield(task)
+
+    def _landed(self, flight_key: Tuple[str, Hashable], task: asyncio.Task) -> None:
+        """Forget a completed fetch of :meth:`_single_flight`"""
+
+        if self._in_flight.get(flight_key) is task:
+            del self._in_flight[flight_key]
+        if not task.cancelled():
+            # Mark the exception (if any) as retrieved: all callers may be gone
+            task.exception()
+
+    async def get_metadata(
+        self, swhid: CoreSWHID, full: bool = False, prefetch: bool = False
+    ) -> Any:
+        """Retrieve metadata for a given SWHID using Software Heritage API.
+
+        Unless ``full`` is set, the returned metadata may lack fields only needed by
+        ``meta.json`` files (see :py:data:`swh.fuse.backends.FULL_METADATA_FIELDS`).
+
+        With ``prefetch``, an uncached directory is fetched with the whole subtree
+        below it, if the back-end supports it (see
+        :py:meth:`swh.fuse.backends.GraphBackend.get_subtree_metadata`). This is
+        meant for directories mounted in ``archive/``, not for each of their
+        sub-directories.
+        """
 
         cache = await self.cache.metadata.get(swhid)
-        if cache is not None:
+        if cache is not None and not (full and is_partial_metadata(swhid, cache)):
             return cache
 
-        metadata = await self.graph_backend.get_metadata(swhid)
-        await self.cache.metadata.set(swhid, metadata)
-        # Retrieve it from cache so it is correctly typed
-        return await self.cache.metadata.get(swhid)
+        if full:
+
+            async def fetch_full() -> Any:
+                metadata = await self.graph_backend.get_metadata(swhid, full=True)
+                return await self.cache.metadata.set(swhid, metadata, replace=True)
+
+            return await self._single_flight("full-metadata", swhid, fetch_full)
 
-    async def get_blob(self, swhid: CoreSWHID) -> bytes:
+        async def fetch() -> Any:
+            if prefetch and swhid.object_type == ObjectType.DIRECTORY:
+                subtree = await self.graph_backend.get_subtree_metadata(swhid)
+                if subtree:
+                    await self.cache.metadata.set_many(subtree.items())
+                    if swhid in subtree:
+                        return await self.cache.metadata.get(swhid)
+            metadata = await self.graph_backend.get_metadata(swhid)
+            return await self.cache.metadata.set(swhid, metadata)
+
+        return await self._single_flight("metadata", swhid, fetch)
+
+    async def get_blob(self, swhid: CoreSWHID) -> FileContent:
         """Retrieve the blob bytes for a given content SWHID using Software
         Heritage API"""
 
@@ -116,11 +351,14 @@ class Fuse(pyfuse3.Operations):
             self.logger.debug("Found blob %s in cache", swhid)
             return cache
 
-        blob = await self.obj_backend.get_blob(swhid)
-        await self.cache.blob.set(swhid, blob)
-        return blob
+        async def fetch() -> FileContent:
+            blob = await self.obj_backend.get_blob(swhid)
+            await self.cache.blob.set(swhid, blob)
+            return blob
+
+        return await self._single_flight("blob", swhid, fetch)
 
-    async def get_history(self, swhid: CoreSWHID) -> List[CoreSWHID]:
+    async def get_history(self, swhid: CoreSWHID) -> History:
         """Retrieve a revision's history using Software Heritage Graph API"""
 
         if swhid.object_type != ObjectType.REVISION:
@@ -133,14 +371,34 @@ class Fuse(pyfuse3.Operations):
             )
             return cache
 
-        history = await self.graph_backend.get_history(swhid)
-        await self.cache.history.set(history)
-        # Retrieve it from cache so it is correctly typed
-        res = await self.cache.history.get(swhid)
-        if res is None:
-            return []
-        else:
-            return res
+        async def fetch() -> History:
+            # build the graph as revisions arrive, rather than from a list of edges
+            builder = HistoryGraphBuilder(swhid)
+            async for revision, parents, date in self.graph_backend.iter_history(swhid):
+                builder.add(revision, parents, date)
+            return await self.cache.history.set(swhid, builder.build())
+
+        return await self._single_flight("history", swhid, fetch)
+
+    async def get_snapshot_branches(self, swhid: CoreSWHID) -> SnapshotBranches:
+        """Retrieve a snapshot's branches, sorted by name"""
+
+        branches = self._snapshot_branches.get(swhid)
+        if branches is not None:
+            self._snapshot_branches.move_to_end(swhid)
+            return branches
+
+        branches = SnapshotBranches(await self.get_metadata(swhid))
+        if swhid in self._snapshot_branches:
+            # built by a concurrent call meanwhile
+            return self._snapshot_branches[swhid]
+        # charged to the direntry cache budget while kept here
+        self._snapshot_branches[swhid] = branches
+        self.cache.direntry.track(branches.nbytes)
+        while len(self._snapshot_branches) > self.SNAPSHOT_BRANCHES_CACHE_SIZE:
+            _, evicted = self._snapshot_branches.popitem(last=False)
+            self.cache.direntry.track(-evicted.nbytes)
+        return branches
 
     async def get_visits(self, url_encoded: str) -> List[Dict[str, Any]]:
         """Retrieve origin visits given an encoded-URL using Software Heritage API"""
@@ -173,6 +431,10 @@ class Fuse(pyfuse3.Operations):
         attrs.st_ino = pyfuse3.InodeT(entry.inode)
         attrs.st_mode = pyfuse3.ModeT(entry.mode)
         attrs.st_size = await entry.size()
+
+        policy = self.kernel_cache_policy(entry)
+        attrs.entry_timeout = policy.entry_timeout
+        attrs.attr_timeout = policy.attr_timeout
         return attrs
 
     async def getattr(
@@ -214,7 +476,7 @@ class Fuse(pyfuse3.Operations):
                     break
 
                 next_id += 1
-                self._inode2entry[attrs.st_ino] = entry
+                self._add_lookup(entry)
         except Exception as err:
             self.logger.exception("Cannot readdir: %s", err)
             raise pyfuse3.FUSEError(errno.ENOENT)
@@ -224,30 +486,65 @@ class Fuse(pyfuse3.Operations):
     ) -> pyfuse3.FileInfo:
         """Open an inode and return a unique file handle"""
 
-        # Reuse inode as file handle
-        self.logger.debug("open(inode=%d)", inode)
         entry = self.inode2entry(inode)
-        return pyfuse3.FileInfo(fh=pyfuse3.FileHandleT(inode), **entry.file_info_attrs)
+        assert isinstance(entry, FuseFileEntry)
+
+        # Concurrent opens of the same content share a single buffer
+        key: Hashable = entry.swhid if isinstance(entry, Content) else inode
+        open_file = self._open_files.get(key)
+        if open_file is None:
+            open_file = OpenFile(key, entry)
+            self._open_files[key] = open_file
+        open_file.refcount += 1
+
+        fh = self._next_fh
+        self._next_fh = pyfuse3.FileHandleT(fh + 1)
+        self._fh2file[fh] = open_file
+        self.logger.debug("open(inode=%d, fh=%d)", inode, fh)
+        return pyfuse3.FileInfo(
+            fh=fh, keep_cache=self.kernel_cache_policy(entry).keep_cache
+        )
 
-    async def read(self, fh: pyfuse3.FileHandleT, offset: int, length: int) -> bytes:
+    async def read(
+        self, fh: pyfuse3.FileHandleT, offset: int, length: int
+    ) -> memoryview:
         """Read `length` bytes from file handle `fh` at position `offset`"""
 
-        # open() uses inode as file handle
-        inode = pyfuse3.InodeT(fh)
+        try:
+            open_file = self._fh2file[fh]
+        except KeyError:
+            raise pyfuse3.FUSEError(errno.EBADF)
 
-        entry = self.inode2entry(inode)
         self.logger.debug(
-            "read(name=%s, fh=%d, offset=%d, length=%d)", entry.name, fh, offset, length
+            "read(name=%s, fh=%d, offset=%d, length=%d)",
+            open_file.entry.name,
+            fh,
+            offset,
+            length,
         )
-        assert isinstance(entry, FuseFileEntry)
 
         try:
-            data = await entry.get_content()
+            data = await open_file.get_data()
+            # Slicing a memoryview does not copy the underlying buffer
             return data[offset : offset + length]
         except Exception as err:
             self.logger.exception("Cannot read: %s", err)
             raise pyfuse3.FUSEError(errno.ENOENT)
 
+    async def release(self, fh: pyfuse3.FileHandleT) -> None:
+        """Release an open file handle, and its buffer if it was the last one"""
+
+        self.logger.debug("release(fh=%d)", fh)
+        try:
+            open_file = self._fh2file.pop(fh)
+        except KeyError:
+            raise pyfuse3.FUSEError(errno.EBADF)
+
+        open_file.refcount -= 1
+        if open_file.refcount == 0:
+            del self._open_files[open_file.key]
+            open_file.close()
+
     async def lookup(
         self,
         parent_inode: pyfuse3.InodeT,
@@ -270,12 +567,41 @@ class Fuse(pyfuse3.Operations):
             if parent_entry.validate_entry(decoded_name):
                 lookup_entry = await parent_entry.lookup(decoded_name)
                 if lookup_entry:
-                    return await self.get_attrs(lookup_entry)
+                    attrs = await self.get_attrs(lookup_entry)
+                    self._add_lookup(lookup_entry)
+                    return attrs
         except Exception as err:
             self.logger.exception("Cannot lookup: %s", err)
+            raise pyfuse3.FUSEError(errno.ENOENT)
 
+        # The entry does not exist: let the kernel cache this negative answer if
+        # the parent's view allows it. A zero inode does not increase the lookup
+        # count.
+        negative_timeout = self.kernel_cache_policy(parent_entry).negative_timeout
+        if negative_timeout > 0:
+            attrs = pyfuse3.EntryAttributes()
+            attrs.st_ino = pyfuse3.InodeT(0)
+            attrs.entry_timeout = negative_timeout
+            return attrs
         raise pyfuse3.FUSEError(errno.ENOENT)
 
+    async def forget(self, inode_list: Sequence[Tuple[pyfuse3.InodeT, int]]) -> None:
+        """Decrease lookup counts (this handles both FUSE ``forget`` and
+        ``forget_multi`` requests), and drop the entries the kernel no longer
+        references from the inode table"""
+
+        for inode, nlookup in inode_list:
+            if inode == pyfuse3.ROOT_INODE:
+                continue
+            try:
+                remaining = self._nlookup[inode] - nlookup
+            except KeyError:
+                continue
+            if remaining > 0:
+                self._nlookup[inode] = remaining
+            else:
+                self._drop_inode(inode)
+
     async def readlink(
         self, inode: pyfuse3.InodeT, _ctx: pyfuse3.RequestContext
     ) -> pyfuse3.FileNameT:
@@ -422,7 +748,7 @@ async def main(
         # Initially populate the cache
         for swhid in swhids:
             try:
-                await fs.get_metadata(swhid)
+                await fs.get_metadata(swhid, prefetch=True)
             except Exception as err:
                 fs.logger.exception("Cannot prefetch object %s: %s", swhid, err)
 
@@ -435,5 +761,5 @@ async def main(
         except Exception as err:
             fs.logger.error("Error running FUSE: %s", err)
         finally:
-            fs.shutdown()
+            await fs.shutdown()
             pyfuse3.close(unmount=True)
@@ -0,0 +1,370 @@
+# Copyright (C) 2025  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""
+Revision history engine
+-----------------------
+
+A compact, in-memory representation of the revisions DAG below a root revision,
+used to list ``history/`` directories without querying a database.
+
+Revisions are numbered from 0 (the root) and stored as:
+
+- ``ids``: the concatenation of their 20-bytes hashes;
+- ``offsets`` and ``targets``: the parents of revision ``i`` are
+  ``targets[offsets[i]:offsets[i + 1]]`` (compressed sparse rows);
+- ``dates``: their author dates, as ``YYYYMMDD`` integers.
+
+:py:class:`History` objects list the ancestors of one of those revisions in
+reverse topological order. They are computed once, then every ``history/`` shard
+is a slice or a binary search in that order or in its sorted indexes.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+import struct
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import dateutil.parser
+
+from swh.model.swhids import CoreSWHID, ObjectType
+
+HASH_LENGTH = 20
+# placeholder for missing or unparsable dates
+UNKNOWN_DATE = 1970_01_01
+
+# format version, number of nodes, number of edges
+HEADER = struct.Struct("<III")
+FORMAT_VERSION = 1
+# memory used by a hash and a node number, as kept in indexes
+HASH_SIZE = sys.getsizeof(bytes(HASH_LENGTH))
+NODE_SIZE = sys.getsizeof(2**30)
+
+
+def date_key(date: Optional[str]) -> int:
+    """Convert an ISO date to a ``YYYYMMDD`` integer, in the date's own time zone"""
+    if date is not None:
+        try:
+            parsed = dateutil.parser.parse(date)
+            return parsed.year * 10000 + parsed.month * 100 + parsed.day
+        except (ValueError, OverflowError):
+            pass
+    return UNKNOWN_DATE
+
+
+def _uint32(values: Iterable[int] = ()) -> array:
+    return array("I", values)
+
+
+def _to_le(values: array) -> bytes:
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_le(data: bytes) -> array:
+    values = _uint32()
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _hash(swhid: str) -> bytes:
+    # faster than CoreSWHID.from_string, as we know we only get revisions
+    return bytes.fromhex(swhid[len("swh:1:rev:") :])
+
+
+class HistoryGraphBuilder:
+    """Build a :py:class:`HistoryGraph` from revisions as they are streamed (see
+    :py:meth:`swh.fuse.backends.GraphBackend.iter_history`), without keeping
+    their SWHIDs and dates as text"""
+
+    def __init__(self, root: CoreSWHID):
+        self.index: Dict[bytes, int] = {root.object_id: 0}
+        self.parents: List[List[int]] = [[]]
+        self.dates = _uint32([UNKNOWN_DATE])
+
+    def _node(self, swhid: str) -> int:
+        key = _hash(swhid)
+        i = self.index.get(key)
+        if i is None:
+            i = self.index[key] = len(self.parents)
+            self.parents.append([])
+            self.dates.append(UNKNOWN_DATE)
+        return i
+
+    def add_edge(self, src: str, dst: str) -> None:
+        src_node = self._node(src)
+        dst_node = self._node(dst)
+        if dst_node not in self.parents[src_node]:
+            self.parents[src_node].append(dst_node)
+
+    def add(self, swhid: str, parents: Iterable[str], date: Optional[str]) -> None:
+        """Add a revision, its parents and its author date (ISO, or None if
+        unknown)"""
+        self.dates[self._node(swhid)] = date_key(date)
+        for parent in parents:
+            self.add_edge(swhid, parent)
+
+    def set_date(self, swhid: str, date: Optional[str]) -> None:
+        """Set the author date of a revision, if it belongs to the graph"""
+        i = self.index.get(_hash(swhid))
+        if i is not None:
+            self.dates[i] = date_key(date)
+
+    def build(self) -> "HistoryGraph":
+        offsets = _uint32([0])
+        targets = _uint32()
+        for node_parents in self.parents:
+            targets.extend(node_parents)
+            offsets.append(len(targets))
+        graph = HistoryGraph(b"".join(self.index.keys()), offsets, targets, self.dates)
+        graph._index = self.index
+        return graph
+
+
+class HistoryGraph:
+    """Revisions DAG, stored as compressed sparse rows (see module documentation)"""
+
+    def __init__(self, ids: bytes, offsets: array, targets: array, dates: array):
+        self.ids = ids
+        self.offsets = offsets
+        self.targets = targets
+        self.dates = dates
+        self._index: Optional[Dict[bytes, int]] = None
+        self._histories: Dict[int, "History"] = {}
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    @classmethod
+    def from_edges(
+        cls,
+        root: CoreSWHID,
+        edges: Iterable[Tuple[str, str]],
+        dates: Dict[str, Optional[str]],
+    ) -> "HistoryGraph":
+        """Build the graph from ``(rev swhid, parent swhid)`` edges and ISO dates
+        (indexed by SWHID), as returned by
+        :py:meth:`swh.fuse.backends.GraphBackend.get_history`."""
+        builder = HistoryGraphBuilder(root)
+        for src, dst in edges:
+            builder.add_edge(src, dst)
+        for swhid, date in dates.items():
+            builder.set_date(swhid, date)
+        return builder.build()
+
+    def to_bytes(self) -> bytes:
+        return b"".join(
+            [
+                HEADER.pack(FORMAT_VERSION, len(self), len(self.targets)),
+                self.ids,
+                _to_le(self.offsets),
+                _to_le(self.targets),
+                _to_le(self.dates),
+            ]
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HistoryGraph":
+        version, nb_nodes, nb_edges = HEADER.unpack_from(data)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported history format version: {version}")
+        pos = HEADER.size
+        sections = []
+        for length in (
+            HASH_LENGTH * nb_nodes,
+            4 * (nb_nodes + 1),
+            4 * nb_edges,
+            4 * nb_nodes,
+        ):
+            sections.append(data[pos : pos + length])
+            pos += length
+        ids, offsets, targets, dates = sections
+        return cls(ids, _from_le(offsets), _from_le(targets), _from_le(dates))
+
+    def object_id(self, node: int) -> bytes:
+        return self.ids[node * HASH_LENGTH : (node + 1) * HASH_LENGTH]
+
+    def node(self, swhid: CoreSWHID) -> Optional[int]:
+        """Return the node number of ``swhid``, if it belongs to this graph"""
+        if self._index is None:
+            # graphs loaded from the database are often only queried from their
+            # root, so this is built on first use only
+            self._index = {self.object_id(i): i for i in range(len(self))}
+        return self._index.get(swhid.object_id)
+
+    def sizeof(self) -> int:
+        """Return the memory used by the graph, its SWHID index and the histories
+        (with their indexes) computed so far, in bytes"""
+        size = sys.getsizeof(self) + sys.getsizeof(self.ids)
+        size += sum(map(sys.getsizeof, (self.offsets, self.targets, self.dates)))
+        if self._index is not None:
+            size += sys.getsizeof(self._index) + len(self._index) * (
+                HASH_SIZE + NODE_SIZE
+            )
+        return size + sum(history.sizeof() for history in self._histories.values())
+
+    def history(self, node: int = 0) -> "History":
+        """Return the ancestors of ``node`` (by default, the root)"""
+        history = self._histories.get(node)
+        if history is None:
+            history = self._histories[node] = History(self, self._ancestors(node))
+        return history
+
+    def _ancestors(self, root: int) -> array:
+        """List the ancestors of ``root`` in reverse topological order (each
+        revision comes before its parents), breaking ties in traversal order."""
+        offsets, targets = self.offsets, self.targets
+        # count children of each ancestor, among the ancestors
+        in_degree = _uint32([0]) * len(self)
+        seen = bytearray(len(self))
+        seen[root] = 1
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            for parent in targets[offsets[node] : offsets[node + 1]]:
+                in_degree[parent] += 1
+                if not seen[parent]:
+                    seen[parent] = 1
+                    stack.append(parent)
+
+        order = _uint32()
+        queue = deque([root])
+        while queue:
+            node = queue.popleft()
+            if node != root:
+                order.append(node)
+            for parent in targets[offsets[node] : offsets[node + 1]]:
+                in_degree[parent] -= 1
+                if in_degree[parent] == 0:
+                    queue.append(parent)
+
+        if len(order) < sum(seen) - 1:
+            # only possible with a cycle, which a valid history cannot contain:
+            # list remaining ancestors anyway
+            listed = set(order)
+            order.extend(
+                node
+                for node in range(len(self))
+                if seen[node] and node != root and node not in listed
+            )
+        return order
+
+
+# year -> month -> day -> (first, last) positions in the date-sorted ancestors
+DateTree = Dict[int, Dict[int, Dict[int, Tuple[int, int]]]]
+
+
+class History(Sequence[CoreSWHID]):
+    """The ancestors of a revision, in reverse topological order.
+
+    Indexes by hash and by date are built on first use, then shared by all the
+    ``history/`` sub-directories of that revision, so listing any of them costs
+    time proportional to its own number of entries."""
+
+    def __init__(self, graph: HistoryGraph, order: array):
+        self.graph = graph
+        self.order = order
+        self._by_hash: Optional[List[bytes]] = None
+        self._by_hash_nodes: Optional[array] = None
+        self._hash_buckets: Dict[int, List[str]] = {}
+        self._by_date_nodes: Optional[array] = None
+        self._date_tree: Optional[DateTree] = None
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def sizeof(self) -> int:
+        """Return the memory used by the ancestors list and its indexes, in bytes
+        (the date tree, with at most one entry per day, is left out)"""
+        size = sys.getsizeof(self) + sys.getsizeof(self.order)
+        if self._by_hash is not None:
+            size += sys.getsizeof(self._by_hash) + len(self._by_hash) * HASH_SIZE
+        for nodes in (self._by_hash_nodes, self._by_date_nodes):
+            if nodes is not None:
+                size += sys.getsizeof(nodes)
+        for buckets in self._hash_buckets.values():
+            size += sys.getsizeof(buckets) + sum(map(sys.getsizeof, buckets))
+        return size
+
+    def _swhid(self, node: int) -> CoreSWHID:
+        return CoreSWHID(
+            object_type=ObjectType.REVISION, object_id=self.graph.object_id(node)
+        )
+
+    def __getitem__(self, i: Any) -> Any:
+        if isinstance(i, slice):
+            return [self._swhid(node) for node in self.order[i]]
+        return self._swhid(self.order[i])
+
+    def _hash_index(self) -> Tuple[List[bytes], array]:
+        if self._by_hash is None or self._by_hash_nodes is None:
+            nodes = sorted(self.order, key=self.graph.object_id)
+            self._by_hash_nodes = _uint32(nodes)
+            self._by_hash = [self.graph.object_id(node) for node in nodes]
+        return self._by_hash, self._by_hash_nodes
+
+    def hash_buckets(self, length: int) -> List[str]:
+        """Sorted list of the distinct ``length``-characters hexadecimal prefixes
+        of ancestors' hashes"""
+        buckets = self._hash_buckets.get(length)
+        if buckets is None:
+            hashes, _ = self._hash_index()
+            buckets = []
+            for object_id in hashes:
+                bucket = object_id.hex()[:length]
+                if not buckets or buckets[-1] != bucket:
+                    buckets.append(bucket)
+            self._hash_buckets[length] = buckets
+        return buckets
+
+    def with_hash_prefix(self, prefix: str) -> List[CoreSWHID]:
+        """Ancestors whose hash starts with the hexadecimal ``prefix``, sorted by
+        hash"""
+        hashes, nodes = self._hash_index()
+        # all hashes starting with prefix are between prefix+"00.." and prefix+"ff.."
+        low = bytes.fromhex(prefix.ljust(2 * HASH_LENGTH, "0"))
+        high = bytes.fromhex(prefix.ljust(2 * HASH_LENGTH, "f"))
+        start = bisect_left(hashes, low)
+        end = bisect_right(hashes, high)
+        return [self._swhid(node) for node in nodes[start:end]]
+
+    def _date_index(self) -> Tuple[array, DateTree]:
+        if self._by_date_nodes is None or self._date_tree is None:
+            dates = self.graph.dates
+            # sorted() is stable: ancestors of the same day keep their order
+            nodes = sorted(self.order, key=dates.__getitem__)
+            tree: DateTree = {}
+            for position, node in enumerate(nodes):
+                date = dates[node]
+                days = tree.setdefault(date // 10000, {}).setdefault(
+                    date // 100 % 100, {}
+                )
+                first, _ = days.get(date % 100, (position, position))
+                days[date % 100] = (first, position + 1)
+            self._by_date_nodes = _uint32(nodes)
+            self._date_tree = tree
+        return self._by_date_nodes, self._date_tree
+
+    def date_children(self, parents: Sequence[int]) -> List[int]:
+        """Sorted years (if ``parents`` is empty), months of the year
+        ``parents[0]``, or days of the month ``parents[1]`` of that year,
+        when at least one ancestor is dated."""
+        _, tree = self._date_index()
+        level: Dict[int, Any] = tree
+        for part in parents:
+            level = level.get(part, {})
+        return sorted(level)
+
+    def on_date(self, year: int, month: int, day: int) -> List[CoreSWHID]:
+        """Ancestors dated on the given day"""
+        nodes, tree = self._date_index()
+        first, last = tree.get(year, {}).get(month, {}).get(day, (0, 0))
+        return [self._swhid(node) for node in nodes[first:last]]
@@ -4,6 +4,7 @@
 # See top-level LICENSE file for more information
 
 import json
+import os
 from pathlib import Path
 
 
@@ -28,4 +29,13 @@ def test_revision(fuse_graph_mountpoint: Path, example_revision: str):
     assert (root / "root").is_symlink()
 
     assert (root / "history").is_dir()
-    # TODO
+
+
+def test_revision_history(fuse_graph_mountpoint: Path, example_revision: str):
+    history = fuse_graph_mountpoint / "archive" / example_revision / "history"
+    parent = "swh:1:rev:0000000000000000000000000000000000000003"
+
+    assert os.listdir(history / "by-page" / "000") == [parent]
+    assert os.listdir(history / "by-hash" / "00") == [parent]
+    assert os.listdir(history / "by-date") == ["2005"]
+    assert os.listdir(history / "by-date" / "2005" / "03" / "18") == [parent]
@@ -0,0 +1,285 @@
+# Copyright (C) 2025  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import asyncio
+import itertools
+from pathlib import Path
+from typing import TYPE_CHECKING, AsyncIterator, List, cast
+
+from swh.fuse.cache import DirEntryCache
+from swh.fuse.fs.artifact import Content, Directory, Snapshot, SnapshotBranches
+from swh.fuse.fs.entry import (
+    DirListing,
+    EntryMode,
+    FuseDirEntry,
+    FuseEntry,
+    FuseSymlinkEntry,
+    LazyDirListing,
+)
+from swh.model.swhids import CoreSWHID
+
+if TYPE_CHECKING:
+    from swh.fuse.fuse import Fuse
+
+SNAPSHOT = CoreSWHID.from_string("swh:1:snp:" + "0" * 40)
+
+
+def branch(target: str, target_type: str = "revision"):
+    return {"target": target, "target_type": target_type}
+
+
+BRANCHES = {
+    "HEAD": branch("refs/heads/master", "alias"),
+    "refs/heads/dev": branch("1" * 40),
+    "refs/heads/master": branch("2" * 40),
+    "refs/heads2/main": branch("3" * 40),
+    "refs/tags/v1.0": branch("4" * 40, "release"),
+    "refs/tags/nested/v2.0": branch("5" * 40, "release"),
+}
+
+
+class FakeCache:
+    def __init__(self):
+        self.direntry = DirEntryCache({"maxram": "10MB"})
+
+
+class FakeFuse:
+    """What artifact directories need from :py:class:`swh.fuse.fuse.Fuse`"""
+
+    def __init__(self, branches=None, metadata=None):
+        self.branches = SnapshotBranches(branches or {})
+        self.metadata = metadata or {}
+        self.cache = FakeCache()
+        self.inodes = itertools.count(1)
+        # names of the directories whose entries were computed
+        self.listed: List[str] = []
+
+    def _alloc_inode(self, entry) -> int:
+        return next(self.inodes)
+
+    async def get_metadata(self, swhid: CoreSWHID):
+        return self.metadata[swhid]
+
+    async def get_snapshot_branches(self, swhid: CoreSWHID) -> SnapshotBranches:
+        return self.branches
+
+
+def test_children():
+    branches = SnapshotBranches(BRANCHES)
+    assert len(branches) == len(BRANCHES)
+    assert list(branches.children("")) == [("HEAD", BRANCHES["HEAD"]), ("refs", None)]
+    # sub-directories are listed once, whatever their number of branches
+    assert list(branches.children("refs/")) == [
+        ("heads", None),
+        ("heads2", None),
+        ("tags", None),
+    ]
+    # refs/heads2/ is not below refs/heads/
+    assert list(branches.children("refs/heads/")) == [
+        ("dev", BRANCHES["refs/heads/dev"]),
+        ("master", BRANCHES["refs/heads/master"]),
+    ]
+    assert list(branches.children("refs/tags/")) == [
+        ("nested", None),
+        ("v1.0", BRANCHES["refs/tags/v1.0"]),
+    ]
+    assert list(branches.children("refs/missing/")) == []
+
+
+def test_get():
+    branches = SnapshotBranches(BRANCHES)
+    assert branches.get("refs/heads/dev") == BRANCHES["refs/heads/dev"]
+    assert branches.get("refs/heads") is None
+    assert branches.get("refs/heads/de") is None
+    assert branches.get("zzz") is None
+
+
+def test_has_prefix():
+    branches = SnapshotBranches(BRANCHES)
+    assert branches.has_prefix("refs/")
+    assert branches.has_prefix("refs/heads/")
+    assert branches.has_prefix("refs/heads2/")
+    assert branches.has_prefix("refs/tags/nested/")
+    assert not branches.has_prefix("refs/head/")
+    assert not branches.has_prefix("refs/heads/dev/")
+    assert not branches.has_prefix("zzz/")
+    assert not SnapshotBranches({}).has_prefix("")
+
+
+def snapshot_dir(fuse: FakeFuse, prefix: str = "") -> Snapshot:
+    return Snapshot(
+        name="snapshot",
+        mode=int(EntryMode.RDONLY_DIR),
+        depth=3,
+        fuse=cast("Fuse", fuse),
+        swhid=SNAPSHOT,
+        prefix=prefix,
+    )
+
+
+def test_lookup_without_listing():
+    fuse = FakeFuse(BRANCHES)
+
+    async def run():
+        root = snapshot_dir(fuse)
+        head = await root.lookup("HEAD")
+        assert isinstance(head, FuseSymlinkEntry)
+        assert head.get_target() == Path("refs/heads/master")
+
+        refs = await root.lookup("refs")
+        assert isinstance(refs, Snapshot) and refs.prefix == "refs/"
+        heads2 = await refs.lookup("heads2")
+        assert isinstance(heads2, Snapshot) and heads2.prefix == "refs/heads2/"
+        assert await refs.lookup("head") is None
+
+        heads = await refs.lookup("heads")
+        dev = await heads.lookup("dev")
+        assert isinstance(dev, FuseSymlinkEntry)
+        assert dev.get_target() == Path(f"../../../../archive/{'1' * 40}")
+        assert await heads.lookup("main") is None
+
+        # branches looked up again keep their inode
+        assert (await heads.lookup("dev")).inode_key() == dev.inode_key()
+        master = await heads.lookup("master")
+        assert master.inode_key() not in (None, dev.inode_key())
+
+        nested = await (await refs.lookup("tags")).lookup("nested")
+        assert isinstance(nested, Snapshot) and nested.prefix == "refs/tags/nested/"
+
+        # no listing was computed
+        assert len(fuse.cache.direntry.lru_cache) == 0
+
+    asyncio.run(run())
+
+
+def test_lookup_with_listing():
+    fuse = FakeFuse(BRANCHES)
+
+    async def run():
+        heads = snapshot_dir(fuse, "refs/heads/")
+        listing = await heads.get_listing()
+        assert [entry.name async for entry in heads.get_entries()] == ["dev", "master"]
+        # looked up in the cached listing
+        assert await heads.lookup("dev") is await listing.lookup("dev")
+        # and keyed like branches looked up without a listing
+        other = await snapshot_dir(FakeFuse(BRANCHES), "refs/heads/").lookup("dev")
+        assert (await heads.lookup("dev")).inode_key() == other.inode_key()
+        assert await heads.lookup("main") is None
+
+    asyncio.run(run())
+
+
+def symlink(fuse: FakeFuse, name: str) -> FuseSymlinkEntry:
+    return FuseSymlinkEntry(name=name, depth=2, fuse=cast("Fuse", fuse), target=name)
+
+
+def test_listing_index():
+    fuse = FakeFuse()
+
+    async def run():
+        entries = [symlink(fuse, name) for name in ("b", "a", "b")]
+        listing = DirListing(entries)
+        assert len(listing) == 3
+        # on duplicate names, the first one wins
+        assert await listing.lookup("b") is entries[0]
+        assert await listing.lookup("a") is entries[1]
+        assert await listing.lookup("c") is None
+        # positions follow the listing order
+        assert [await listing.get(i) for i in range(3)] == entries
+
+    asyncio.run(run())
+
+
+class CountingDir(FuseDirEntry):
+    """Directory of many symlinks, counting how many times it is listed"""
+
+    async def compute_entries(self) -> AsyncIterator[FuseEntry]:
+        self.fuse.listed.append(self.name)
+        for i in range(1000):
+            yield self.create_child(FuseSymlinkEntry, name=f"file{i}", target="x")
+
+
+def test_lookup_uses_cached_index():
+    fuse = FakeFuse()
+
+    async def run():
+        directory = CountingDir(
+            name="dir", mode=int(EntryMode.RDONLY_DIR), depth=1, fuse=cast("Fuse", fuse)
+        )
+        found = await directory.lookup("file999")
+        assert found is not None and found.name == "file999"
+        assert await directory.lookup("file999") is found
+        for i in range(100):
+            assert await directory.lookup(f"missing{i}") is None
+        # the listing is computed once, then looked up in the direntry cache
+        assert fuse.listed == ["dir"]
+
+    asyncio.run(run())
+
+
+def test_lazy_listing():
+    fuse = FakeFuse()
+    created = []
+
+    async def create(position):
+        created.append(position)
+        return snapshot_dir(fuse, f"{position}/")
+
+    async def run():
+        listing = LazyDirListing(["a", "b", "a"], create)
+        nbytes = listing.nbytes
+        assert len(listing) == 3
+        assert created == []
+        # on duplicate names, the first one wins
+        entry = await listing.lookup("a")
+        assert created == [0]
+        # entries are accounted by the inode table, not by listings
+        assert listing.nbytes == nbytes
+        assert await listing.get(0) is entry
+        assert await listing.lookup("missing") is None
+        await listing.get(2)
+        assert created == [0, 2]
+
+    asyncio.run(run())
+
+
+def test_directory_creates_entries_on_demand():
+    directory = CoreSWHID.from_string("swh:1:dir:" + "6" * 40)
+    metadata = [
+        {
+            "name": f"file{i}",
+            "target": CoreSWHID.from_string(f"swh:1:cnt:{i:040x}"),
+            "perms": 0o100644,
+            "length": i,
+        }
+        for i in range(100)
+    ]
+    fuse = FakeFuse(metadata={directory: metadata})
+
+    async def run():
+        entry = Directory(
+            name="dir",
+            mode=int(EntryMode.RDONLY_DIR),
+            depth=2,
+            fuse=fuse,
+            swhid=directory,
+        )
+        listing = await entry.get_listing()
+        assert isinstance(listing, LazyDirListing)
+        assert len(listing) == 100
+
+        file = await entry.lookup("file42")
+        assert isinstance(file, Content)
+        assert await file.size() == 42
+        assert [i for i, e in enumerate(listing.created) if e is not None] == [42]
+
+        # readdir offsets only create the entries it reads
+        names = []
+        async for child in entry.get_entries(98):
+            names.append(child.name)
+        assert names == ["file98", "file99"]
+        assert sum(e is not None for e in listing.created) == 3
+
+    asyncio.run(run())
@@ -0,0 +1,442 @@
+# Copyright (C) 2025  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import asyncio
+import copy
+from datetime import datetime
+import json
+import mmap
+import os
+import sqlite3
+from typing import List
+
+import pytest
+
+from swh.fuse.cache import (
+    BlobCache,
+    FileBlobCache,
+    HistoryCache,
+    MetadataCache,
+    swhid_key,
+)
+from swh.fuse.compression import train_dictionary
+from swh.fuse.history import HistoryGraph
+from swh.model.swhids import CoreSWHID
+
+CNT_SWHIDS = [CoreSWHID.from_string(f"swh:1:cnt:{i:040x}") for i in range(10)]
+DIR_SWHID = CoreSWHID.from_string("swh:1:dir:" + "1" * 40)
+DIR_METADATA = [
+    {
+        "dir_id": "1" * 40,
+        "name": "README",
+        "type": "file",
+        "target": "3" * 40,
+        "perms": 0o100644,
+        "length": 7,
+    }
+]
+
+
+def test_metadata_lru_is_bounded_by_memory(tmp_path, monkeypatch):
+    parses = []
+    loads = json.loads
+
+    def counting_loads(*args, **kwargs):
+        parses.append(None)
+        return loads(*args, **kwargs)
+
+    monkeypatch.setattr("swh.fuse.cache.json.loads", counting_loads)
+
+    async def run():
+        conf = {"path": str(tmp_path / "metadata.sqlite"), "lru-maxram": "2KB"}
+        async with MetadataCache(conf) as cache:
+            # the metadata is typified without parsing its JSON again
+            typed = await cache.set(DIR_SWHID, copy.deepcopy(DIR_METADATA))
+            assert typed[0]["target"] == CoreSWHID.from_string("swh:1:cnt:" + "3" * 40)
+            assert await cache.get(DIR_SWHID) is typed
+            assert parses == []
+
+            for swhid in CNT_SWHIDS:
+                await cache.set(swhid, {"length": 42, "padding": "x" * 100})
+            assert cache.lru_used_ram == sum(
+                cached.nbytes for cached in cache.lru.values()
+            )
+            assert cache.lru_used_ram <= 2000
+            # least recently used objects were forgotten, but are still stored
+            assert swhid_key(DIR_SWHID) not in cache.lru
+            assert swhid_key(CNT_SWHIDS[-1]) in cache.lru
+            assert await cache.get(DIR_SWHID) == typed
+            assert len(parses) == 1
+
+    asyncio.run(run())
+
+
+def stored_swhids(path) -> List[bytes]:
+    with sqlite3.connect(path) as conn:
+        rows = conn.execute("select swhid from metadata_cache").fetchall()
+    conn.close()
+    return [swhid for (swhid,) in rows]
+
+
+def test_pending_writes_are_read(tmp_path):
+    path = str(tmp_path / "metadata.sqlite")
+
+    async def run():
+        conf = {"path": path, "lru-maxram": "0B", "flush-interval": 60}
+        async with MetadataCache(conf) as cache:
+            await cache.set(CNT_SWHIDS[0], {"length": 42})
+            assert stored_swhids(path) == []
+            assert await cache.get(CNT_SWHIDS[0]) == {"length": 42}
+            await cache.flush()
+            assert stored_swhids(path) == [swhid_key(CNT_SWHIDS[0])]
+            assert await cache.get(CNT_SWHIDS[0]) == {"length": 42}
+
+    asyncio.run(run())
+
+
+def test_failed_flush_is_retried(tmp_path, monkeypatch):
+    monkeypatch.setattr("swh.fuse.cache.BUSY_TIMEOUT", 0.1)
+    path = str(tmp_path / "metadata.sqlite")
+
+    async def run():
+        conf = {"path": path, "lru-maxram": "0B", "flush-interval": 60}
+        async with MetadataCache(conf) as cache:
+            await cache.set(CNT_SWHIDS[0], {"length": 42})
+            # another process holds the write lock
+            other = sqlite3.connect(path, isolation_level=None)
+            other.execute("begin immediate")
+            await cache.flush()
+            assert stored_swhids(path) == []
+            # the write is still visible, and queued again
+            assert await cache.get(CNT_SWHIDS[0]) == {"length": 42}
+            assert cache.flush_timer is not None
+            other.execute("rollback")
+            other.close()
+
+            await cache.flush()
+            assert stored_swhids(path) == [swhid_key(CNT_SWHIDS[0])]
+            assert not cache.pending
+
+    asyncio.run(run())
+
+
+def test_failed_flush_is_rolled_back(tmp_path):
+    path = str(tmp_path / "metadata.sqlite")
+
+    async def run():
+        conf = {"path": path, "lru-maxram": "0B", "flush-interval": 60}
+        async with MetadataCache(conf) as cache:
+            await cache.set(CNT_SWHIDS[0], {"length": 42})
+            # fails once the first statement locked the database
+            await cache.write(
+                "missing", "insert into missing values (?)", [(0, (0,), None)]
+            )
+            await cache.flush()
+            assert not cache.conn.in_transaction
+            # other processes can write
+            other = sqlite3.connect(path, timeout=0)
+            with other:
+                other.execute("insert into metadata_cache values (x'00', '{}')")
+            other.close()
+            assert set(cache.pending) == {
+                ("metadata_cache", swhid_key(CNT_SWHIDS[0])),
+                ("missing", 0),
+            }
+            del cache.pending[("missing", 0)]
+
+    asyncio.run(run())
+
+
+def test_failed_flush_keeps_writes_of_caches_sharing_the_connection(tmp_path):
+    path = str(tmp_path / "metadata.sqlite")
+
+    async def run():
+        conf = {"path": path, "lru-maxram": "0B", "flush-interval": 60}
+        async with MetadataCache(conf) as metadata:
+            async with HistoryCache(conf, conn=metadata.conn) as history:
+                await metadata.set(CNT_SWHIDS[0], {"length": 42})
+                await metadata.set_visits("https://example.org", [])
+                await history.write(
+                    "missing", "insert into missing values (?)", [(0, (0,), None)]
+                )
+                # the history flush fails while the metadata one is in progress
+                await asyncio.gather(metadata.flush(), history.flush())
+                assert stored_swhids(path) == [swhid_key(CNT_SWHIDS[0])]
+                history.pending.clear()
+
+    asyncio.run(run())
+
+
+def blob_conf(tmp_path, **conf):
+    return {
+        "path": str(tmp_path / "blob.sqlite"),
+        "directory": str(tmp_path / "blobs"),
+        "small-blob-size": 16,
+        "flush-interval": 0,
+        **conf,
+    }
+
+
+def stored_files(tmp_path) -> List[str]:
+    return sorted(
+        path.name for path in (tmp_path / "blobs").glob("**/*") if path.is_file()
+    )
+
+
+def test_file_blob_cache(tmp_path):
+    large, small = CNT_SWHIDS[:2]
+
+    async def run():
+        async with FileBlobCache(blob_conf(tmp_path)) as cache:
+            await cache.set(large, b"large " * 10)
+            await cache.set(small, b"small")
+            assert await cache.get(CNT_SWHIDS[2]) is None
+
+            blob = await cache.get(large)
+            # large blobs are mapped from their file, sharded by SHA1-git
+            assert isinstance(blob, mmap.mmap)
+            assert blob[:] == b"large " * 10
+            assert cache.blob_path(large).relative_to(tmp_path / "blobs").parts[:2] == (
+                "00",
+                "00",
+            )
+            # small blobs are stored in SQLite
+            assert await cache.get(small) == b"small"
+            assert stored_files(tmp_path) == [large.object_id.hex()]
+
+            await cache.remove(large)
+            assert await cache.get(large) is None
+            assert stored_files(tmp_path) == []
+
+    asyncio.run(run())
+
+
+def test_file_blob_cache_atomic_writes(tmp_path, monkeypatch):
+    replace = os.replace
+
+    def failing_replace(src, dst):
+        raise OSError("disk full")
+
+    async def run():
+        async with FileBlobCache(blob_conf(tmp_path)) as cache:
+            monkeypatch.setattr("swh.fuse.cache.os.replace", failing_replace)
+            await cache.set(CNT_SWHIDS[0], b"large " * 10)
+            # no partial file is left behind, to be read as the blob
+            assert stored_files(tmp_path) == []
+            assert await cache.get(CNT_SWHIDS[0]) is None
+
+            monkeypatch.setattr("swh.fuse.cache.os.replace", replace)
+            await cache.set(CNT_SWHIDS[0], b"large " * 10)
+            # written once, to a temporary file renamed over the blob's name
+            await cache.set(CNT_SWHIDS[0], b"other " * 10)
+            assert stored_files(tmp_path) == [CNT_SWHIDS[0].object_id.hex()]
+            assert (await cache.get(CNT_SWHIDS[0]))[:] == b"large " * 10
+
+    asyncio.run(run())
+
+
+def test_file_blob_cache_compressed(tmp_path):
+    compressible, incompressible = CNT_SWHIDS[:2]
+    random = os.urandom(100)
+
+    async def run():
+        conf = blob_conf(tmp_path, compression="zstd")
+        async with FileBlobCache(conf) as cache:
+            await cache.set(compressible, b"a" * 1000)
+            await cache.set(incompressible, random)
+            assert stored_files(tmp_path) == sorted(
+                [f"{compressible.object_id.hex()}.zst", incompressible.object_id.hex()]
+            )
+            assert await cache.get(compressible) == b"a" * 1000
+            assert (await cache.get(incompressible))[:] == random
+
+    asyncio.run(run())
+
+
+def test_blobs_read_again_survive_eviction(tmp_path):
+    blob = b"x" * 300
+    first, *others = CNT_SWHIDS[:4]
+
+    async def run():
+        conf = {"path": str(tmp_path / "blob.sqlite"), "maxsize": "1000B"}
+        async with BlobCache(conf) as cache:
+            await cache.set(first, blob)
+            # read from the cache once, after being stored on first read
+            assert await cache.get(first) == blob
+            for swhid in others:
+                await cache.set(swhid, blob)
+            assert cache.eviction is not None
+            await cache.eviction
+
+            assert cache.size == 900
+            assert await cache.get(first) == blob
+            assert await cache.get(others[0]) is None
+            assert await cache.get(others[-1]) == blob
+
+    asyncio.run(run())
+
+
+def test_existing_blobs_are_tracked_once(tmp_path, monkeypatch):
+    conf = {"path": str(tmp_path / "blob.sqlite"), "flush-interval": 0}
+
+    async def run(swhid, **extra_conf):
+        async with BlobCache({**conf, **extra_conf}) as cache:
+            await cache.set(swhid, b"x" * 300)
+            return cache.size
+
+    asyncio.run(run(CNT_SWHIDS[0]))
+    # stored before maxsize was set, then the new blob
+    assert asyncio.run(run(CNT_SWHIDS[1], maxsize="1MB")) == 600
+
+    async def rescan(self):
+        raise AssertionError("blob_usage is rebuilt")
+
+    monkeypatch.setattr(BlobCache, "track_existing", rescan)
+    assert asyncio.run(run(CNT_SWHIDS[2], maxsize="1MB")) == 900
+
+
+def dictionary(tmp_path, name: str) -> str:
+    path = tmp_path / f"{name}.zdict"
+    path.write_bytes(
+        train_dictionary([f"{name} {i}: {i * 7}".encode() for i in range(2000)], 4096)
+    )
+    return str(path)
+
+
+def unreadable_conf(tmp_path, change):
+    """Compression settings before and after values became unreadable"""
+    before = {
+        "compression": "zstd",
+        "compression-dictionary": dictionary(tmp_path, "a"),
+    }
+    if change == "compression disabled":
+        after = {}
+    else:
+        after = {**before, "compression-dictionary": dictionary(tmp_path, "b")}
+    return before, after
+
+
+@pytest.mark.parametrize("change", ["compression disabled", "dictionary changed"])
+@pytest.mark.parametrize("cache_cls", [BlobCache, FileBlobCache])
+def test_unreadable_blobs_are_replaced(tmp_path, cache_cls, change):
+    before, after = unreadable_conf(tmp_path, change)
+    blob = b"a" * 1000
+
+    async def get(conf, store=False):
+        async with cache_cls({**blob_conf(tmp_path), **conf}) as cache:
+            # blobs are only stored after a miss
+            if store and await cache.get(CNT_SWHIDS[0]) is None:
+                await cache.set(CNT_SWHIDS[0], blob)
+            content = await cache.get(CNT_SWHIDS[0])
+            return None if content is None else bytes(content)
+
+    assert asyncio.run(get(before, store=True)) == blob
+    assert asyncio.run(get(after)) is None
+    # fetched again, then stored in place of the unreadable blob
+    assert asyncio.run(get(after, store=True)) == blob
+    assert asyncio.run(get(after)) == blob
+
+
+@pytest.mark.parametrize("prefetched", [False, True])
+@pytest.mark.parametrize("change", ["compression disabled", "dictionary changed"])
+def test_unreadable_metadata_is_replaced(tmp_path, change, prefetched):
+    before, after = unreadable_conf(tmp_path, change)
+    metadata = {"length": 42, "padding": "x" * 100}
+
+    async def get(conf, store=False):
+        conf = {"path": str(tmp_path / "metadata.sqlite"), "lru-maxram": "0B", **conf}
+        async with MetadataCache(conf) as cache:
+            # metadata is only stored after a miss
+            if store and await cache.get(CNT_SWHIDS[0]) is None:
+                if prefetched:
+                    await cache.set_many([(CNT_SWHIDS[0], metadata)])
+                else:
+                    await cache.set(CNT_SWHIDS[0], metadata)
+            return await cache.get(CNT_SWHIDS[0])
+
+    assert asyncio.run(get(before, store=True)) == metadata
+    assert asyncio.run(get(after)) is None
+    # fetched again, then stored in place of the unreadable metadata
+    assert asyncio.run(get(after, store=True)) == metadata
+    assert asyncio.run(get(after)) == metadata
+
+
+def test_migrate_baseline_caches(tmp_path):
+    """Caches created before the schema_version table are migrated"""
+    path = str(tmp_path / "cache.sqlite")
+    with sqlite3.connect(path) as conn:
+        conn.executescript(
+            """
+            create table metadata_cache (
+                swhid text not null primary key, metadata blob, date text
+            );
+            create table visits_cache (
+                url text not null primary key, metadata blob, itime timestamp
+            );
+            create table blob_cache (swhid text not null primary key, blob blob);
+            create table history_graph (
+                src text not null, dst text not null, unique(src, dst)
+            );
+            create index idx_history on history_graph(src);
+            """
+        )
+        conn.execute(
+            "insert into metadata_cache values (?, ?, null)",
+            (str(DIR_SWHID), json.dumps(DIR_METADATA)),
+        )
+        conn.execute(
+            "insert into visits_cache values ('url', '[]', ?)",
+            (datetime.now().isoformat(" "),),
+        )
+        conn.execute("insert into blob_cache values (?, ?)", (str(CNT_SWHIDS[0]), b"a"))
+        conn.execute(
+            "insert into history_graph values (?, ?)",
+            (str(DIR_SWHID), str(CNT_SWHIDS[0])),
+        )
+    conn.close()
+
+    async def run():
+        async with MetadataCache({"path": path}) as cache:
+            assert (await cache.get(DIR_SWHID))[0]["name"] == "README"
+            assert await cache.get_visits("url") == []
+        async with BlobCache({"path": path, "maxsize": "1MB"}) as cache:
+            assert await cache.get(CNT_SWHIDS[0]) == b"a"
+            assert cache.size == 1
+        async with HistoryCache({"path": path}) as cache:
+            # edges lack dates: histories are fetched again
+            assert await cache.get(DIR_SWHID) is None
+            assert "history_graph" not in await cache.tables()
+
+    asyncio.run(run())
+    with sqlite3.connect(path) as conn:
+        versions = dict(conn.execute("select * from schema_version"))
+    conn.close()
+    assert versions == {"metadata": 2, "blob": 2, "history": 2}
+
+
+def test_history_graphs_are_tracked(tmp_path, monkeypatch):
+    monkeypatch.setattr(HistoryCache, "IN_MEMORY_GRAPHS", 1)
+    roots = [CoreSWHID.from_string(f"swh:1:rev:{i:040x}") for i in range(2)]
+    tracked = []
+
+    async def run():
+        async with HistoryCache({"path": str(tmp_path / "history.sqlite")}) as cache:
+            cache.track = tracked.append
+            for root in roots:
+                edges = [(str(root), f"swh:1:rev:{i:040x}") for i in range(10, 100)]
+                await cache.set(root, HistoryGraph.from_edges(root, edges, {}))
+            # only the last graph is kept in memory
+            graph = cache.graphs[swhid_key(roots[1])]
+            assert sum(tracked) == graph.sizeof()
+
+            # indexes built on demand are reported the next time the graph is used
+            history = await cache.get(roots[1])
+            assert history is not None
+            before = sum(tracked)
+            history.hash_buckets(2)
+            await cache.get(roots[1])
+            assert sum(tracked) == graph.sizeof() > before
+
+    asyncio.run(run())
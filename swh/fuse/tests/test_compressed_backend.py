@@ -0,0 +1,350 @@
+# Copyright (C) 2025  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""
+Tests of :py:class:`swh.fuse.backends.compressed.CompressedGraphBackend` and of its
+:py:class:`swh.fuse.backends.compressed.NodeBatcher`, on top of a fake graph server.
+"""
+
+import asyncio
+from contextlib import aclosing
+from datetime import datetime, timedelta, timezone
+import logging
+from typing import Dict, List, Optional, Set
+
+import grpc
+import pytest
+
+from swh.core.statsd import Statsd
+from swh.fuse.backends import compressed
+from swh.fuse.backends.compressed import CompressedGraphBackend, NodeBatcher
+from swh.fuse.history import HistoryGraph, HistoryGraphBuilder
+import swh.graph.grpc.swhgraph_pb2 as swhgraph
+from swh.model.swhids import CoreSWHID
+
+SWHIDS = [f"swh:1:dir:{i:040x}" for i in range(5)]
+UNKNOWN = "swh:1:dir:" + "f" * 40
+
+
+class NotFound(grpc.RpcError):
+    def code(self):
+        return grpc.StatusCode.NOT_FOUND
+
+
+class FakeBackend:
+    """Resolves known SWHIDs, like a graph server whose ``Traverse`` fails as
+    soon as one of its sources is unknown"""
+
+    node_request = staticmethod(CompressedGraphBackend.node_request)
+
+    def __init__(self, known: Set[str]):
+        self.known = known
+        self.statsd = Statsd()
+        self.logger = logging.getLogger(__name__)
+        self.traversals: List[List[str]] = []
+        self.nodes: List[str] = []
+
+    async def _get_node(self, request):
+        self.nodes.append(request.swhid)
+        if request.swhid not in self.known:
+            raise NotFound()
+        return swhgraph.Node(swhid=request.swhid)
+
+    async def _traverse(self, request):
+        self.traversals.append(list(request.src))
+        if not self.known.issuperset(request.src):
+            raise NotFound()
+        for swhid in request.src:
+            yield swhgraph.Node(swhid=swhid)
+
+
+def masked(node: swhgraph.Node, paths: List[str], edges: str = "*") -> swhgraph.Node:
+    """Copy of ``node`` reduced to the fields in ``paths`` (all if empty), keeping
+    only the successors allowed by ``edges`` (all if empty), like the graph server
+    does"""
+    if not paths:
+        paths = ["cnt", "rev", "successor.swhid", "successor.label"]
+    allowed = {tuple(edge.split(":")) for edge in edges.split(",")}
+    result = swhgraph.Node(swhid=node.swhid)
+    if "cnt" in paths and node.HasField("cnt"):
+        result.cnt.CopyFrom(node.cnt)
+    if any(path.startswith("rev") for path in paths) and node.HasField("rev"):
+        result.rev.CopyFrom(node.rev)
+    if "successor.swhid" in paths:
+        for successor in node.successor:
+            edge = (node.swhid.split(":")[2], successor.swhid.split(":")[2])
+            if edges not in ("", "*") and edge not in allowed:
+                continue
+            copy = result.successor.add(swhid=successor.swhid)
+            if "successor.label" in paths:
+                copy.label.extend(successor.label)
+    return result
+
+
+class FakeCall:
+    """Streamed response of :py:meth:`FakeStub.Traverse`"""
+
+    def __init__(self, nodes: List[swhgraph.Node]):
+        self.nodes = nodes
+        self.cancelled = False
+
+    async def read(self):
+        await asyncio.sleep(0)
+        return self.nodes.pop(0) if self.nodes else grpc.aio.EOF
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class FakeStub:
+    """Graph server holding ``nodes``, that only implements what
+    :py:class:`CompressedGraphBackend` uses"""
+
+    def __init__(self, nodes: List[swhgraph.Node]):
+        self.nodes: Dict[str, swhgraph.Node] = {node.swhid: node for node in nodes}
+        self.calls: List[FakeCall] = []
+        self.requests: List[swhgraph.TraversalRequest] = []
+        self.sent: List[swhgraph.Node] = []
+
+    async def GetNode(self, request):
+        if request.swhid not in self.nodes:
+            raise NotFound()
+        node = masked(self.nodes[request.swhid], list(request.mask.paths))
+        self.sent.append(node)
+        return node
+
+    def Traverse(self, request):
+        self.requests.append(request)
+        depths = {swhid: 0 for swhid in request.src}
+        queue = list(request.src)
+        returned = []
+        for swhid in queue:
+            node = masked(self.nodes[swhid], list(request.mask.paths), request.edges)
+            if not request.return_nodes.types or request.return_nodes.types == (
+                swhid.split(":")[2]
+            ):
+                returned.append(node)
+            if request.max_depth and depths[swhid] >= request.max_depth:
+                continue
+            for successor in masked(
+                self.nodes[swhid], ["successor.swhid"], request.edges
+            ).successor:
+                if successor.swhid not in depths:
+                    depths[successor.swhid] = depths[swhid] + 1
+                    queue.append(successor.swhid)
+        self.sent.extend(returned)
+        self.calls.append(FakeCall(returned))
+        return self.calls[-1]
+
+
+def graph_backend(monkeypatch, stub: FakeStub, **graph_conf) -> CompressedGraphBackend:
+    """Backend connected to ``stub``; it must be created in a running event loop"""
+    monkeypatch.setattr(
+        CompressedGraphBackend, "_check_connectivity", lambda self: None
+    )
+    monkeypatch.setattr(
+        compressed.swhgraph_grpc, "TraversalServiceStub", lambda channel: stub
+    )
+    conf = {"grpc-url": "localhost:0", "batch-window": 0, **graph_conf}
+    return CompressedGraphBackend({"graph": conf})
+
+
+def swhid(object_type: str, i: int) -> str:
+    return f"swh:1:{object_type}:{i:040x}"
+
+
+def directory(i: int, *entries: str) -> swhgraph.Node:
+    node = swhgraph.Node(swhid=swhid("dir", i))
+    for entry in entries:
+        successor = node.successor.add(swhid=entry)
+        successor.label.add(name=f"name-{entry[-4:]}".encode(), permission=0o100644)
+    return node
+
+
+def content(i: int) -> swhgraph.Node:
+    return swhgraph.Node(swhid=swhid("cnt", i), cnt=swhgraph.ContentData(length=i))
+
+
+def test_directory_metadata_only_streams_contents(monkeypatch):
+    stub = FakeStub(
+        [
+            directory(0, swhid("cnt", 1), swhid("dir", 2)),
+            content(1),
+            directory(2, *(swhid("cnt", i) for i in range(3, 10))),
+            *(content(i) for i in range(3, 10)),
+        ]
+    )
+
+    async def run():
+        backend = graph_backend(monkeypatch, stub)
+        try:
+            return await backend.get_metadata(CoreSWHID.from_string(swhid("dir", 0)))
+        finally:
+            await backend.shutdown()
+
+    listing = asyncio.run(run())
+    assert [(entry["type"], entry.get("length")) for entry in listing] == [
+        ("file", 1),
+        ("dir", None),
+    ]
+    # the sub-directory and its own entries are not sent
+    assert sorted(node.swhid for node in stub.sent) == [
+        swhid("cnt", 1),
+        swhid("dir", 0),
+    ]
+    assert all(call.cancelled for call in stub.calls)
+
+
+def test_traversal_is_streamed(monkeypatch):
+    stub = FakeStub(
+        [content(i) for i in range(3)]
+        + [directory(9, *(swhid("cnt", i) for i in range(3)))]
+    )
+    timings = []
+
+    async def run():
+        backend = graph_backend(monkeypatch, stub)
+        monkeypatch.setattr(
+            backend.statsd,
+            "timing",
+            lambda metric, value, *args, **kwargs: timings.append(metric),
+        )
+        request = swhgraph.TraversalRequest(src=[swhid("dir", 9)])
+        received = []
+        async with aclosing(backend._traverse(request)) as nodes:
+            async for node in nodes:
+                received.append(node.swhid)
+                # the call is still open, with the remaining nodes not read yet
+                assert not stub.calls[0].cancelled
+                assert len(stub.calls[0].nodes) == 4 - len(received)
+                if len(received) == 2:
+                    break
+        # leaving the traversal early cancels the call
+        assert stub.calls[0].cancelled
+        await backend.shutdown()
+        return received, backend.total_waiting_ms
+
+    received, waiting_ms = asyncio.run(run())
+    assert received == [swhid("dir", 9), swhid("cnt", 0)]
+    # waiting time is reported once for the whole traversal
+    assert timings == ["swhfuse_waiting_graph"]
+    assert waiting_ms > 0
+
+
+def revision(i: int, parents: List[int], date: Optional[datetime]) -> swhgraph.Node:
+    node = swhgraph.Node(swhid=swhid("rev", i))
+    for parent in parents:
+        node.successor.add(swhid=swhid("rev", parent))
+    if date is not None:
+        offset = date.utcoffset()
+        node.rev.author_date = int(date.timestamp())
+        node.rev.author_date_offset = int(offset.total_seconds() // 60) if offset else 0
+    return node
+
+
+def test_history_with_dates(monkeypatch):
+    eastern = timezone(timedelta(hours=-5))
+    stub = FakeStub(
+        [
+            # a merge: both branches share an ancestor without date
+            revision(0, [1, 2], datetime(2024, 3, 1, 12, tzinfo=timezone.utc)),
+            revision(1, [3], datetime(2024, 2, 1, 23, 30, tzinfo=eastern)),
+            revision(2, [3], datetime(2023, 12, 31, 12, tzinfo=timezone.utc)),
+            revision(3, [], None),
+        ]
+    )
+    root = CoreSWHID.from_string(swhid("rev", 0))
+
+    async def run():
+        backend = graph_backend(monkeypatch, stub)
+        try:
+            builder = HistoryGraphBuilder(root)
+            async for revision, parents, date in backend.iter_history(root):
+                builder.add(revision, parents, date)
+            return builder.build(), await backend.get_history(root)
+        finally:
+            await backend.shutdown()
+
+    graph, (edges, dates) = asyncio.run(run())
+    assert stub.requests[0].edges == "rev:rev"
+    assert sorted(edges) == [
+        (swhid("rev", 0), swhid("rev", 1)),
+        (swhid("rev", 0), swhid("rev", 2)),
+        (swhid("rev", 1), swhid("rev", 3)),
+        (swhid("rev", 2), swhid("rev", 3)),
+    ]
+    # dates keep their time zone
+    assert dates[swhid("rev", 1)] == "2024-02-01T23:30:00-05:00"
+    assert dates[swhid("rev", 3)] is None
+    assert graph.to_bytes() == HistoryGraph.from_edges(root, edges, dates).to_bytes()
+
+    history = graph.history()
+    revisions = [CoreSWHID.from_string(swhid("rev", i)) for i in range(4)]
+    assert list(history) == revisions[1:]
+    assert history.date_children([]) == [1970, 2023, 2024]
+    assert history.on_date(2024, 2, 1) == revisions[1:2]
+    assert history.on_date(1970, 1, 1) == revisions[3:]
+
+
+def test_batches_are_split():
+    backend = FakeBackend(set(SWHIDS))
+
+    async def run():
+        batcher = NodeBatcher(backend, batch_window=0.01, batch_size=2)
+        # the same node requested twice is fetched once
+        nodes = await asyncio.gather(
+            *(batcher.get_node(swhid) for swhid in SWHIDS[:1] + SWHIDS)
+        )
+        assert [node.swhid for node in nodes] == SWHIDS[:1] + SWHIDS
+
+    asyncio.run(run())
+    assert backend.traversals == [SWHIDS[0:2], SWHIDS[2:4]]
+    # the last batch only has one node
+    assert backend.nodes == SWHIDS[4:]
+
+
+def test_failed_batch_falls_back_to_single_requests():
+    backend = FakeBackend(set(SWHIDS))
+
+    async def run():
+        batcher = NodeBatcher(backend, batch_window=0.01, batch_size=10)
+        return await asyncio.gather(
+            *(batcher.get_node(swhid) for swhid in SWHIDS[:2] + [UNKNOWN]),
+            return_exceptions=True,
+        )
+
+    first, second, unknown = asyncio.run(run())
+    assert backend.traversals == [SWHIDS[:2] + [UNKNOWN]]
+    assert sorted(backend.nodes) == sorted(SWHIDS[:2] + [UNKNOWN])
+    # only the unknown node's waiter gets the error
+    assert (first.swhid, second.swhid) == tuple(SWHIDS[:2])
+    assert isinstance(unknown, NotFound)
+
+
+def test_batching_disabled():
+    backend = FakeBackend(set(SWHIDS))
+
+    async def run():
+        batcher = NodeBatcher(backend, batch_window=0, batch_size=10)
+        await asyncio.gather(*(batcher.get_node(swhid) for swhid in SWHIDS))
+
+    asyncio.run(run())
+    assert backend.traversals == []
+    assert backend.nodes == SWHIDS
+
+
+@pytest.mark.parametrize("cancelled", [0, 1])
+def test_cancelled_waiter(cancelled):
+    backend = FakeBackend(set(SWHIDS))
+
+    async def run():
+        batcher = NodeBatcher(backend, batch_window=0.01, batch_size=10)
+        waiters = [asyncio.create_task(batcher.get_node(SWHIDS[0])) for _ in range(2)]
+        await asyncio.sleep(0)
+        waiters[cancelled].cancel()
+        node = await waiters[1 - cancelled]
+        assert node.swhid == SWHIDS[0]
+
+    asyncio.run(run())
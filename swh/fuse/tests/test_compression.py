@@ -0,0 +1,71 @@
+# Copyright (C) 2025  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import asyncio
+import json
+
+import pytest
+
+from swh.fuse.compression import Codec, is_compressed, train_dictionary
+
+VALUES = [
+    json.dumps({"name": f"file{i}.py", "perms": 33188, "length": i}).encode()
+    for i in range(2000)
+]
+
+
+def dictionary_path(tmp_path, samples=VALUES, name="values.zdict") -> str:
+    path = tmp_path / name
+    path.write_bytes(train_dictionary(samples, size=4096))
+    return str(path)
+
+
+def test_codec_from_conf(tmp_path):
+    assert Codec.from_conf({}) is None
+    codec = Codec.from_conf(
+        {
+            "compression": "zstd",
+            "compression-level": 9,
+            "compression-dictionary": dictionary_path(tmp_path),
+        }
+    )
+    assert codec.level == 9 and codec.dictionary is not None
+    with pytest.raises(ValueError):
+        Codec.from_conf({"compression": "lz4"})
+
+
+@pytest.mark.parametrize("with_dictionary", [False, True])
+def test_round_trip(tmp_path, with_dictionary):
+    codec = Codec(dictionary=dictionary_path(tmp_path) if with_dictionary else None)
+    for value in (VALUES[0], b"", b"a" * 10000):
+        compressed = codec.compress(value)
+        assert is_compressed(compressed)
+        assert codec.decompress(compressed) == value
+    assert codec.compress_many(VALUES[:3]) == [codec.compress(v) for v in VALUES[:3]]
+
+    async def run():
+        compressed = await codec.compress_async(VALUES[1])
+        return await codec.decompress_async(compressed)
+
+    assert asyncio.run(run()) == VALUES[1]
+
+
+def test_dictionary_makes_small_values_smaller(tmp_path):
+    plain = Codec()
+    trained = Codec(dictionary=dictionary_path(tmp_path))
+    assert len(trained.compress(VALUES[42])) < len(plain.compress(VALUES[42]))
+
+
+def test_other_dictionary(tmp_path):
+    codec = Codec(dictionary=dictionary_path(tmp_path))
+    other_samples = [f"other sample {i}, {i * 7}".encode() for i in range(2000)]
+    other = Codec(dictionary=dictionary_path(tmp_path, other_samples, "other.zdict"))
+    compressed = codec.compress(VALUES[42])
+    for unable in (other, Codec()):
+        with pytest.raises(ValueError):
+            unable.decompress(compressed)
+    with pytest.raises(ValueError):
+        codec.decompress(b"not compressed")
+    assert not is_compressed(VALUES[42].decode())
@@ -0,0 +1,373 @@
+# Copyright (C) 2025  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""
+Tests of the :py:class:`swh.fuse.fuse.Fuse` operations, called directly (without
+mounting) on top of in-memory caches and fake back-ends.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+import errno
+import os
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import pyfuse3
+import pytest
+
+from swh.fuse.backends import ContentBackend, GraphBackend
+from swh.fuse.cache import FuseCache, swhid_key
+from swh.fuse.fs.artifact import Directory
+from swh.fuse.fs.entry import EntryMode
+from swh.fuse.fuse import Fuse
+from swh.model.swhids import CoreSWHID
+
+ROOT = pyfuse3.InodeT(pyfuse3.ROOT_INODE)
+CTX = pyfuse3.RequestContext()
+DIR_SWHID = CoreSWHID.from_string("swh:1:dir:" + "1" * 40)
+OTHER_DIR_SWHID = CoreSWHID.from_string("swh:1:dir:" + "2" * 40)
+CNT_SWHID = CoreSWHID.from_string("swh:1:cnt:" + "3" * 40)
+SNP_SWHIDS = [CoreSWHID.from_string(f"swh:1:snp:{i:040x}") for i in range(2)]
+
+
+class FakeGraphBackend(GraphBackend):
+    def __init__(self, metadata: Dict[CoreSWHID, Any], delay: float = 0):
+        self.metadata = metadata
+        self.delay = delay
+        self.calls: List[CoreSWHID] = []
+
+    async def get_metadata(self, swhid, full=False):
+        self.calls.append(swhid)
+        # let concurrent callers run
+        await asyncio.sleep(self.delay)
+        return self.metadata[swhid]
+
+    async def get_history(self, swhid):
+        return [], {}
+
+    async def get_visits(self, url_encoded):
+        return []
+
+
+class FakeContentBackend(ContentBackend):
+    def __init__(self, blobs: Dict[CoreSWHID, bytes]):
+        self.blobs = blobs
+        self.calls: List[CoreSWHID] = []
+
+    async def get_blob(self, swhid):
+        self.calls.append(swhid)
+        await asyncio.sleep(0)
+        return self.blobs[swhid]
+
+
+@asynccontextmanager
+async def fuse_instance(
+    graph: Optional[GraphBackend] = None,
+    content: Optional[ContentBackend] = None,
+    **conf: Any,
+) -> AsyncIterator[Fuse]:
+    cache_conf = {
+        "metadata": {"in-memory": True},
+        "blob": {"in-memory": True},
+        "direntry": {"maxram": "10%"},
+    }
+    async with FuseCache(cache_conf) as cache:
+        yield Fuse(
+            cache,
+            {"cache": cache_conf, "json-indent": None, **conf},
+            graph or FakeGraphBackend({}),
+            content or FakeContentBackend({}),
+        )
+
+
+def test_forget_drops_inode():
+    async def run():
+        async with fuse_instance() as fs:
+            inode = (await fs.lookup(ROOT, b"archive", CTX)).st_ino
+            assert (await fs.lookup(ROOT, b"archive", CTX)).st_ino == inode
+
+            await fs.forget([(inode, 1)])
+            assert fs.inode2entry(inode).name == "archive"
+
+            await fs.forget([(inode, 1)])
+            with pytest.raises(pyfuse3.FUSEError):
+                fs.inode2entry(inode)
+            assert inode not in fs._nlookup
+
+            # the root is never forgotten
+            await fs.forget([(ROOT, 1)])
+            assert fs.inode2entry(ROOT) is fs.root
+
+    asyncio.run(run())
+
+
+def test_stable_inodes_across_mounts():
+    graph = FakeGraphBackend({DIR_SWHID: []})
+
+    async def archived_inode():
+        async with fuse_instance(graph) as fs:
+            archive = (await fs.lookup(ROOT, b"archive", CTX)).st_ino
+            attrs = await fs.lookup(archive, str(DIR_SWHID).encode(), CTX)
+            return attrs.st_ino
+
+    inode = asyncio.run(archived_inode())
+    assert inode & Fuse.KEYED_INODE_BIT
+    assert asyncio.run(archived_inode()) == inode
+
+
+def test_views_have_their_own_inodes():
+    graph = FakeGraphBackend({DIR_SWHID: []})
+
+    def directory(fs: Fuse, view: str) -> Directory:
+        return Directory(
+            name=str(DIR_SWHID),
+            mode=int(EntryMode.RDONLY_DIR),
+            depth=2,
+            fuse=fs,
+            swhid=DIR_SWHID,
+            view=view,
+        )
+
+    async def run():
+        async with fuse_instance(graph) as fs:
+            archived = directory(fs, "archive")
+            listing = await archived.get_listing()
+            # interchangeable entries share their inode, hence their listing
+            again = directory(fs, "archive")
+            assert again.inode == archived.inode
+            assert fs.cache.direntry.get(again) is listing
+            # children of other views follow another kernel cache policy
+            other = directory(fs, "origin")
+            assert other.inode != archived.inode
+            assert fs.cache.direntry.get(other) is None
+
+    asyncio.run(run())
+
+
+def test_inode_collision(monkeypatch):
+    class ConstantHash:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def digest(self):
+            return b"\x01" * 8
+
+    monkeypatch.setattr("swh.fuse.fuse.hashlib.blake2b", ConstantHash)
+    graph = FakeGraphBackend({DIR_SWHID: [], OTHER_DIR_SWHID: []})
+
+    async def run():
+        async with fuse_instance(graph) as fs:
+            archive = (await fs.lookup(ROOT, b"archive", CTX)).st_ino
+            first = await fs.lookup(archive, str(DIR_SWHID).encode(), CTX)
+            second = await fs.lookup(archive, str(OTHER_DIR_SWHID).encode(), CTX)
+            assert first.st_ino & Fuse.KEYED_INODE_BIT
+            # the second key hashes to the same inode: it gets a counter one
+            assert not second.st_ino & Fuse.KEYED_INODE_BIT
+            assert fs.inode2entry(first.st_ino).swhid == DIR_SWHID
+            assert fs.inode2entry(second.st_ino).swhid == OTHER_DIR_SWHID
+
+    asyncio.run(run())
+
+
+def test_concurrent_fetches_coalesced():
+    # slow enough for all callers to miss the cache before the fetch lands
+    graph = FakeGraphBackend({DIR_SWHID: []}, delay=0.1)
+
+    async def run():
+        async with fuse_instance(graph) as fs:
+            listings = await asyncio.gather(
+                *(fs.get_metadata(DIR_SWHID) for _ in range(3))
+            )
+            assert listings == [[], [], []]
+            assert graph.calls == [DIR_SWHID]
+
+    asyncio.run(run())
+
+
+def test_cancelled_caller_does_not_cancel_fetch():
+    async def run():
+        started = asyncio.Event()
+        released = asyncio.Event()
+        calls = []
+
+        async def fetch():
+            calls.append(None)
+            started.set()
+            await released.wait()
+            return b"content"
+
+        async with fuse_instance() as fs:
+            first = asyncio.create_task(fs._single_flight("blob", CNT_SWHID, fetch))
+            await started.wait()
+            second = asyncio.create_task(fs._single_flight("blob", CNT_SWHID, fetch))
+            await asyncio.sleep(0)
+            # the caller which started the fetch goes away
+            first.cancel()
+            released.set()
+            assert await second == b"content"
+            assert first.cancelled()
+            assert len(calls) == 1
+            assert not fs._in_flight
+
+    asyncio.run(run())
+
+
+def test_lookup_missing_name():
+    graph = FakeGraphBackend({DIR_SWHID: []})
+
+    async def run():
+        async with fuse_instance(graph) as fs:
+            # archived objects never appear: the kernel may cache the answer
+            archive = (await fs.lookup(ROOT, b"archive", CTX)).st_ino
+            directory = (await fs.lookup(archive, str(DIR_SWHID).encode(), CTX)).st_ino
+            attrs = await fs.lookup(directory, b"missing", CTX)
+            assert attrs.st_ino == 0
+            assert attrs.entry_timeout == fs.kernel_cache["archive"].negative_timeout
+            assert 0 not in fs._inode2entry
+
+            # cached objects may appear at any time
+            cache = (await fs.lookup(ROOT, b"cache", CTX)).st_ino
+            with pytest.raises(pyfuse3.FUSEError) as exc_info:
+                await fs.lookup(cache, b"missing", CTX)
+            assert exc_info.value.errno == errno.ENOENT
+
+    asyncio.run(run())
+
+
+def test_prefetch_subtree():
+    subdir = {
+        "name": "src",
+        "type": "dir",
+        "target": OTHER_DIR_SWHID.object_id.hex(),
+        "perms": 0o040000,
+    }
+    third_dir = CoreSWHID.from_string("swh:1:dir:" + "4" * 40)
+
+    class PrefetchingGraphBackend(FakeGraphBackend):
+        async def get_subtree_metadata(self, swhid):
+            self.subtrees.append(swhid)
+            return {DIR_SWHID: [subdir], OTHER_DIR_SWHID: []}
+
+    graph = PrefetchingGraphBackend({third_dir: []})
+    graph.subtrees = []
+
+    async def run():
+        async with fuse_instance(graph) as fs:
+            archive = (await fs.lookup(ROOT, b"archive", CTX)).st_ino
+            await fs.lookup(archive, str(DIR_SWHID).encode(), CTX)
+            assert graph.subtrees == [DIR_SWHID]
+            assert graph.calls == []
+            # prefetched listings do not evict the objects in use from memory
+            assert swhid_key(DIR_SWHID) in fs.cache.metadata.lru
+            assert swhid_key(OTHER_DIR_SWHID) not in fs.cache.metadata.lru
+            assert await fs.get_metadata(OTHER_DIR_SWHID) == []
+            assert graph.calls == []
+
+            # directories which are not mounted are fetched alone
+            assert await fs.get_metadata(third_dir) == []
+            assert graph.subtrees == [DIR_SWHID]
+            assert graph.calls == [third_dir]
+
+    asyncio.run(run())
+
+
+def test_open_shares_buffers():
+    graph = FakeGraphBackend({CNT_SWHID: {"length": 7}})
+    content = FakeContentBackend({CNT_SWHID: b"content"})
+
+    async def run():
+        async with fuse_instance(graph, content) as fs:
+            archive = (await fs.lookup(ROOT, b"archive", CTX)).st_ino
+            inode = (await fs.lookup(archive, str(CNT_SWHID).encode(), CTX)).st_ino
+            handles = [await fs.open(inode, os.O_RDONLY, CTX) for _ in range(2)]
+            # file info only depends on the kernel cache policy
+            assert all(info.keep_cache for info in handles)
+            assert bytes(await fs.read(handles[0].fh, 2, 3)) == b"nte"
+            assert bytes(await fs.read(handles[1].fh, 0, 100)) == b"content"
+            assert content.calls == [CNT_SWHID]
+
+            await fs.release(handles[0].fh)
+            assert fs._open_files
+            await fs.release(handles[1].fh)
+            assert not fs._open_files
+
+    asyncio.run(run())
+
+
+def test_memory_accounting():
+    file = {
+        "dir_id": DIR_SWHID.object_id.hex(),
+        "name": "README",
+        "type": "file",
+        "target": CNT_SWHID.object_id.hex(),
+        "perms": 0o100644,
+        "length": 7,
+    }
+    graph = FakeGraphBackend({DIR_SWHID: [file], CNT_SWHID: {"length": 7}})
+    content = FakeContentBackend({CNT_SWHID: b"content"})
+
+    def expected_ram(fs: Fuse) -> int:
+        # cached listings, then the inode table (but its root) with its entries
+        return fs.cache.direntry.lru_cache.used_ram + sum(
+            fs.INODE_TABLE_ITEM_SIZE + entry.sizeof()
+            for inode, entry in fs._inode2entry.items()
+            if inode != ROOT
+        )
+
+    async def run():
+        async with fuse_instance(graph, content) as fs:
+            direntry = fs.cache.direntry
+            archive = (await fs.lookup(ROOT, b"archive", CTX)).st_ino
+            directory = (await fs.lookup(archive, str(DIR_SWHID).encode(), CTX)).st_ino
+            await fs.inode2entry(directory).get_listing()
+            used = direntry.used_ram
+            inode = (await fs.lookup(directory, b"README", CTX)).st_ino
+            await fs.lookup(directory, b"README", CTX)
+            # each entry is counted once, by the inode table, even when it
+            # belongs to a cached listing
+            file_ram = fs.INODE_TABLE_ITEM_SIZE + fs.inode2entry(inode).sizeof()
+            assert direntry.used_ram == used + file_ram
+            used = direntry.used_ram
+            assert used == expected_ram(fs)
+
+            # in-memory contents are charged while the file is open
+            info = await fs.open(inode, os.O_RDONLY, CTX)
+            assert direntry.used_ram == used
+            await fs.read(info.fh, 0, 100)
+            assert direntry.used_ram == used + len(b"content")
+            await fs.release(info.fh)
+            assert direntry.used_ram == used
+
+            await fs.forget([(inode, 2)])
+            assert direntry.used_ram == expected_ram(fs) < used
+
+    asyncio.run(run())
+
+
+def test_snapshot_branches_are_charged(monkeypatch):
+    monkeypatch.setattr(Fuse, "SNAPSHOT_BRANCHES_CACHE_SIZE", 1)
+    graph = FakeGraphBackend(
+        {
+            swhid: {
+                f"refs/heads/branch{i}": {"target": "1" * 40, "target_type": "revision"}
+                for i in range(10 * (n + 1))
+            }
+            for n, swhid in enumerate(SNP_SWHIDS)
+        }
+    )
+
+    async def run():
+        async with fuse_instance(graph) as fs:
+            direntry = fs.cache.direntry
+            used = direntry.used_ram
+            first = await fs.get_snapshot_branches(SNP_SWHIDS[0])
+            assert direntry.used_ram == used + first.nbytes
+            assert await fs.get_snapshot_branches(SNP_SWHIDS[0]) is first
+            assert direntry.used_ram == used + first.nbytes
+            # the first snapshot's branches are released once evicted
+            second = await fs.get_snapshot_branches(SNP_SWHIDS[1])
+            assert direntry.used_ram == used + second.nbytes > used + first.nbytes
+
+    asyncio.run(run())
@@ -0,0 +1,183 @@
+# Copyright (C) 2025  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import asyncio
+import itertools
+
+from swh.fuse.backends import GraphBackend
+from swh.fuse.fs.artifact import (
+    RevisionHistoryShardByDate,
+    RevisionHistoryShardByHash,
+    RevisionHistoryShardByPage,
+)
+from swh.fuse.fs.entry import EntryMode
+from swh.fuse.history import UNKNOWN_DATE, HistoryGraph, HistoryGraphBuilder
+from swh.model.swhids import CoreSWHID
+
+
+def rev(prefix: str) -> str:
+    return "swh:1:rev:" + prefix.ljust(40, "0")
+
+
+ROOT = rev("f0")
+# a merge: both branches share an ancestor
+EDGES = [
+    (ROOT, rev("a1")),
+    (ROOT, rev("b1")),
+    (rev("a1"), rev("a2")),
+    (rev("b1"), rev("a2")),
+    (rev("a2"), rev("a3")),
+]
+DATES = {
+    ROOT: "2024-03-01T12:00:00+00:00",
+    rev("a1"): "2024-02-01T12:00:00+00:00",
+    rev("b1"): "2024-02-01T23:30:00-05:00",
+    rev("a2"): "2023-12-31T12:00:00+00:00",
+    rev("a3"): None,
+}
+
+
+def swhids(*revisions: str):
+    return [CoreSWHID.from_string(revision) for revision in revisions]
+
+
+def history_graph() -> HistoryGraph:
+    return HistoryGraph.from_edges(CoreSWHID.from_string(ROOT), EDGES, DATES)
+
+
+def test_merge_order():
+    history = history_graph().history()
+    # each revision comes before its parents, the root is left out
+    assert list(history) == swhids(rev("a1"), rev("b1"), rev("a2"), rev("a3"))
+    assert history[1:3] == swhids(rev("b1"), rev("a2"))
+
+
+def test_ancestors_of_any_revision():
+    graph = history_graph()
+    node = graph.node(CoreSWHID.from_string(rev("b1")))
+    assert node is not None
+    assert list(graph.history(node)) == swhids(rev("a2"), rev("a3"))
+    assert graph.node(CoreSWHID.from_string(rev("cc"))) is None
+
+
+def test_bytes_round_trip():
+    graph = history_graph()
+    loaded = HistoryGraph.from_bytes(graph.to_bytes())
+    assert len(loaded) == len(graph)
+    assert list(loaded.history()) == list(graph.history())
+    assert list(loaded.dates) == list(graph.dates)
+    # the SWHID index is rebuilt on first use
+    assert loaded.node(CoreSWHID.from_string(rev("a2"))) == graph.node(
+        CoreSWHID.from_string(rev("a2"))
+    )
+
+
+class EdgesBackend(GraphBackend):
+    """Back-end only returning the whole history at once"""
+
+    async def get_metadata(self, swhid, full=False):
+        raise NotImplementedError
+
+    async def get_history(self, swhid):
+        return EDGES, DATES
+
+    async def get_visits(self, url_encoded):
+        raise NotImplementedError
+
+
+def test_build_from_streamed_revisions():
+    async def build():
+        root = CoreSWHID.from_string(ROOT)
+        builder = HistoryGraphBuilder(root)
+        async for revision, parents, date in EdgesBackend().iter_history(root):
+            builder.add(revision, parents, date)
+        return builder.build()
+
+    graph = asyncio.run(build())
+    assert graph.to_bytes() == history_graph().to_bytes()
+    assert graph.node(CoreSWHID.from_string(rev("a3"))) is not None
+
+
+def test_empty_history():
+    graph = HistoryGraph.from_edges(CoreSWHID.from_string(ROOT), [], {})
+    history = HistoryGraph.from_bytes(graph.to_bytes()).history()
+    assert len(history) == 0
+    assert history.hash_buckets(2) == []
+    assert history.with_hash_prefix("f0") == []
+    assert history.date_children([]) == []
+    assert history.on_date(2024, 3, 1) == []
+
+
+def test_dates():
+    history = history_graph().history()
+    # dates are taken in their own time zone, unknown ones are set to 1970-01-01
+    assert history.date_children([]) == [1970, 2023, 2024]
+    assert history.date_children([2024]) == [2]
+    assert history.date_children([2024, 2]) == [1]
+    assert history.date_children([2025]) == []
+    assert history.on_date(2024, 2, 1) == swhids(rev("a1"), rev("b1"))
+    assert history.on_date(2023, 12, 31) == swhids(rev("a2"))
+    assert history.on_date(2024, 3, 1) == []
+    assert history.graph.dates[history.order[-1]] == UNKNOWN_DATE
+
+
+def test_hashes():
+    history = history_graph().history()
+    assert history.hash_buckets(1) == ["a", "b"]
+    assert history.hash_buckets(2) == ["a1", "a2", "a3", "b1"]
+    assert history.with_hash_prefix("a") == swhids(rev("a1"), rev("a2"), rev("a3"))
+    assert history.with_hash_prefix("a2") == swhids(rev("a2"))
+    assert history.with_hash_prefix("c") == []
+
+
+class FakeFuse:
+    """What history shards need from :py:class:`swh.fuse.fuse.Fuse`"""
+
+    def __init__(self, graph: HistoryGraph):
+        self.graph = graph
+        self.inodes = itertools.count(1)
+
+    def _alloc_inode(self, entry) -> int:
+        return next(self.inodes)
+
+    async def get_history(self, swhid: CoreSWHID):
+        return self.graph.history()
+
+
+def list_shard(cls, **kwargs):
+    shard = cls(
+        name="shard",
+        mode=int(EntryMode.RDONLY_DIR),
+        depth=4,
+        fuse=FakeFuse(history_graph()),
+        history_swhid=CoreSWHID.from_string(ROOT),
+        **kwargs,
+    )
+
+    async def names():
+        return [entry.name async for entry in shard.compute_entries()]
+
+    return asyncio.run(names())
+
+
+def test_shard_by_date():
+    assert list_shard(RevisionHistoryShardByDate) == ["1970", "2023", "2024"]
+    assert list_shard(RevisionHistoryShardByDate, prefix="2024/") == ["02"]
+    assert list_shard(RevisionHistoryShardByDate, prefix="2024/02/") == ["01"]
+    assert list_shard(RevisionHistoryShardByDate, prefix="2024/02/01/") == [
+        rev("a1"),
+        rev("b1"),
+    ]
+
+
+def test_shard_by_hash():
+    assert list_shard(RevisionHistoryShardByHash) == ["a1", "a2", "a3", "b1"]
+    assert list_shard(RevisionHistoryShardByHash, prefix="a2") == [rev("a2")]
+
+
+def test_shard_by_page(monkeypatch):
+    monkeypatch.setattr(RevisionHistoryShardByPage, "PAGE_SIZE", 3)
+    assert list_shard(RevisionHistoryShardByPage) == ["000", "001"]
+    assert list_shard(RevisionHistoryShardByPage, prefix=1) == [rev("a3")]
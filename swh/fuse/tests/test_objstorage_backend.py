@@ -0,0 +1,103 @@
+# Copyright (C) 2025  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""
+Tests of :py:class:`swh.fuse.backends.objstorage.ObjStorageBackend`, on top of
+in-memory storage and objstorage.
+"""
+
+import asyncio
+import threading
+import time
+from typing import List, Tuple
+
+from swh.fuse.backends.objstorage import ObjStorageBackend
+from swh.model.model import Content
+from swh.objstorage.interface import objid_from_dict
+
+CONTENT = Content.from_data(b"print('hello')\n")
+
+
+def content_backend(threads: int) -> ObjStorageBackend:
+    backend = ObjStorageBackend(
+        {
+            "content": {
+                "storage": {"cls": "memory", "journal_writer": {"cls": "memory"}},
+                "objstorage": {"cls": "memory"},
+                "threads": threads,
+            }
+        }
+    )
+    backend.storage.content_add([CONTENT])
+    assert backend.objstorage is not None and CONTENT.data is not None
+    backend.objstorage.add(CONTENT.data, objid_from_dict(CONTENT.hashes()))
+    return backend
+
+
+def slow_storage(monkeypatch, backend: ObjStorageBackend, threads: List[str]) -> None:
+    """Make storage lookups block for a while, and record their threads"""
+    content_get = backend.storage.content_get
+
+    def slow_content_get(*args, **kwargs):
+        threads.append(threading.current_thread().name)
+        time.sleep(0.1)
+        return content_get(*args, **kwargs)
+
+    monkeypatch.setattr(backend.storage, "content_get", slow_content_get)
+
+
+def test_blocking_calls_do_not_block_the_event_loop(monkeypatch):
+    backend = content_backend(threads=2)
+    threads: List[str] = []
+    slow_storage(monkeypatch, backend, threads)
+
+    async def run():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.create_task(tick())
+        blob = await backend.get_blob(CONTENT.swhid())
+        ticker.cancel()
+        await backend.shutdown()
+        return blob, ticks
+
+    blob, ticks = asyncio.run(run())
+    assert blob == CONTENT.data
+    # the event loop kept running other tasks during the storage lookup
+    assert ticks >= 5
+    assert threads and all(name.startswith("swhfuse-content") for name in threads)
+
+
+def test_queue_depth_gauges(monkeypatch):
+    backend = content_backend(threads=1)
+    slow_storage(monkeypatch, backend, [])
+    gauges: List[Tuple[str, int]] = []
+    monkeypatch.setattr(
+        backend.statsd,
+        "gauge",
+        lambda metric, value, *args, **kwargs: gauges.append((metric, value)),
+    )
+
+    async def run():
+        blobs = await asyncio.gather(
+            *(backend.get_blob(CONTENT.swhid()) for _ in range(2))
+        )
+        await backend.shutdown()
+        return blobs
+
+    assert asyncio.run(run()) == [CONTENT.data] * 2
+    storage = [value for metric, value in gauges if "_storage_" in metric]
+    objstorage = [value for metric, value in gauges if "_objstorage_" in metric]
+    # both lookups were queued for the single thread at once
+    assert max(storage) == 2
+    assert storage[-1] == 0
+    assert max(objstorage) >= 1
+    assert objstorage[-1] == 0
+    assert backend.queue_depth == {"storage": 0, "objstorage": 0}
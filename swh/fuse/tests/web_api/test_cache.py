@@ -3,8 +3,12 @@
 # License: GNU General Public License version 3, or any later version
 # See top-level LICENSE file for more information
 
+import asyncio
+import json
 import os
+import sqlite3
 
+from swh.fuse.cache import MetadataCache
 from swh.model.hashutil import hash_to_hex
 from swh.model.swhids import CoreSWHID
 
@@ -28,3 +32,32 @@ def test_cache_artifact(fuse_mntdir):
     os.unlink(fuse_mntdir / "cache" / hash_to_hex(swhid.object_id)[:2] / str(swhid))
 
     assert os.listdir(fuse_mntdir / "cache") == DEFAULT_CACHE_CONTENT
+
+
+def test_cache_migration(tmp_path):
+    # version 1 tables were keyed by SWHIDs as text
+    path = str(tmp_path / "metadata.sqlite")
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "create table metadata_cache "
+            "(swhid text not null primary key, metadata blob, date text)"
+        )
+        conn.execute(
+            "insert into metadata_cache values (?, ?, '')",
+            (REGULAR_FILE, json.dumps({"length": 42})),
+        )
+    conn.close()
+
+    async def get_metadata():
+        cache = await MetadataCache({"path": path}).__aenter__()
+        try:
+            return await cache.get(CoreSWHID.from_string(REGULAR_FILE), typify=False)
+        finally:
+            await cache.__aexit__()
+
+    assert asyncio.run(get_metadata()) == {"length": 42}
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("select * from schema_version").fetchall() == [
+            ("metadata", MetadataCache.SCHEMA_VERSION)
+        ]
+    conn.close()
@@ -16,3 +16,21 @@ def test_cat_file(fuse_mntdir):
     file_path = fuse_mntdir / "archive" / REGULAR_FILE
     expected = get_data_from_web_archive(REGULAR_FILE, raw=True)
     assert file_path.read_text() == expected
+
+
+def test_read_file_by_chunks(fuse_mntdir):
+    file_path = fuse_mntdir / "archive" / REGULAR_FILE
+    expected = get_data_from_web_archive(REGULAR_FILE, raw=True).encode()
+
+    # Two concurrent handles on the same content share one buffer
+    with (
+        open(file_path, "rb", buffering=0) as f1,
+        open(file_path, "rb", buffering=0) as f2,
+    ):
+        chunks = []
+        while chunk := f1.read(7):
+            chunks.append(chunk)
+        assert b"".join(chunks) == expected
+
+        f2.seek(len(expected) // 2)
+        assert f2.read() == expected[len(expected) // 2 :]